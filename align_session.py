@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+
+from loguru import logger
+
+from libs.alignment import alignment_stats, build_index, load_streams, save_index, session_files
+
+
+def parse_device_offsets(values):
+    offsets = {}
+    for value in values or []:
+        host, _, offset = value.rpartition("=")
+        offsets[host] = int(offset)
+    return offsets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Align the frames of all devices in a recorded session.")
+    parser.add_argument("directory", help="Directory holding the session's recordings")
+    parser.add_argument("session", help="Session name, files are {session}-r{round}-{host}-Device{i}.mkv")
+    parser.add_argument(
+        "--round", type=int, default=None, help="Round to align (default: the latest round of every host)"
+    )
+    parser.add_argument("--track", type=str, default="DEPTH", help="Track whose frames are aligned")
+    parser.add_argument("--sync_delay", type=int, default=160, help="Sync delay in microseconds, as in slave.py")
+    parser.add_argument(
+        "--device_offset",
+        action="append",
+        metavar="HOST=N",
+        help="--device_offset each slave was started with (repeatable, default 0)",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Match window in frame periods")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel processes (default: all cores)")
+    parser.add_argument(
+        "--output", type=str, default=None, help="Index path prefix (default: <directory>/<session>.align)"
+    )
+    args = parser.parse_args()
+
+    files = session_files(args.directory, args.session, args.round)
+    if not files:
+        logger.error(f"No recordings of session [{args.session}] in {args.directory}")
+        sys.exit(1)
+
+    streams = load_streams(
+        files, args.sync_delay, parse_device_offsets(args.device_offset), args.track, args.workers
+    )
+    for stream in streams:
+        for issue in stream.issues:
+            logger.warning(f"{stream.label}: {issue}")
+    index = build_index(streams, args.tolerance)
+    stats = alignment_stats(index, streams)
+
+    def us(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    logger.info(f"{len(index)} capture instants across {len(streams)} devices, reference {streams[0].label}")
+    for row in stats:
+        drift = "-" if row.drift_ppm is None else f"{row.drift_ppm:.3f}"
+        logger.info(
+            f"{row.label}: {row.frames} frames, {row.matched} matched, {row.missing} missing, "
+            f"offset {us(row.mean_offset_us)} us (expected {row.expected_offset_us:.1f}, "
+            f"error {us(row.offset_error_us)}, jitter {us(row.jitter_us)}, max {us(row.max_error_us)}), "
+            f"drift {drift} ppm"
+        )
+
+    prefix = args.output or os.path.join(args.directory, f"{args.session}.align")
+    index_path, meta_path = save_index(prefix, index, streams, stats)
+    logger.info(f"Wrote {index_path} and {meta_path}")
@@ -0,0 +1,460 @@
+"""End-to-end latency of the sync protocol on one machine.
+
+Run from the repository root::
+
+    python -m benchmarks.sync_bench --slaves 4 --cycles 20 --output bench.json
+
+Starts ``--slaves`` slave.py processes with the simulated recorder (see
+:mod:`libs.recorder`) on localhost, all listening on the same multicast
+port like hosts of a rig, and drives them with a :class:`MasterControl`.
+After a burst of pings, every cycle arms the rig (START, or PREPARE and GO
+with ``--mode prepare``), lets it record for ``--hold`` seconds and stops
+it. Measured per cycle, in milliseconds on the master clock:
+
+- ``ping_fanout``: a ping's one-way delay to each slave (slave receive
+  time converted with the clock estimate), and ``ping_spread``, the
+  spread of the receive times across slaves.
+- ``start_ack`` / ``stop_ack``: first send of the reliable command until
+  each slave's ACK.
+- ``arm``: START (or PREPARE) sent until each slave reported all its
+  devices armed, and ``device_arm``, spawn to armed per recorder as the
+  slaves report it.
+- ``arm_spread``: spread of the slaves' armed reports within a cycle.
+  With ``--scheduled`` it is ``start_skew``, the spread of every slave's
+  own armed-versus-target error, which is how tightly the hosts are
+  aligned. Each slave also reports the bound it expected from its arm
+  time estimate; cycles record how many slaves exceeded it.
+- ``go`` (prepare mode): GO sent until each slave's reply.
+- ``stop``: STOP sent until each slave's reply, and ``stop_reported``
+  until the last recording of the session was reported finished.
+
+On one host every slave shares the loopback link and its multicast
+delivery, which is neither lossy nor delayed like a network. ``--netns``
+(Linux, root) gives every slave its own network namespace, and the
+master one too. The namespaces are joined by a bridge, so each slave has
+its own link-local address like a separate host. ``--netem "delay 1ms
+0.2ms loss 1%"`` shapes every namespace's link.
+
+Samples, a percentile summary of every metric and the run's settings are
+saved as JSON. ``--compare baseline.json`` prints the change of every
+metric against an earlier run and exits with 1 when a median or p99 grew
+by more than ``--tolerance``. ``--trace trace.json`` saves the last
+cycle's timeline of the master and every slave (see :mod:`libs.trace`).
+"""
+import argparse
+import ctypes
+import json
+import os
+import platform
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from libs.clocksync import now_ns
+from libs.controlplane import DEFAULT_MULTICAST_GROUP, MasterControl
+from libs.protocol import REPLY_RECORDED
+from libs.trace import save_trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRICS = (
+    "ping_fanout",
+    "ping_spread",
+    "start_ack",
+    "arm",
+    "device_arm",
+    "arm_spread",
+    "start_skew",
+    "go",
+    "stop_ack",
+    "stop",
+    "stop_reported",
+)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    return {
+        "count": len(ordered),
+        "min": round(ordered[0], 3),
+        "mean": round(statistics.fmean(ordered), 3),
+        "p50": round(percentile(50), 3),
+        "p90": round(percentile(90), 3),
+        "p99": round(percentile(99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def spread(values) -> Optional[float]:
+    values = list(values)
+    return max(values) - min(values) if len(values) > 1 else None
+
+
+class Namespaces:
+    """A master and ``count`` slave network namespaces on one bridge, created with iproute2."""
+
+    def __init__(self, count: int, prefix: str = "syncb", netem: Optional[str] = None):
+        self.names = [f"{prefix}m"] + [f"{prefix}{i}" for i in range(count)]
+        self.bridge = f"{prefix}br"
+        self.netem = netem
+        self._home: Optional[int] = None  # 原网络命名空间的 fd
+
+    @staticmethod
+    def _run(*command: str) -> None:
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(command)}: {result.stderr.strip()}")
+
+    def _ip(self, *arguments: str) -> None:
+        self._run("ip", *arguments)
+
+    def setup(self) -> None:
+        self._ip("link", "add", "name", self.bridge, "type", "bridge", "mcast_snooping", "0")
+        self._ip("link", "set", self.bridge, "up")
+        for index, name in enumerate(self.names):
+            self._ip("netns", "add", name)
+            # 关闭重复地址检测，链路本地地址立即可用
+            self._ip("netns", "exec", name, "sysctl", "-qw", "net.ipv6.conf.default.accept_dad=0")
+            host_side = f"{self.bridge}{index}"
+            self._ip("link", "add", host_side, "type", "veth", "peer", "name", "eth0", "netns", name)
+            self._ip("link", "set", host_side, "master", self.bridge, "up")
+            self._ip("-n", name, "link", "set", "lo", "up")
+            self._ip("-n", name, "link", "set", "eth0", "up")
+            if self.netem:
+                self._run("tc", "-n", name, "qdisc", "add", "dev", "eth0", "root", "netem", *self.netem.split())
+
+    def enter_master(self) -> None:
+        """Move the calling thread, and the threads it starts later, into the master namespace."""
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._home = os.open("/proc/self/ns/net", os.O_RDONLY)
+        fd = os.open(f"/run/netns/{self.names[0]}", os.O_RDONLY)
+        try:
+            if libc.setns(fd, 0x40000000) != 0:  # CLONE_NEWNET
+                raise OSError(ctypes.get_errno(), "setns failed")
+        finally:
+            os.close(fd)
+
+    def wrap(self, slave: int, command: List[str]) -> List[str]:
+        return ["ip", "netns", "exec", self.names[slave + 1], *command]
+
+    def teardown(self) -> None:
+        if self._home is not None:
+            ctypes.CDLL(None, use_errno=True).setns(self._home, 0x40000000)
+            os.close(self._home)
+            self._home = None
+        for name in self.names:
+            subprocess.run(["ip", "netns", "del", name], capture_output=True)
+        subprocess.run(["ip", "link", "del", self.bridge], capture_output=True)
+
+
+class Rig:
+    """Slave processes with simulated recorders, and the master driving them."""
+
+    def __init__(self, args: argparse.Namespace, work_dir: str, namespaces: Optional[Namespaces] = None):
+        self.args = args
+        self.work_dir = work_dir
+        self.namespaces = namespaces
+        self.slaves: List[subprocess.Popen] = []
+        self.recorded: Dict[str, List[int]] = defaultdict(list)  # 会话 -> RECORDED 报告的到达时刻
+        self.recorded_event = threading.Event()
+        self.master = MasterControl(args.multicast_group, args.port, args.reply_port, on_reply=self.on_reply)
+
+    def on_reply(self, reply) -> None:
+        if reply.msg_type != REPLY_RECORDED:
+            return
+        try:
+            session = json.loads(reply.msg_text)["session"]
+        except (ValueError, KeyError, TypeError):
+            return
+        self.recorded[session].append(reply.received)
+        self.recorded_event.set()
+
+    def start(self) -> None:
+        args = self.args
+        self.master.start()
+        self.master.start_clock_sync(0.2)
+        for i in range(args.slaves):
+            save_path = os.path.join(self.work_dir, f"slave{i}")
+            os.makedirs(save_path, exist_ok=True)
+            command = [
+                sys.executable, os.path.join(ROOT, "slave.py"),
+                "--multicast_group", args.multicast_group,
+                "--port", str(args.port),
+                "--reply_port", str(args.reply_port),
+                "--save_path", save_path,
+                "--device_num", str(args.devices),
+                "--device_offset", str(i * args.devices),
+                "--recorder", "sim",
+                "--sim_startup", str(args.sim_startup),
+                "--sim_bitrate", str(args.sim_bitrate),
+                "--sample_interval", "0",
+            ]
+            if self.namespaces is not None:
+                command = self.namespaces.wrap(i, command)
+            log = open(os.path.join(self.work_dir, f"slave{i}.log"), "w")
+            self.slaves.append(subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=self.work_dir))
+        deadline = time.monotonic() + args.join_timeout
+        while len(self.master.members.members) < args.slaves:
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    f"Only {len(self.master.members.members)} of {args.slaves} slaves joined, see {self.work_dir}"
+                )
+            self.master.discover(0.5).result()
+        # 等待时钟估计收敛
+        time.sleep(2.0)
+
+    def close(self) -> None:
+        self.master.close()
+        for slave in self.slaves:
+            if slave.poll() is None:
+                slave.send_signal(signal.SIGINT)
+        for slave in self.slaves:
+            try:
+                slave.wait(5)
+            except subprocess.TimeoutExpired:
+                slave.kill()
+
+    def ping(self, samples: Dict[str, List[float]]) -> None:
+        master = self.master
+        for _ in range(self.args.pings):
+            replies = master.send_ping(expected=self.args.slaves).result()
+            received = []
+            for peer, reply in replies.items():
+                estimate = master.clock.get(peer)
+                if estimate is None or reply.stamps is None:
+                    continue
+                t0, t1, _ = reply.stamps
+                received.append(estimate.to_master(t1))
+                samples["ping_fanout"].append((received[-1] - t0) / 1e6)
+            if spread(received) is not None:
+                samples["ping_spread"].append(spread(received) / 1e6)
+            time.sleep(0.02)
+
+    def ack_ms(self, expected: int, timeout: float = 1.0) -> List[float]:
+        # ACK 耗时在重发循环结束后才写入 SlaveState
+        deadline = time.monotonic() + timeout
+        while True:
+            acks = [s.ack_ms for s in list(self.master.slaves.values()) if s.ack_ms is not None]
+            if len(acks) >= expected or time.monotonic() > deadline:
+                return acks
+            time.sleep(0.01)
+
+    def cycle(self, index: int, samples: Dict[str, List[float]]) -> Dict:
+        args, master = self.args, self.master
+        session = f"bench{index}"
+        expected = args.slaves
+        record = {"session": session}
+        for state in master.slaves.values():
+            state.ack_ms = None
+
+        sent = now_ns()
+        if args.mode == "prepare":
+            barrier = master.prepare(session, args.record_time, expected=expected).result()
+            replies = barrier.replies
+            record["armed"] = barrier.armed
+        else:
+            target = master.plan_start() if args.scheduled else 0
+            sent = now_ns()
+            replies = master.send_start(session, args.record_time, target, expected=expected).result()
+            record["armed"] = len(replies) == expected and all(r.status == 0 for r in replies.values())
+        arm = [(r.received - sent) / 1e6 for r in replies.values()]
+        samples["arm"] += arm
+        record["arm_ms"] = max(arm, default=None)
+        if spread(r.received for r in replies.values()) is not None:
+            samples["arm_spread"].append(spread(r.received for r in replies.values()) / 1e6)
+        skews = []
+        exceeded = 0
+        for reply in replies.values():
+            try:
+                report = json.loads(reply.msg_text)
+            except ValueError:
+                continue
+            samples["device_arm"] += [ms for ms in report.get("arm_ms", {}).values() if ms is not None]
+            if "skew_ms" in report:
+                skews.append(report["skew_ms"])
+                bound = report.get("skew_bound_ms")
+                if bound is not None and abs(report["skew_ms"]) > bound:
+                    exceeded += 1
+                    logger.warning(f"[{session}] {reply.peer} skew {report['skew_ms']} ms exceeds ±{bound} ms")
+        if args.scheduled:
+            # 未完成时钟同步的 slave 立即启动，不报告 skew_ms
+            record["on_schedule"] = len(skews)
+            record["skew_exceeded"] = exceeded
+        if spread(skews) is not None:
+            samples["start_skew"].append(spread(skews))
+        samples["start_ack"] += self.ack_ms(expected)
+
+        if args.mode == "prepare" and record["armed"]:
+            go = master.go(expected=expected).result()
+            samples["go"] += [(r.received - go.go_ns) / 1e6 for r in go.replies.values()]
+
+        time.sleep(args.hold)
+        for state in master.slaves.values():
+            state.ack_ms = None
+        self.recorded_event.clear()
+        sent = now_ns()
+        replies = master.send_stop(expected=expected).result()
+        stop = [(r.received - sent) / 1e6 for r in replies.values()]
+        samples["stop"] += stop
+        record["stop_ms"] = max(stop, default=None)
+
+        # 每个录像进程退出后 slave 各报告一次
+        files = expected * args.devices
+        deadline = time.monotonic() + args.report_timeout
+        while len(self.recorded[session]) < files and time.monotonic() < deadline:
+            self.recorded_event.wait(0.1)
+            self.recorded_event.clear()
+        if len(self.recorded[session]) >= files:
+            samples["stop_reported"].append((max(self.recorded[session]) - sent) / 1e6)
+        else:
+            logger.warning(f"[{session}] only {len(self.recorded[session])} of {files} recordings reported")
+        samples["stop_ack"] += self.ack_ms(expected)
+        record["reported"] = len(self.recorded[session])
+        return record
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(summary: Dict, baseline_path: str, tolerance: float) -> bool:
+    """Print the change against a baseline run; returns True when something regressed."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["summary"]
+    regressed = False
+    print(f"\nAgainst {baseline_path}:")
+    print(f"{'metric':<14} {'p50_ms':>9} {'base':>9} {'change':>8} {'p99_ms':>9} {'base':>9} {'change':>8}")
+    for metric in METRICS:
+        now, base = summary.get(metric, {}), baseline.get(metric, {})
+        if not now.get("count") or not base.get("count"):
+            continue
+        row = f"{metric:<14}"
+        for key in ("p50", "p99"):
+            change = (now[key] - base[key]) / base[key] if base[key] else 0.0
+            worse = change > tolerance
+            regressed |= worse
+            row += f" {now[key]:>9.3f} {base[key]:>9.3f} {change:>+7.0%}{'!' if worse else ' '}"
+        print(row)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync protocol start/stop latency benchmark")
+    parser.add_argument("--slaves", type=int, default=3)
+    parser.add_argument("--devices", type=int, default=2, help="Simulated devices per slave")
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--pings", type=int, default=50)
+    parser.add_argument("--mode", choices=["start", "prepare"], default="start")
+    parser.add_argument("--scheduled", action="store_true", help="Schedule starts at a planned time (start mode)")
+    parser.add_argument("--record_time", type=int, default=60, help="Recording length; STOP ends it earlier")
+    parser.add_argument("--hold", type=float, default=1.0, help="Seconds to record before STOP")
+    parser.add_argument("--sim_startup", type=float, default=1.0)
+    parser.add_argument("--sim_bitrate", type=float, default=1.0, help="MB/s written per simulated device")
+    parser.add_argument("--multicast_group", default=DEFAULT_MULTICAST_GROUP)
+    parser.add_argument("--port", type=int, default=24329, help="Kept apart from a real rig's ports")
+    parser.add_argument("--reply_port", type=int, default=24328)
+    parser.add_argument("--netns", action="store_true", help="One network namespace per slave (Linux, root)")
+    parser.add_argument("--netem", default=None, help="tc netem options for every namespace's link")
+    parser.add_argument("--join_timeout", type=float, default=20.0)
+    parser.add_argument("--report_timeout", type=float, default=10.0)
+    parser.add_argument("--work_dir", default=None, help="Recordings and slave logs (default: a temporary dir)")
+    parser.add_argument("--output", default=None, help="Save samples and summary as JSON")
+    parser.add_argument("--trace", default=None, help="Save the last cycle's rig timeline as a Chrome trace")
+    parser.add_argument("--compare", default=None, help="Baseline JSON of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative growth of p50/p99")
+    parser.add_argument("--log_level", default="WARNING")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="sync_bench_")
+    samples: Dict[str, List[float]] = {metric: [] for metric in METRICS}
+    cycles = []
+    namespaces = Namespaces(args.slaves, netem=args.netem) if args.netns else None
+    rig = None
+    ingest = {}
+    started = time.time()
+    try:
+        if namespaces is not None:
+            namespaces.setup()
+            namespaces.enter_master()
+        rig = Rig(args, work_dir, namespaces)
+        rig.start()
+        rig.ping(samples)
+        for index in range(args.cycles):
+            record = rig.cycle(index, samples)
+            cycles.append(record)
+            print(
+                f"cycle {index:>3}: armed={record['armed']} arm {record['arm_ms'] or 0:8.1f} ms, "
+                f"stop {record['stop_ms'] or 0:6.1f} ms, {record['reported']} recordings reported"
+            )
+            time.sleep(0.5)
+        if args.trace and cycles:
+            # 时间线在 RECORDED 之后上报，上面的等待已足够
+            save_trace(rig.master.trace(), args.trace)
+            print(f"Trace of the last cycle saved to {args.trace}")
+    finally:
+        if rig is not None:
+            ingest = rig.master.ingest_stats()  # 回复路径的丢包与排队情况
+            rig.close()
+        if namespaces is not None:
+            namespaces.teardown()
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = {metric: summarize(values) for metric, values in samples.items()}
+    print(f"\n{'metric':<14} {'count':>6} {'min':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)")
+    for metric, s in summary.items():
+        if s["count"]:
+            print(
+                f"{metric:<14} {s['count']:>6} {s['min']:>9.3f} {s['p50']:>9.3f} "
+                f"{s['p90']:>9.3f} {s['p99']:>9.3f} {s['max']:>9.3f}"
+            )
+    result = {
+        "meta": {
+            "revision": git_revision(),
+            "started": started,
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "settings": vars(args),
+        },
+        "summary": summary,
+        "ingest": ingest,
+        "samples": samples,
+        "cycles": cycles,
+    }
+    if ingest:
+        print(
+            f"\nreplies: {ingest['received']} received, {ingest['rejected']} malformed, "
+            f"kernel drops {ingest['kernel_drops']}, queue peak {ingest['queue_peak']}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved to {args.output}")
+    if args.compare and compare(summary, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Compare the precise timer against the old pure busy-wait.
+
+Run from the repository root::
+
+    python -m benchmarks.timer_bench --iterations 200
+
+For every wait length it reports the wake-up error and the CPU time the
+waiting thread consumed, first on an otherwise idle process and then with a
+CPU-bound second Python thread, whose throughput shows how much the waiter
+starves the rest of the process (a busy-wait holding the GIL does). Under
+contention both waits also pay up to one GIL switch interval (5 ms) to get
+the interpreter back after waking.
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from libs.timer import PreciseTimer
+
+
+def legacy_busy_wait_ms(milliseconds):
+    # 旧版 processutils.busy_wait_ms 的实现，作为对照
+    target_duration = milliseconds / 1000.0
+    start_time = time.perf_counter()
+    while (time.perf_counter() - start_time) < target_duration:
+        pass
+
+
+class Background(threading.Thread):
+    """Counts loop iterations to measure how much the waiter starves other threads."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.count = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.count += 1
+
+
+def measure(wait, milliseconds, iterations, contended):
+    errors = []
+    background = Background()
+    if contended:
+        background.start()
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        wait(milliseconds)
+        errors.append(time.perf_counter_ns() - start - int(milliseconds * 1e6))
+    wall = time.perf_counter() - wall_start
+    cpu = time.thread_time() - cpu_start
+    if contended:
+        background.running = False
+        background.join()
+    errors.sort()
+    return {
+        "mean_us": statistics.fmean(errors) / 1e3,
+        "p99_us": errors[min(len(errors) - 1, int(len(errors) * 0.99))] / 1e3,
+        "max_us": errors[-1] / 1e3,
+        "cpu_pct": cpu / wall * 100,
+        "background_mops": background.count / wall / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precise timer micro-benchmark")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--waits", type=float, nargs="+", default=[0.5, 1, 2, 5, 10])
+    parser.add_argument("--spin_us", type=float, default=None, help="Spin slice of the precise timer")
+    args = parser.parse_args()
+
+    timer = PreciseTimer() if args.spin_us is None else PreciseTimer(int(args.spin_us * 1000))
+    candidates = {"busy_wait": legacy_busy_wait_ms, "precise": timer.sleep_ms}
+
+    print(
+        f"{'impl':<10} {'contended':>9} {'wait_ms':>8} {'mean_us':>9} {'p99_us':>9} "
+        f"{'max_us':>9} {'cpu_%':>7} {'bg_Mops/s':>10}"
+    )
+    for contended in (False, True):
+        for milliseconds in args.waits:
+            for name, wait in candidates.items():
+                r = measure(wait, milliseconds, args.iterations, contended)
+                print(
+                    f"{name:<10} {str(contended):>9} {milliseconds:>8} {r['mean_us']:>9.1f} "
+                    f"{r['p99_us']:>9.1f} {r['max_us']:>9.1f} {r['cpu_pct']:>7.1f} "
+                    f"{r['background_mops']:>10.2f}"
+                )
+    print(f"precise timer wake-up error: {timer.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import os
+import threading
+
+from loguru import logger
+
+from libs.transfer import DEFAULT_TRANSFER_PORT, CollectorServer
+
+
+def log_host_table(server: CollectorServer):
+    for host, files, megabytes, throughput, retries in server.table():
+        logger.info(
+            f"{host}: {files} file(s), {megabytes:.1f} MB at {throughput:.1f} MB/s, {retries} retried chunk(s)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collection node receiving recordings from slaves.")
+    parser.add_argument("--host", type=str, default="", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_TRANSFER_PORT, help="Port to listen on")
+    parser.add_argument(
+        "--save_path", type=str, default="./Collected", help="Root path, one sub directory per slave"
+    )
+    parser.add_argument(
+        "--report_interval", type=float, default=30, help="Seconds between throughput reports"
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.save_path, exist_ok=True)
+    server = CollectorServer(args.save_path, args.host, args.port)
+    logger.info(f"Collecting recordings into {os.path.abspath(args.save_path)} on port {args.port}")
+
+    # 定期打印每台主机的传输速率
+    stopped = threading.Event()
+
+    def report():
+        while not stopped.wait(args.report_interval):
+            log_host_table(server)
+
+    threading.Thread(target=report, daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        log_host_table(server)
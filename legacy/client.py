@@ -5,8 +5,10 @@ import subprocess
 import re
 import argparse
 from loguru import logger
-from typing import List
+from typing import List, Tuple
 from libs import processutils
+from libs.catalog import STATUS_COMPLETE, STATUS_FAILED, STATUS_STOPPED, SessionCatalog
+from libs.recorder import RECORDERS, RecorderBackend, RecordingSpec, create_recorder
 
 
 def setup_arguments() -> argparse.Namespace:
@@ -27,6 +29,9 @@ def setup_arguments() -> argparse.Namespace:
         default="C:\\Program Files\\Azure Kinect SDK v1.4.2\\tools",
         help="recorder path",
     )
+    parser.add_argument(
+        "--recorder", type=str, default="k4a", choices=list(RECORDERS), help="recorder backend"
+    )
     parser.add_argument(
         "--save_path", type=str, default="C:\\0_goatdata", help="save root path"
     )
@@ -51,53 +56,62 @@ def run_recorder(
     delay: int,
     record_time: int,
     save_file_name: str,
-    recorder_path: str,
+    recorder: RecorderBackend,
     process_list: List[subprocess.Popen],
-) -> None:
-    """Helper function to run the k4arecorder with specified parameters."""
-    command: str = (
-        f"k4arecorder.exe --device {device_id} --external-sync {sync_type} "
-        f'--sync-delay {delay} -d WFOV_2X2BINNED -c 1080p -r 30 -l {record_time} "{save_file_name}"'
-    )
-    process: subprocess.Popen = subprocess.Popen(
-        command,
-        shell=True,
-        cwd=recorder_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    
-    logger.debug(f"$ {command}")
+) -> subprocess.Popen:
+    """Helper function to run the recorder with specified parameters."""
+    spec = RecordingSpec(device_id, save_file_name, record_time, sync_type, delay)
+    process: subprocess.Popen = recorder.spawn(spec, new_session=False)
+
+    logger.debug(f"$ {recorder.command(spec)}")
     processutils.set_high_priority(process.pid)
     process_list.append(process)
     logger.info(f"Started recording on device {device_id}, saving to {save_file_name}")
+    return process
+
+
+def finish_recordings(
+    catalog: SessionCatalog,
+    recordings: List[Tuple[subprocess.Popen, str]],
+    error_status: str = STATUS_FAILED,
+) -> None:
+    """Record exited recorders in the catalog and drop them from the list."""
+    for process, save_file_name in list(recordings):
+        if process.poll() is not None:
+            status = STATUS_COMPLETE if process.returncode == 0 else error_status
+            catalog.finish_file(save_file_name, status)
+            recordings.remove((process, save_file_name))
 
 
 def record_video(
     id: str,
     save_path: str,
     record_time: int,
-    recorder_path: str,
+    recorder: RecorderBackend,
     process_list: List[subprocess.Popen],
     device_offset,
     device_num,
     sync_delay,
+    catalog: SessionCatalog,
+    recordings: List[Tuple[subprocess.Popen, str]],
 ) -> str:
     """Handles video recording setup for multiple devices."""
-    current_round: int = len(os.listdir(save_path)) // 2 + 1
+    finish_recordings(catalog, recordings)
+    current_round: int = catalog.allocate_round(id, record_time, device_num)
 
     for i in range(device_num):
         save_file_name: str = os.path.join(save_path, f"sheep_{current_round}_{id}_{device_offset + i}.mkv")
-        run_recorder(
+        catalog.add_file(save_file_name, current_round, id, device_offset + i)
+        process = run_recorder(
             i,
             "Subordinate",
             (device_offset + i) * sync_delay,
             record_time,
             save_file_name,
-            recorder_path,
+            recorder,
             process_list,
         )
+        recordings.append((process, save_file_name))
 
     for p in process_list:
         processutils.read_until_signal(p)
@@ -125,6 +139,8 @@ def main() -> None:
 
     # Create the save folder
     save_path: str = create_save_folder(args.save_path)
+    catalog = SessionCatalog(save_path)
+    recordings: List[Tuple[subprocess.Popen, str]] = []
 
     # Create and connect the socket
     sk: socket.socket = socket.socket()
@@ -133,6 +149,7 @@ def main() -> None:
 
     # List to track running processes
     process_list: List[subprocess.Popen] = []
+    recorder: RecorderBackend = create_recorder(args.recorder, args.recorder_path)
 
     try:
         while True:
@@ -146,11 +163,13 @@ def main() -> None:
                     id,
                     save_path,
                     args.record_time,
-                    args.recorder_path,
+                    recorder,
                     process_list,
                     args.device_offset,
                     args.device_num,
                     args.sync_delay,
+                    catalog,
+                    recordings,
                 )
                 sk.send(ret_message.encode("utf-8"))
 
@@ -165,7 +184,12 @@ def main() -> None:
         traceback.print_exc()
     finally:
         # Ensure all processes are terminated when the session ends
+        finish_recordings(catalog, recordings)
         terminate_processes(process_list)
+        for process, _ in recordings:
+            process.wait()
+        finish_recordings(catalog, recordings, STATUS_STOPPED)
+        catalog.close()
 
         # Close the socket
         sk.close()
@@ -9,6 +9,7 @@ from typing import List
 from loguru import logger
 
 from libs import processutils
+from libs.recorder import RECORDERS, RecorderBackend, RecordingSpec, create_recorder
 
 processutils.check_system_and_set_priority()
 
@@ -47,19 +48,12 @@ def receive_readiness(clients: List[socket.socket]) -> int:
 
 
 def execute_recording(
-    record_command: str, recorder_path: str, delay: int = 2
+    spec: RecordingSpec, recorder: RecorderBackend, delay: int = 2
 ) -> subprocess.Popen:
     """Execute recording command and wait for a short delay."""
-    process = subprocess.Popen(
-        record_command,
-        shell=True,
-        cwd=recorder_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
+    process = recorder.spawn(spec, new_session=False)
 
-    logger.debug(f"$ {record_command}")
+    logger.debug(f"$ {recorder.command(spec)}")
     processutils.set_high_priority(process.pid)
     return process
 
@@ -88,6 +82,9 @@ def main() -> None:
         default="C:\\Program Files\\Azure Kinect SDK v1.4.2\\tools",
         help="Recorder path",
     )
+    parser.add_argument(
+        "--recorder", type=str, default="k4a", choices=list(RECORDERS), help="Recorder backend"
+    )
     parser.add_argument(
         "--save_path", type=str, default="./Goatdata", help="Save root path"
     )
@@ -110,6 +107,7 @@ def main() -> None:
     connected_clients: List[socket.socket] = initiate_connection(sk, client_num)
 
     recording_processes: List[subprocess.Popen] = []
+    recorder: RecorderBackend = create_recorder(args.recorder, args.recorder_path)
 
     try:
         while True:
@@ -125,11 +123,14 @@ def main() -> None:
 
                 for i in range(args.device_num):
                     sync_delay = i * args.sync_delay
-                    record_command: str = (
-                        f'k4arecorder.exe --device {i} --external-sync Subordinate --sync-delay {sync_delay} -d WFOV_2X2BINNED -c 1080p -r 30 -l {args.record_time} "{save_path}\\Goat_{len(os.listdir(save_path)) // 2 + 1}_{id[0]}_{i}.mkv"'
+                    spec = RecordingSpec(
+                        i,
+                        f"{save_path}\\Goat_{len(os.listdir(save_path)) // 2 + 1}_{id[0]}_{i}.mkv",
+                        args.record_time,
+                        sync_delay=sync_delay,
                     )
 
-                    p = execute_recording(record_command, args.recorder_path)
+                    p = execute_recording(spec, recorder)
 
                     # Append the processes to the list
                     recording_processes.append(p)
@@ -0,0 +1,232 @@
+"""Cross-device frame alignment of a recorded session.
+
+Every device's frame timestamps are pulled from its recording (see
+:func:`libs.mkvscan.read_timestamps`), shifted by the sync delay it was
+configured with, and clustered into rows of one capture instant. The result
+is an index of shape ``(rows, devices)`` with the frame number and device
+timestamp of every device in every row (-1 where a device has no frame),
+from which the achieved offsets, clock drift and dropped frames follow as
+plain array operations.
+
+The index is saved as a ``.npy`` file, so downstream jobs can open it with
+``numpy.load(path, mmap_mode="r")`` without parsing anything, and a JSON
+file next to it describes the columns and holds the statistics.
+"""
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from libs.mkvscan import read_timestamps
+
+INDEX_DTYPE = np.dtype([("frame", "<i4"), ("timestamp_ns", "<i8")])
+MISSING = -1
+START_OFFSET_TAG = "K4A_START_OFFSET_NS"
+
+
+@dataclass
+class DeviceStream:
+    label: str  # "<主机名>/Device<i>"
+    path: str
+    expected_offset_ns: int  # 配置的 sync delay
+    timestamps: np.ndarray = field(repr=False)  # 设备时间戳 (ns)，升序
+    frame_period_ns: int = 0
+    issues: List[str] = field(default_factory=list)
+
+
+@dataclass
+class DeviceStats:
+    label: str
+    frames: int
+    matched: int
+    missing: int  # 其他设备有帧而本设备没有的行数
+    expected_offset_us: float
+    mean_offset_us: Optional[float] = None  # 相对参考设备
+    offset_error_us: Optional[float] = None  # 平均偏移与配置偏移之差
+    jitter_us: Optional[float] = None  # 去掉漂移后偏移的标准差
+    max_error_us: Optional[float] = None
+    drift_ppm: Optional[float] = None
+
+
+def session_files(directory: str, session: str, round: Optional[int] = None) -> List[Tuple[str, str, int]]:
+    """``(path, host, device)`` of every ``{session}-r{round}-{host}-Device{i}.mkv`` in ``directory``.
+
+    Every slave numbers its rounds on its own, so without ``round`` the
+    latest round of each host is taken. Names without a round (older
+    slaves) count as round 0.
+    """
+    pattern = re.compile(re.escape(session) + r"(?:-r(\d+))?-(.+)-Device(\d+)\.mkv$", re.IGNORECASE)
+    found = []
+    for name in sorted(os.listdir(directory)):
+        match = pattern.match(name)
+        if match:
+            file_round = int(match.group(1) or 0)
+            found.append((file_round, os.path.join(directory, name), match.group(2), int(match.group(3))))
+    latest: Dict[str, int] = {}
+    for file_round, _, host, _ in found:
+        latest[host] = max(latest.get(host, 0), file_round)
+    files = [
+        (path, host, device)
+        for file_round, path, host, device in found
+        if file_round == (latest[host] if round is None else round)
+    ]
+    return sorted(files, key=lambda f: (f[1], f[2]))
+
+
+def _load(args) -> DeviceStream:
+    path, label, expected_offset_ns, track_name = args
+    report, timestamps = read_timestamps(path, track_name)
+    device_ns = np.frombuffer(timestamps, dtype=np.int64).copy()
+    # k4arecorder 写入的块时间戳减去了起始偏移，加回来得到设备时间戳
+    device_ns += int(report.tags.get(START_OFFSET_TAG, 0) or 0)
+    device_ns.sort()
+    stream = DeviceStream(label, path, expected_offset_ns, device_ns, issues=list(report.issues))
+    if len(device_ns) > 1:
+        stream.frame_period_ns = int(np.median(np.diff(device_ns)))
+    if len(device_ns) == 0:
+        stream.issues.append(f"No frames on track {track_name or 'video'}")
+    return stream
+
+
+def load_streams(
+    files: List[Tuple[str, str, int]],
+    sync_delay_us: int = 160,
+    device_offsets: Optional[Dict[str, int]] = None,
+    track_name: str = "DEPTH",
+    workers: Optional[int] = None,
+) -> List[DeviceStream]:
+    """Read the frame timestamps of every recording, one file per process.
+
+    The expected offset of device ``i`` on a host started with
+    ``--device_offset N`` is ``(N + i) * sync_delay``, as in slave.py.
+    """
+    device_offsets = device_offsets or {}
+    jobs = [
+        (
+            path,
+            f"{host}/Device{device}",
+            (device_offsets.get(host, 0) + device) * sync_delay_us * 1000,
+            track_name,
+        )
+        for path, host, device in files
+    ]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [_load(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_load, jobs))
+
+
+def build_index(streams: List[DeviceStream], tolerance: float = 0.5) -> np.ndarray:
+    """Match frames of all devices into rows of one capture instant.
+
+    Timestamps are first shifted back by each device's expected offset, then
+    all of them are sorted together and split wherever two neighbours are
+    more than ``tolerance`` frame periods apart. Each device takes the frame
+    closest to the row's first timestamp.
+    """
+    period = max((s.frame_period_ns for s in streams), default=0) or 1
+    corrected = [s.timestamps - s.expected_offset_ns for s in streams]
+    merged = np.sort(np.concatenate(corrected)) if corrected else np.empty(0, np.int64)
+    if len(merged) == 0:
+        return np.empty((0, len(streams)), INDEX_DTYPE)
+    starts = np.concatenate(([True], np.diff(merged) > tolerance * period))
+    centers = merged[starts]
+
+    index = np.empty((len(centers), len(streams)), INDEX_DTYPE)
+    index["frame"] = MISSING
+    index["timestamp_ns"] = MISSING
+    limit = tolerance * period
+    for column, (stream, times) in enumerate(zip(streams, corrected)):
+        if len(times) == 0:
+            continue
+        right = np.clip(np.searchsorted(times, centers), 0, len(times) - 1)
+        left = np.clip(right - 1, 0, len(times) - 1)
+        nearest = np.where(np.abs(times[left] - centers) <= np.abs(times[right] - centers), left, right)
+        hit = np.abs(times[nearest] - centers) <= limit
+        # 同一帧只归入离它最近的一行
+        distance = np.where(hit, np.abs(times[nearest] - centers), np.iinfo(np.int64).max)
+        order = np.lexsort((distance, nearest))
+        first = np.concatenate(([True], np.diff(nearest[order]) != 0))
+        keep = np.zeros(len(centers), bool)
+        keep[order[first]] = True
+        hit &= keep
+        index["frame"][hit, column] = nearest[hit]
+        index["timestamp_ns"][hit, column] = stream.timestamps[nearest[hit]]
+    return index
+
+
+def alignment_stats(
+    index: np.ndarray, streams: List[DeviceStream], reference: int = 0
+) -> List[DeviceStats]:
+    """Offset of every device against ``reference`` over the rows both captured."""
+    stats = []
+    frames = index["frame"]
+    times = index["timestamp_ns"]
+    ref_present = frames[:, reference] != MISSING
+    any_present = (frames != MISSING).any(axis=1)
+    ref_expected = streams[reference].expected_offset_ns if streams else 0
+    for column, stream in enumerate(streams):
+        present = frames[:, column] != MISSING
+        row = DeviceStats(
+            label=stream.label,
+            frames=len(stream.timestamps),
+            matched=int(present.sum()),
+            missing=int((any_present & ~present).sum()),
+            expected_offset_us=(stream.expected_offset_ns - ref_expected) / 1e3,
+        )
+        both = present & ref_present
+        if column != reference and both.sum() >= 2:
+            ref_times = times[both, reference]
+            offsets = (times[both, column] - ref_times).astype(np.float64)
+            expected = stream.expected_offset_ns - ref_expected
+            errors = offsets - expected
+            row.mean_offset_us = float(offsets.mean() / 1e3)
+            row.offset_error_us = float(errors.mean() / 1e3)
+            row.max_error_us = float(np.abs(errors).max() / 1e3)
+            residuals = offsets - offsets.mean()
+            elapsed = (ref_times - ref_times[0]).astype(np.float64)
+            if elapsed[-1] > 0:
+                slope, intercept = np.polyfit(elapsed, offsets, 1)
+                row.drift_ppm = float(slope * 1e6)
+                residuals = offsets - (slope * elapsed + intercept)
+            row.jitter_us = float(residuals.std() / 1e3)
+        stats.append(row)
+    return stats
+
+
+def save_index(
+    prefix: str, index: np.ndarray, streams: List[DeviceStream], stats: List[DeviceStats]
+) -> Tuple[str, str]:
+    """Write ``<prefix>.npy`` (the index) and ``<prefix>.json`` (columns and statistics)."""
+    index_path = prefix + ".npy"
+    meta_path = prefix + ".json"
+    np.save(index_path, index)
+    meta = {
+        "rows": len(index),
+        "columns": [
+            {
+                "label": s.label,
+                "path": os.path.abspath(s.path),
+                "expected_offset_ns": s.expected_offset_ns,
+                "frame_period_ns": s.frame_period_ns,
+                "issues": s.issues,
+            }
+            for s in streams
+        ],
+        "stats": [asdict(row) for row in stats],
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return index_path, meta_path
+
+
+def load_index(prefix: str) -> Tuple[np.ndarray, Dict]:
+    """Memory-map an index written by :func:`save_index`."""
+    with open(prefix + ".json", encoding="utf-8") as f:
+        meta = json.load(f)
+    return np.load(prefix + ".npy", mmap_mode="r"), meta
@@ -0,0 +1,359 @@
+"""Catalogs of recording rounds and the files they produced.
+
+Round numbers used to be derived from the number of entries in the save
+directory on every start, which costs a directory listing that grows with
+the data and assumes two files per round. The catalog is a small SQLite
+database next to the recordings instead: a round is one ``INSERT`` into a
+table with an autoincrement key, so numbers are allocated atomically and
+never reused, and every file is recorded with its state, size and
+duration so it can be queried without walking the directory tree.
+
+Slaves report every finished file to the master, which keeps the same kind
+of database for the whole rig in :class:`RigCatalog`.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import astuple, dataclass
+from typing import Dict, List, Optional, Tuple
+
+CATALOG_NAME = "catalog.sqlite3"
+
+# 文件状态
+STATUS_RECORDING = "recording"
+STATUS_COMPLETE = "complete"
+STATUS_STOPPED = "stopped"  # 被 STOP 命令终止
+STATUS_FAILED = "failed"
+STATUS_IMPORTED = "imported"  # 建库前已存在的文件
+
+# 旧版客户端的文件名中带有轮次: sheep_{round}_{id}_{device}.mkv
+LEGACY_ROUND = re.compile(r"^sheep_(\d+)_")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rounds (
+    round INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    started REAL NOT NULL,
+    record_time INTEGER,
+    devices INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    round INTEGER,
+    session TEXT,
+    device INTEGER,
+    status TEXT NOT NULL,
+    size INTEGER,
+    duration REAL,
+    checksum TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    uploaded REAL
+);
+CREATE INDEX IF NOT EXISTS files_session ON files (session);
+CREATE INDEX IF NOT EXISTS files_round ON files (round);
+CREATE INDEX IF NOT EXISTS files_status ON files (status);
+"""
+
+
+FILE_COLUMNS = "path, round, session, device, status, size, duration, checksum, created, updated, uploaded"
+
+
+@dataclass
+class FileRecord:
+    path: str
+    round: Optional[int]
+    session: Optional[str]
+    device: Optional[int]
+    status: str
+    size: Optional[int]
+    duration: Optional[float]  # 秒，录像进程从就绪到退出
+    checksum: Optional[str]  # libs.transfer.file_digest
+    created: float
+    updated: float
+    uploaded: Optional[float] = None  # 收集节点确认收到完整文件的时刻
+
+
+@dataclass
+class RoundRecord:
+    round: int
+    session: str
+    started: float
+    record_time: Optional[int]
+    devices: Optional[int]
+
+
+class SessionCatalog:
+    """SQLite catalog of one save directory, safe to share between threads."""
+
+    def __init__(self, directory: str, name: str = CATALOG_NAME):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, name)
+        new = not os.path.exists(self.path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(files)")}
+        if "checksum" not in columns:  # 早期版本的数据库
+            self._db.execute("ALTER TABLE files ADD COLUMN checksum TEXT")
+        if "uploaded" not in columns:
+            self._db.execute("ALTER TABLE files ADD COLUMN uploaded REAL")
+        if new:
+            self._import_existing()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _import_existing(self) -> None:
+        # 只在建库时遍历一次目录: 登记已有文件，并让轮次接着旧文件名继续编号
+        now = time.time()
+        last_round = 0
+        rows = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not entry.name.lower().endswith(".mkv"):
+                continue
+            match = LEGACY_ROUND.match(entry.name)
+            if match:
+                last_round = max(last_round, int(match.group(1)))
+            stat = entry.stat()
+            rows.append((os.path.abspath(entry.path), STATUS_IMPORTED, stat.st_size, stat.st_mtime, now))
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR IGNORE INTO files (path, status, size, created, updated) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            if last_round:
+                self._db.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('rounds', ?)", (last_round,)
+                )
+
+    def allocate_round(
+        self, session: str, record_time: Optional[int] = None, devices: Optional[int] = None
+    ) -> int:
+        """Reserve the next round number."""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO rounds (session, started, record_time, devices) VALUES (?, ?, ?, ?)",
+                (session, time.time(), record_time, devices),
+            )
+            return cursor.lastrowid
+
+    def add_file(
+        self,
+        path: str,
+        round: Optional[int],
+        session: Optional[str],
+        device: Optional[int],
+        status: str = STATUS_RECORDING,
+    ) -> None:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, round, session, device, status, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(path), round, session, device, status, now, now),
+            )
+
+    def finish_file(
+        self, path: str, status: str, duration: Optional[float] = None, checksum: Optional[str] = None
+    ) -> Optional[FileRecord]:
+        """Mark a file as no longer being written and record its size; returns the updated record."""
+        path = os.path.abspath(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        with self._lock:
+            self._db.execute(
+                "UPDATE files SET status = ?, size = ?, duration = ?, checksum = ?, updated = ? "
+                "WHERE path = ?",
+                (status, size, duration, checksum, time.time(), path),
+            )
+            row = self._db.execute(f"SELECT {FILE_COLUMNS} FROM files WHERE path = ?", (path,)).fetchone()
+        return None if row is None else FileRecord(*row)
+
+    def last_round(self) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'rounds'").fetchone()
+        return row[0] if row else 0
+
+    def rounds(self, session: Optional[str] = None) -> List[RoundRecord]:
+        query = "SELECT round, session, started, record_time, devices FROM rounds"
+        params = ()
+        if session is not None:
+            query += " WHERE session = ?"
+            params = (session,)
+        with self._lock:
+            return [RoundRecord(*row) for row in self._db.execute(query + " ORDER BY round", params)]
+
+    def files(
+        self, session: Optional[str] = None, round: Optional[int] = None, status: Optional[str] = None
+    ) -> List[FileRecord]:
+        conditions = []
+        params = []
+        for column, value in (("session", session), ("round", round), ("status", status)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        query = f"SELECT {FILE_COLUMNS} FROM files"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            return [FileRecord(*row) for row in self._db.execute(query + " ORDER BY created, path", params)]
+
+    def total_size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    def pending_uploads(self) -> List[FileRecord]:
+        """Files no longer being written that the collector has not confirmed yet."""
+        query = f"SELECT {FILE_COLUMNS} FROM files WHERE uploaded IS NULL AND status != ? ORDER BY created, path"
+        with self._lock:
+            return [FileRecord(*row) for row in self._db.execute(query, (STATUS_RECORDING,))]
+
+    def mark_uploaded(self, paths: List[str]) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "UPDATE files SET uploaded = ? WHERE path = ?", [(now, os.path.abspath(p)) for p in paths]
+            )
+
+
+RIG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    host TEXT NOT NULL,
+    path TEXT NOT NULL,
+    session TEXT,
+    round INTEGER,
+    device INTEGER,
+    status TEXT,
+    size INTEGER,
+    duration REAL,
+    checksum TEXT,
+    recorded REAL,
+    day TEXT,
+    received REAL NOT NULL,
+    PRIMARY KEY (host, path)
+);
+CREATE INDEX IF NOT EXISTS rig_session ON files (session, host, device);
+CREATE INDEX IF NOT EXISTS rig_host ON files (host, device);
+CREATE INDEX IF NOT EXISTS rig_day ON files (day);
+"""
+RIG_COLUMNS = "host, path, session, round, device, status, size, duration, checksum, recorded, day, received"
+
+
+@dataclass
+class RigFileRecord:
+    host: str
+    path: str  # slave 上的绝对路径
+    session: Optional[str]
+    round: Optional[int]
+    device: Optional[int]
+    status: Optional[str]
+    size: Optional[int]
+    duration: Optional[float]
+    checksum: Optional[str]
+    recorded: Optional[float]  # 录像开始时刻 (slave 的 time.time())
+    day: Optional[str]  # 录像开始日期 YYYY-MM-DD
+    received: float
+
+
+class RigCatalog:
+    """Master side catalog of the files of every slave, filled from their reports."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(RIG_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def add_report(self, report: Dict) -> RigFileRecord:
+        """Insert or update a file from a slave's report (see ``file_report``)."""
+        recorded = report.get("recorded")
+        day = None if recorded is None else time.strftime("%Y-%m-%d", time.localtime(recorded))
+        record = RigFileRecord(
+            report["host"],
+            report["path"],
+            report.get("session"),
+            report.get("round"),
+            report.get("device"),
+            report.get("status"),
+            report.get("size"),
+            report.get("duration"),
+            report.get("checksum"),
+            recorded,
+            day,
+            time.time(),
+        )
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO files ({RIG_COLUMNS}) VALUES ({', '.join('?' * 12)})",
+                astuple(record),
+            )
+        return record
+
+    def find(
+        self,
+        session: Optional[str] = None,
+        host: Optional[str] = None,
+        device: Optional[int] = None,
+        day: Optional[str] = None,
+    ) -> List[RigFileRecord]:
+        """Files matching every given field; ``day`` is ``YYYY-MM-DD``."""
+        conditions = []
+        params = []
+        for column, value in (("session", session), ("host", host), ("device", device), ("day", day)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        query = f"SELECT {RIG_COLUMNS} FROM files"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY session, host, device"
+        with self._lock:
+            return [RigFileRecord(*row) for row in self._db.execute(query, params)]
+
+    def sessions(self, day: Optional[str] = None) -> List[Tuple[str, int, int, int, int]]:
+        """Rows of ``(session, hosts, files, bytes, failed_files)``."""
+        query = (
+            "SELECT session, COUNT(DISTINCT host), COUNT(*), COALESCE(SUM(size), 0), "
+            "SUM(status NOT IN (?, ?)) FROM files"
+        )
+        params = [STATUS_COMPLETE, STATUS_STOPPED]
+        if day is not None:
+            query += " WHERE day = ?"
+            params.append(day)
+        with self._lock:
+            return list(self._db.execute(query + " GROUP BY session ORDER BY MIN(recorded)", params))
+
+
+def file_report(host: str, record: FileRecord, recorded: Optional[float] = None) -> Dict:
+    """What a slave sends to the master about one finished file."""
+    return {
+        "host": host,
+        "path": record.path,
+        "session": record.session,
+        "round": record.round,
+        "device": record.device,
+        "status": record.status,
+        "size": record.size,
+        "duration": record.duration,
+        "checksum": record.checksum,
+        "recorded": record.created if recorded is None else recorded,
+    }
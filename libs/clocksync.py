@@ -0,0 +1,147 @@
+"""Clock offset estimation between the master and its slaves.
+
+Every host timestamps with its own monotonic clock (:func:`now_ns`). A ping
+exchange gives four timestamps: ``t0`` master send, ``t1`` slave receive,
+``t2`` slave send and ``t3`` master receive, from which the master derives
+the slave's clock offset and the network delay, NTP style.
+"""
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+
+
+def now_ns() -> int:
+    """Monotonic clock used for every protocol timestamp."""
+    return time.perf_counter_ns()
+
+
+@dataclass
+class ClockSample:
+    t0: int  # master send
+    t1: int  # slave receive
+    t2: int  # slave send
+    t3: int  # master receive
+
+    @property
+    def offset_ns(self) -> int:
+        """Slave clock minus master clock."""
+        return ((self.t1 - self.t0) + (self.t2 - self.t3)) // 2
+
+    @property
+    def delay_ns(self) -> int:
+        """Round trip time spent on the network (excludes slave processing)."""
+        return (self.t3 - self.t0) - (self.t2 - self.t1)
+
+
+@dataclass
+class ClockEstimate:
+    offset_ns: int  # slave - master, at ``updated_ns`` on the master clock
+    delay_ns: int  # lowest round trip in the window
+    updated_ns: int
+    drift_ppm: float = 0.0  # slave clock rate relative to the master
+    samples: int = 1
+
+    def offset_at(self, master_ns: int) -> int:
+        return self.offset_ns + int((master_ns - self.updated_ns) * self.drift_ppm / 1e6)
+
+    def to_slave(self, master_ns: int) -> int:
+        return master_ns + self.offset_at(master_ns)
+
+    def to_master(self, slave_ns: int) -> int:
+        # 漂移量级为 ppm，用近似的 master 时刻求偏移已足够精确
+        return slave_ns - self.offset_at(slave_ns - self.offset_ns)
+
+
+class ClockFilter:
+    """Sliding window of ping samples for one slave.
+
+    Queuing only ever adds delay, so the samples with the smallest round trip
+    carry the least asymmetric error. The offset is anchored on the best
+    sample and drift is the least-squares slope of offset over time, fitted
+    through the low-delay samples only.
+    """
+
+    def __init__(self, window: int = 64, delay_tolerance: float = 1.5, min_span_ns: int = 5_000_000_000):
+        self.samples: Deque[ClockSample] = deque(maxlen=window)
+        self.delay_tolerance = delay_tolerance
+        self.min_span_ns = min_span_ns  # 时间跨度太短时斜率主要是噪声
+
+    def add(self, sample: ClockSample) -> ClockEstimate:
+        self.samples.append(sample)
+        return self.estimate()
+
+    def estimate(self) -> ClockEstimate:
+        best = min(self.samples, key=lambda s: s.delay_ns)
+        limit = best.delay_ns * self.delay_tolerance + 50_000
+        good = [s for s in self.samples if s.delay_ns <= limit]
+
+        drift_ppm = 0.0
+        if len(good) >= 3 and good[-1].t0 - good[0].t0 >= self.min_span_ns:
+            # 以 master 时刻 (t0, t3 中点) 为自变量做线性回归
+            xs = [(s.t0 + s.t3) / 2 for s in good]
+            ys = [s.offset_ns for s in good]
+            mx = sum(xs) / len(xs)
+            my = sum(ys) / len(ys)
+            var = sum((x - mx) ** 2 for x in xs)
+            if var > 0:
+                drift_ppm = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var * 1e6
+
+        best_mid = (best.t0 + best.t3) // 2
+        latest = self.samples[-1].t3
+        offset = best.offset_ns + int((latest - best_mid) * drift_ppm / 1e6)
+        return ClockEstimate(offset, best.delay_ns, latest, drift_ppm, len(self.samples))
+
+
+class ClockTable:
+    """Master side: a continuously updated clock estimate for every slave."""
+
+    def __init__(self, window: int = 64):
+        self.window = window
+        self.filters: Dict[str, ClockFilter] = {}
+        self.estimates: Dict[str, ClockEstimate] = {}
+
+    def add_sample(self, peer: str, sample: ClockSample) -> ClockEstimate:
+        if sample.delay_ns < 0:
+            raise ValueError(f"Negative round trip from {peer}: {sample}")
+        clock_filter = self.filters.get(peer)
+        if clock_filter is None:
+            clock_filter = self.filters[peer] = ClockFilter(self.window)
+        estimate = clock_filter.add(sample)
+        self.estimates[peer] = estimate
+        return estimate
+
+    def get(self, peer: str) -> Optional[ClockEstimate]:
+        return self.estimates.get(peer)
+
+    def max_delay_ns(self) -> int:
+        return max((e.delay_ns for e in self.estimates.values()), default=0)
+
+    def table(self) -> List[Tuple[str, float, float, float, int]]:
+        """Rows of ``(peer, offset_ms, rtt_ms, drift_ppm, samples)``."""
+        return [
+            (peer, e.offset_ns / 1e6, e.delay_ns / 1e6, e.drift_ppm, e.samples)
+            for peer, e in sorted(self.estimates.items())
+        ]
+
+
+class SlaveClock:
+    """Slave side: the offset and drift the master measured for this host."""
+
+    def __init__(self):
+        self.offset_ns: Optional[int] = None
+        self.drift_ppm = 0.0
+        self.reference_ns = 0  # 收到偏移时的本地时刻
+
+    @property
+    def is_synced(self) -> bool:
+        return self.offset_ns is not None
+
+    def update(self, offset_ns: int, drift_ppm: float, received_ns: int) -> None:
+        self.offset_ns = offset_ns
+        self.drift_ppm = drift_ppm
+        self.reference_ns = received_ns
+
+    def to_local(self, master_ns: int) -> int:
+        local = master_ns + self.offset_ns
+        return local + int((local - self.reference_ns) * self.drift_ppm / 1e6)
@@ -0,0 +1,1312 @@
+"""Asyncio control plane shared by master.py and slave.py.
+
+The master multicasts commands to every slave on ``port`` and collects the
+unicast replies that slaves send back to ``reply_port``. Both sides run their
+sockets on a private asyncio event loop so that neither a GUI thread nor a
+long-running recorder start ever sits between a datagram and its handler.
+The wire format is defined in :mod:`libs.protocol`.
+"""
+import asyncio
+import concurrent.futures
+import itertools
+import random
+import socket
+import struct
+import sys
+import threading
+import json
+from dataclasses import dataclass, field
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from libs.clocksync import ClockSample, ClockTable, now_ns
+from libs.membership import ANNOUNCE_LEAVING, ANNOUNCE_PRESENT, Member, MembershipRegistry
+from libs.protocol import (
+    CMD_CLOCK,
+    CMD_DISCOVER,
+    CMD_GO,
+    CMD_PING,
+    CMD_PREPARE,
+    CMD_START,
+    CMD_STOP,
+    CMD_SYNC,
+    COMMAND_NAMES,
+    MAX_DATAGRAM,
+    RELIABLE_COMMANDS,
+    REPLY_ACK,
+    REPLY_ANNOUNCE,
+    REPLY_HEARTBEAT,
+    REPLY_PING,
+    REPLY_PREPARE,
+    REPLY_START,
+    REPLY_SYNC,
+    REPLY_TRACE,
+    Command,
+    Heartbeat,
+    Reply,
+    pack_command,
+    pack_heartbeat,
+    pack_reply,
+    unpack_command,
+    unpack_reply,
+)
+from libs.stats import LatencyHistogram, ProbeStatsTable
+from libs.trace import TRACK_CONTROL, Timeline, TraceStore, chrome_trace
+
+DEFAULT_MULTICAST_GROUP = "ff02:ca11:4514:1919::"
+DEFAULT_PORT = 4329
+DEFAULT_REPLY_PORT = 4328
+DEFAULT_HOP_LIMIT = 1
+IPV6_MULTICAST_ALL = getattr(socket, "IPV6_MULTICAST_ALL", 29)  # Linux
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)  # Linux
+DEFAULT_RCVBUF = 4 * 1024 * 1024  # 100 个 slave 同时回复也远用不完
+READ_BATCH = 256  # 每次可读事件最多读取的数据包数，之后先处理计时器和其他套接字
+HANDLE_BATCH = 32  # 每轮最多处理的排队回复数
+REPLY_QUEUE_LIMIT = 4096
+PATH_MULTICAST = "multicast"
+PATH_UNICAST = "unicast"
+
+
+@dataclass
+class SlaveState:
+    """Everything the master knows about one slave."""
+
+    peer: str
+    address: Tuple
+    first_seen: int
+    last_seen: int
+    last_status: int = 0
+    last_msg_type: int = 0
+    last_message: str = ""
+    replies: int = 0
+    errors: int = 0
+    arm_ms: Optional[float] = None  # 上一次启动时所有设备就绪的耗时
+    arm_estimate_ms: Optional[float] = None  # slave 按以往多次启动估计的就绪耗时 (均值 + 方差余量)
+    ack_ms: Optional[float] = None  # 上一条可靠命令从首次发送到收到 ACK 的耗时
+    heartbeat: Optional[Heartbeat] = None  # 最近一次心跳
+    heartbeat_at: int = 0  # 最近一次心跳的到达时刻 (now_ns)
+    heartbeat_seq: int = 0
+    heartbeats: int = 0
+    heartbeats_lost: int = 0  # 按心跳序号的缺口统计
+    last_error: str = ""
+    stale: bool = False
+    path: str = PATH_MULTICAST  # 可靠命令的送达方式
+    multicast_misses: int = 0  # 连续几条可靠命令靠单播补发才送达
+    multicast_probes: int = 0  # 切换到单播后连续收到的组播探测回复
+    # 可靠命令从发出到 ACK 的耗时，按送达路径分别统计
+    multicast_ack: LatencyHistogram = field(default_factory=LatencyHistogram, repr=False)
+    unicast_ack: LatencyHistogram = field(default_factory=LatencyHistogram, repr=False)
+
+    def is_stale(self, now: int, stale_after: float) -> bool:
+        """No heartbeat for ``stale_after`` of its own intervals."""
+        if self.heartbeat is None or not self.heartbeat.interval_ms:
+            return False
+        return now - self.heartbeat_at > stale_after * self.heartbeat.interval_ms * 1_000_000
+
+
+def resolve_interface(interface: Union[str, int, None]) -> int:
+    """Index of a network interface given by name or index; 0 lets the system choose."""
+    if interface is None or interface == "":
+        return 0
+    if isinstance(interface, int) or str(interface).isdigit():
+        return int(interface)
+    try:
+        return socket.if_nametoindex(interface)
+    except OSError as e:
+        raise ValueError(f"Unknown network interface {interface!r}") from e
+
+
+def join_group(sock: socket.socket, multicast_group: str, interface: int = 0) -> None:
+    # 加入组播组, 接口序号 0 表示由系统选择
+    group_bin = socket.inet_pton(socket.AF_INET6, multicast_group)
+    mreq = group_bin + struct.pack("I", interface)
+    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
+
+
+def set_multicast_options(sock: socket.socket, interface: int = 0, hop_limit: int = 1, loopback: bool = True) -> None:
+    """Outgoing multicast of ``sock``: interface, hop limit and delivery to the local host.
+
+    On hosts with several network interfaces the system picks one for
+    multicast unless ``interface`` is given, which may be the Wi-Fi adapter.
+    """
+    if interface:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, interface)
+    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, hop_limit)
+    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_LOOP, int(loopback))
+
+
+def group_address(multicast_group: str, port: int, interface: int = 0) -> Tuple:
+    # 链路本地组播需要 scope id 才能确定从哪个接口发出
+    return (multicast_group, port, 0, interface) if interface else (multicast_group, port)
+
+
+@dataclass
+class BarrierResult:
+    """Outcome of a PREPARE: whether the whole rig armed, and when."""
+
+    session_name: str
+    sent_ns: int  # master 发出 PREPARE 的时刻
+    completed_ns: int  # 最后一个 slave 就绪 (或第一个失败) 的回复到达时刻
+    replies: Dict[str, Reply]
+    failed: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)  # 已知但未回复的 slave
+
+    @property
+    def armed(self) -> bool:
+        return bool(self.replies) and not self.failed and not self.missing
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (self.completed_ns - self.sent_ns) / 1e6
+
+    def device_arm_ms(self) -> Dict[str, Optional[float]]:
+        """``{"<peer>/Device<i>": ms from spawn to armed}`` from the slaves' reports."""
+        devices = {}
+        for peer, reply in sorted(self.replies.items()):
+            try:
+                arm_ms = json.loads(reply.msg_text)["arm_ms"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            for device, ms in arm_ms.items():
+                devices[f"{peer}/Device{device}"] = ms
+        return devices
+
+
+@dataclass
+class GoResult:
+    """Outcome of a GO: how long the rig sat armed before the trigger."""
+
+    go_ns: int  # master 发出 GO 的时刻
+    dead_ms: Optional[float]  # 屏障完成到 GO 的间隔
+    replies: Dict[str, Reply]
+
+
+def set_receive_buffer(sock: socket.socket, size: int) -> int:
+    """Request a ``size`` byte receive buffer; returns what the kernel granted."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    # Linux 报告的值是实际设置的两倍 (含簿记开销)，上限为 net.core.rmem_max
+    if granted < size:
+        logger.warning(
+            f"Receive buffer limited to {granted} bytes instead of {size}; "
+            "raise net.core.rmem_max to absorb larger reply bursts"
+        )
+    return granted
+
+
+def create_multicast_socket(multicast_group: str, port: int, interface: int = 0) -> socket.socket:
+    """Create a non-blocking socket bound to ``port`` and joined to the group."""
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if sys.platform.startswith("linux"):
+        # Linux 默认把本机任意套接字加入的组播都投递到同端口的套接字，只接收自己加入的组
+        sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MULTICAST_ALL, 0)
+    sock.bind(("::", port))
+    join_group(sock, multicast_group, interface)
+    sock.setblocking(False)
+    return sock
+
+
+def create_reply_socket(
+    reply_port: int,
+    multicast_group: Optional[str] = None,
+    interface: int = 0,
+    hop_limit: int = 1,
+    loopback: bool = True,
+    rcvbuf: int = DEFAULT_RCVBUF,
+) -> socket.socket:
+    """Create the master socket: sends commands, receives replies on ``reply_port``.
+
+    With ``multicast_group`` the socket also receives slave announcements
+    multicast to that group. ``rcvbuf`` sizes the kernel receive buffer that
+    absorbs reply bursts; 0 keeps the system default.
+    """
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    if rcvbuf:
+        set_receive_buffer(sock, rcvbuf)
+    sock.bind(("::", reply_port))
+    if multicast_group is not None:
+        join_group(sock, multicast_group, interface)
+    set_multicast_options(sock, interface, hop_limit, loopback)
+    sock.setblocking(False)
+    return sock
+
+
+class DatagramReader:
+    """Drains a non-blocking UDP socket into one preallocated buffer.
+
+    Every readable event receives up to ``batch`` datagrams with
+    ``recvfrom_into`` and hands ``on_datagram`` a memoryview of the buffer,
+    which is only valid for the duration of the call. The selector reports
+    the socket again while datagrams remain, so a burst is read in batches
+    between other callbacks. Malformed datagrams are counted and logged,
+    never fatal. On Linux the kernel's count of datagrams dropped on a full
+    receive buffer is read along with the datagrams (``SO_RXQ_OVFL``).
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        on_datagram: Callable[[memoryview, Tuple], None],
+        name: str,
+        batch: int = READ_BATCH,
+    ):
+        self.sock = sock
+        self.on_datagram = on_datagram
+        self.name = name
+        self.batch = batch
+        self.buffer = bytearray(MAX_DATAGRAM)
+        self.view = memoryview(self.buffer)
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0  # 处理函数抛出的其他异常
+        self.paused = False
+        self.pauses = 0
+        self.kernel_drops: Optional[int] = None  # None 表示系统不提供该计数
+        self._reported_drops = 0
+        self._ancillary = 0
+        if sys.platform.startswith("linux") and hasattr(sock, "recvmsg_into"):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self._ancillary = socket.CMSG_SPACE(4)
+                self.kernel_drops = 0
+            except OSError:
+                pass
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def receive_buffer(self) -> int:
+        return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.paused = False
+        loop.add_reader(self.sock.fileno(), self._on_readable)
+
+    def pause(self) -> None:
+        """Stop reading; datagrams wait in the kernel receive buffer."""
+        if self.loop is not None and not self.paused:
+            self.loop.remove_reader(self.sock.fileno())
+            self.paused = True
+            self.pauses += 1
+
+    def resume(self) -> None:
+        if self.loop is not None and self.paused:
+            self.loop.add_reader(self.sock.fileno(), self._on_readable)
+            self.paused = False
+
+    def close(self) -> None:
+        if self.loop is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.loop = None
+        self.sock.close()
+
+    def _receive(self) -> Tuple[int, Tuple]:
+        if not self._ancillary:
+            return self.sock.recvfrom_into(self.buffer)
+        n, ancdata, _, address = self.sock.recvmsg_into([self.buffer], self._ancillary)
+        for level, kind, data in ancdata:
+            # 内核只在计数非零时附带，值为该套接字累计丢弃的数据包数
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                self.kernel_drops = struct.unpack("=I", data[:4])[0]
+        return n, address
+
+    def _on_readable(self) -> None:
+        for _ in range(self.batch):
+            if self.paused:
+                break
+            try:
+                n, address = self._receive()
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionResetError:
+                continue  # Windows: 之前发送的数据包触发了 ICMP 端口不可达
+            except OSError as e:
+                logger.error(f"{self.name} channel error: {e}")
+                break
+            self.received += 1
+            try:
+                self.on_datagram(self.view[:n], address)
+            except ValueError as e:  # ProtocolError 与解码错误
+                self.rejected += 1
+                logger.warning(f"Malformed {self.name} datagram from {address[0]}: {e}")
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"{self.name} handler failed: {e}")
+        if self.kernel_drops and self.kernel_drops != self._reported_drops:
+            logger.warning(
+                f"{self.name} channel: kernel dropped {self.kernel_drops - self._reported_drops} "
+                f"datagram(s) on a full receive buffer ({self.kernel_drops} in total)"
+            )
+            self._reported_drops = self.kernel_drops
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    # Windows 默认的 Proactor 循环不支持 add_reader，套接字用 select 循环即可
+    return asyncio.SelectorEventLoop()
+
+
+class _ReplyWaiter:
+    """Collects replies of one message type until ``expected`` hosts answered."""
+
+    def __init__(self, msg_type: int, expected: Optional[int], future: asyncio.Future, fail_fast: bool = False):
+        self.msg_type = msg_type
+        self.expected = expected
+        self.future = future
+        self.fail_fast = fail_fast  # 任一失败回复立即结束等待
+        self.replies: Dict[str, Reply] = {}
+
+    def feed(self, reply: Reply) -> None:
+        if reply.msg_type != self.msg_type or self.future.done():
+            return
+        self.replies[reply.peer] = reply
+        if self.expected is not None and len(self.replies) >= self.expected:
+            self.future.set_result(self.replies)
+        elif self.fail_fast and reply.status < 0:
+            self.future.set_result(self.replies)
+
+
+class MasterControl:
+    """Master side of the control plane, running on a background event loop.
+
+    All public methods are safe to call from any thread (e.g. the GUI loop);
+    requests return ``concurrent.futures.Future`` objects so callers never
+    block on the network.
+    """
+
+    def __init__(
+        self,
+        multicast_group: str = DEFAULT_MULTICAST_GROUP,
+        port: int = DEFAULT_PORT,
+        reply_port: int = DEFAULT_REPLY_PORT,
+        on_reply: Optional[Callable[[Reply], None]] = None,
+        interface: Union[str, int, None] = None,
+        hop_limit: int = DEFAULT_HOP_LIMIT,
+        loopback: bool = True,
+        rcvbuf: int = DEFAULT_RCVBUF,
+        queue_limit: int = REPLY_QUEUE_LIMIT,
+    ):
+        self.multicast_group = multicast_group
+        self.port = port
+        self.reply_port = reply_port
+        self.on_reply = on_reply
+        self.rcvbuf = rcvbuf
+        self.queue_limit = queue_limit  # 已解析、待处理的回复上限，达到时暂停读取
+        self.interface = resolve_interface(interface)
+        self.hop_limit = hop_limit
+        self.loopback = loopback  # 组播是否也发给本机 (本机运行 slave 时需要)
+        self.unicast_after = 2  # 连续几条可靠命令组播未送达后改为同时单播
+        self.multicast_restore_after = 3  # 连续几次组播探测有回复后恢复纯组播
+        self.slaves: Dict[str, SlaveState] = {}
+        self.clock = ClockTable()
+        self.probes = ProbeStatsTable()
+        self._probe_seq = itertools.count(1)
+        # 命令序号从随机值开始，master 重启后不会被 slave 当成重复命令
+        self._command_seq = itertools.count(random.randrange(1, 2**31))
+        self._acks: Dict[int, Dict[str, int]] = {}  # seq -> {peer: ACK 到达时刻}
+        self.retransmit_initial = 0.02
+        self.retransmit_max = 0.2
+        self.retransmit_timeout = 2.0
+        self.stale_after = 3.0  # 心跳间隔的倍数
+        self.on_stale: Optional[Callable[[SlaveState], None]] = None  # 状态变化时调用 (含恢复)
+        self.members = MembershipRegistry()
+        self.barrier: Optional[BarrierResult] = None  # 最近一次 PREPARE 的结果
+        self.on_membership: Optional[Callable[[Member, bool], None]] = None  # (成员, 是否加入)
+        self.traces = TraceStore()  # 本机和各 slave 上报的会话时间线
+        self.session = ""  # 最近一次 START/PREPARE 的会话，GO 和 STOP 记入它的时间线
+        self._tasks = set()
+        self._clock_task: Optional[concurrent.futures.Future] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sock: Optional[socket.socket] = None
+        self._reader: Optional[DatagramReader] = None
+        self._thread: Optional[threading.Thread] = None
+        self._waiters: List[_ReplyWaiter] = []
+        self._queue: Deque[Reply] = deque()
+        self._handling = False
+        self.queue_peak = 0
+        self._ready = threading.Event()
+        self._startup_error: Optional[BaseException] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Open the reply socket and start the event loop thread."""
+        if self.is_running:
+            return
+        self._ready.clear()
+        self._startup_error = None
+        self._thread = threading.Thread(target=self._run, name="master-control", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._startup_error is not None:
+            self._thread.join()
+            raise self._startup_error
+        where = f", multicast on interface {self.interface}" if self.interface else ""
+        logger.info(f"Listening for replies on port {self.reply_port}{where}")
+
+    def close(self) -> None:
+        """Stop the event loop and close the socket."""
+        if not self.is_running:
+            return
+        self.stop_clock_sync()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        self.loop = new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._sock = create_reply_socket(
+                self.reply_port, self.multicast_group, self.interface, self.hop_limit, self.loopback, self.rcvbuf
+            )
+            self._reader = DatagramReader(self._sock, self._on_datagram, "reply")
+            self._reader.attach(self.loop)
+        except BaseException as e:
+            self._startup_error = e
+            self._ready.set()
+            self.loop.close()
+            return
+        self._ready.set()
+        self.loop.create_task(self._stale_watch())
+        try:
+            self.loop.run_forever()
+        finally:
+            self._reader.close()
+            for waiter in self._waiters:
+                if not waiter.future.done():
+                    waiter.future.cancel()
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+    def _on_datagram(self, data: memoryview, address: Tuple) -> None:
+        # 读取时只解析 (到达时间戳在此刻打上)，处理放到队列之后，突发回复先尽快读出内核缓冲区
+        self._queue.append(unpack_reply(data, address))
+        self.queue_peak = max(self.queue_peak, len(self._queue))
+        if len(self._queue) >= self.queue_limit:
+            # 处理跟不上时其余回复留在内核缓冲区，缓冲区满后的丢包由内核计数
+            self._reader.pause()
+        if not self._handling:
+            self._handling = True
+            self.loop.call_soon(self._handle_queue)
+
+    def _handle_queue(self) -> None:
+        """Handle queued replies in small batches, including the ``on_reply`` callback.
+
+        Replies arrive in bursts when a whole rig answers a ping or arms at
+        once. They are read in larger batches than they are handled, and
+        reading pauses while the queue is full so the rest waits in the
+        kernel's receive buffer instead of being dropped.
+        """
+        for _ in range(HANDLE_BATCH):
+            if not self._queue:
+                break
+            reply = self._queue.popleft()
+            try:
+                self._dispatch_reply(reply)
+            except Exception as e:
+                logger.exception(f"Handling reply from {reply.peer} failed: {e}")
+        if self._reader.paused and len(self._queue) <= self.queue_limit // 2:
+            self._reader.resume()
+        if self._queue:
+            # 让出事件循环，期间到达的数据包先被读取
+            self.loop.call_soon(self._handle_queue)
+            return
+        self._handling = False
+
+    def ingest_stats(self) -> Dict:
+        """Counters of the reply path, from the socket to the handlers.
+
+        Kernel drops, malformed datagrams and the queue peak show whether
+        the receive buffer and batch sizes keep up with the rig.
+        """
+        reader = self._reader
+        if reader is None:
+            return {}
+        return {
+            "received": reader.received,
+            "rejected": reader.rejected,
+            "failed": reader.failed,
+            "kernel_drops": reader.kernel_drops,
+            "queue_pauses": reader.pauses,
+            "queue_peak": self.queue_peak,
+            "queued": len(self._queue),
+            "receive_buffer": reader.receive_buffer if self.is_running else None,
+        }
+
+    def _dispatch_reply(self, reply: Reply) -> None:
+        state = self.slaves.get(reply.peer)
+        if state is None:
+            state = SlaveState(reply.peer, reply.address, reply.received, reply.received)
+            self.slaves[reply.peer] = state
+        state.address = reply.address
+        state.last_seen = reply.received
+        self.members.touch(reply.peer, reply.received)
+        if reply.msg_type == REPLY_ANNOUNCE:
+            self._on_announce(reply)
+            return
+        if reply.msg_type == REPLY_HEARTBEAT:
+            self._on_heartbeat(state, reply)
+            return
+        if reply.msg_type == REPLY_TRACE:
+            self._on_trace(reply)
+            return
+        state.last_status = reply.status
+        state.last_msg_type = reply.msg_type
+        state.last_message = reply.msg_text
+        state.replies += 1
+        if reply.status < 0:
+            state.errors += 1
+        if reply.msg_type == REPLY_ACK:
+            self._on_ack(reply)
+        elif reply.msg_type in (REPLY_PING, REPLY_SYNC):
+            self._update_clock(state, reply)
+            if state.path == PATH_UNICAST:
+                self._on_multicast_probe(state)
+        elif reply.msg_type in (REPLY_START, REPLY_PREPARE) and reply.msg_text:
+            try:
+                report = json.loads(reply.msg_text)
+                state.arm_ms = report["total_ms"]
+                state.arm_estimate_ms = report.get("estimate_ms", state.arm_estimate_ms)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                pass
+        if reply.msg_type in RELIABLE_COMMANDS and self.session:
+            self.traces.timeline(self.session).instant(
+                f"{COMMAND_NAMES[reply.msg_type]} reply", "replies", reply.received, peer=reply.peer, status=reply.status
+            )
+
+        for waiter in self._waiters:
+            waiter.feed(reply)
+        if self.on_reply is not None:
+            try:
+                self.on_reply(reply)
+            except Exception as e:
+                logger.exception(f"Reply handler failed: {e}")
+
+    def _on_trace(self, reply: Reply) -> None:
+        try:
+            session, complete = self.traces.add_chunk(reply.peer, reply.msg_text)
+        except ValueError as e:
+            logger.warning(f"Bad timeline from {reply.peer}: {e}")
+            return
+        if complete:
+            events = len(self.traces.events(session).get(reply.peer, ()))
+            logger.debug(f"Timeline of [{session}] from {reply.peer}: {events} event(s)")
+
+    def trace(self, session: Optional[str] = None) -> Dict:
+        """Chrome trace of ``session`` (default: the last one) with the slave timelines received so far.
+
+        The master's timeline holds its reliable commands, their ACKs and the
+        slaves' replies; slaves ship theirs as ``REPLY_TRACE`` datagrams once
+        their recorders exit (:mod:`libs.trace`).
+        """
+        session = session or self.session
+        slaves = self.traces.events(session)
+        names = {m.peer: m.host for m in self.members.table()}
+        clocks = {peer: self.clock.get(peer) for peer in slaves}
+        return chrome_trace(session, self.traces.local.get(session), slaves, clocks, names)
+
+    def _on_announce(self, reply: Reply) -> None:
+        try:
+            joined, left = self.members.announce(reply.peer, reply.status, reply.msg_text, reply.received)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Bad announcement from {reply.peer}: {e}")
+            return
+        if reply.status == ANNOUNCE_LEAVING:
+            self.slaves.pop(reply.peer, None)
+        for member in left:
+            self._membership_changed(member, False, "left" if member.peer == reply.peer else "was replaced")
+        if joined is not None:
+            self._membership_changed(joined, True, "joined")
+
+    def _membership_changed(self, member: Member, joined: bool, how: str) -> None:
+        logger.log(
+            "INFO" if joined else "WARNING",
+            f"Slave {member.host} ({member.peer}) {how}: {member.devices} device(s) "
+            f"from slot {member.device_offset}, {len(self.members.members)} slave(s) / "
+            f"{self.members.device_count} device(s) in the rig",
+        )
+        if not joined:
+            self.slaves.pop(member.peer, None)
+        if self.on_membership is not None:
+            try:
+                self.on_membership(member, joined)
+            except Exception as e:
+                logger.exception(f"Membership handler failed: {e}")
+
+    def _on_heartbeat(self, state: SlaveState, reply: Reply) -> None:
+        # 心跳不经过 on_reply 和等待者，只更新状态表
+        if state.heartbeats and reply.seq > state.heartbeat_seq:
+            state.heartbeats_lost += reply.seq - state.heartbeat_seq - 1
+        elif state.heartbeats and reply.seq < state.heartbeat_seq:
+            logger.info(f"Slave {state.peer} restarted (heartbeat #{reply.seq})")
+        silence_s = (reply.received - state.heartbeat_at) / 1e9
+        state.heartbeat_seq = reply.seq
+        state.heartbeat = reply.heartbeat
+        state.heartbeat_at = reply.received
+        state.heartbeats += 1
+        if reply.heartbeat.error:
+            state.last_error = reply.heartbeat.error
+        if state.stale:
+            state.stale = False
+            logger.info(f"Slave {state.peer} is back after {silence_s:.1f} s without heartbeats")
+            self._notify_stale(state)
+
+    def _notify_stale(self, state: SlaveState) -> None:
+        if self.on_stale is not None:
+            try:
+                self.on_stale(state)
+            except Exception as e:
+                logger.exception(f"Stale handler failed: {e}")
+
+    async def _stale_watch(self, interval: float = 0.5) -> None:
+        # 超过 stale_after 个心跳周期没有心跳的 slave 标记为失联
+        while True:
+            await asyncio.sleep(interval)
+            now = now_ns()
+            for member in self.members.expire(now):
+                self._membership_changed(member, False, "timed out")
+            for state in self.slaves.values():
+                if not state.stale and state.is_stale(now, self.stale_after):
+                    state.stale = True
+                    logger.warning(
+                        f"Slave {state.peer} is stale: no heartbeat for {(now - state.heartbeat_at) / 1e9:.1f} s "
+                        f"(last state {state.heartbeat.state_name})"
+                    )
+                    self._notify_stale(state)
+
+    def status_table(self) -> List[Dict]:
+        """One row per slave that sent heartbeats, built from the latest one."""
+        now = now_ns()
+        rows = []
+        for peer, state in sorted(self.slaves.items()):
+            hb = state.heartbeat
+            if hb is None:
+                continue
+            rows.append(
+                {
+                    "peer": peer,
+                    "state": hb.state_name,
+                    "stale": state.stale,
+                    "age_s": (now - state.heartbeat_at) / 1e9,
+                    "devices": hb.devices,
+                    "armed": hb.armed,
+                    "alive": hb.alive,
+                    "warnings": hb.warnings,
+                    "written_mb": hb.bytes_written / 1e6,
+                    "cpu_percent": hb.cpu_percent,
+                    "heartbeats": state.heartbeats,
+                    "lost": state.heartbeats_lost,
+                    "path": state.path,
+                    "last_error": state.last_error,
+                }
+            )
+        return rows
+
+    def _on_multicast_probe(self, state: SlaveState) -> None:
+        # 探测只通过组播发送，收到回复说明组播又能送达
+        state.multicast_probes += 1
+        if state.multicast_probes >= self.multicast_restore_after:
+            state.path = PATH_MULTICAST
+            state.multicast_misses = 0
+            logger.info(f"Multicast to {state.peer} confirmed again, back to multicast only")
+
+    def _update_clock(self, state: SlaveState, reply: Reply) -> None:
+        t0, t1, t2 = reply.stamps
+        # 往返时间以回传的发送时刻计算，乱序或迟到的回复不会被算错
+        self.probes.on_reply(reply.peer, reply.seq, reply.received - t0)
+        try:
+            estimate = self.clock.add_sample(reply.peer, ClockSample(t0, t1, t2, reply.received))
+        except ValueError as e:
+            logger.warning(f"Bad clock sample from {reply.peer}: {e}")
+            return
+        # 把当前偏移和漂移 (ppb) 推送给该 slave，使其能把计划启动时刻换算为本地时钟
+        drift_ppb = max(-(2**31), min(int(estimate.drift_ppm * 1000), 2**31 - 1))
+        self._send(
+            pack_command(CMD_CLOCK, drift_ppb, "", estimate.offset_at(now_ns())),
+            self._command_address(state),
+            quiet=True,
+        )
+
+    def _command_address(self, state: SlaveState) -> Tuple:
+        """The unicast address of a slave's command socket.
+
+        Slaves on one host share the multicast ``port``, where a unicast
+        datagram reaches only one of them, so every slave announces a
+        command port of its own. Slaves that did not announce one get the
+        shared port.
+        """
+        member = self.members.members.get(state.peer)
+        port = None if member is None else member.extra.get("command_port")
+        if not isinstance(port, int) or not 0 < port < 65536:
+            port = self.port
+        return (state.address[0], port) + tuple(state.address[2:])
+
+    def _on_ack(self, reply: Reply) -> None:
+        acks = self._acks.get(reply.seq)
+        if acks is not None and reply.peer not in acks:
+            acks[reply.peer] = reply.received
+
+    async def _deliver(
+        self,
+        seq: int,
+        packet: bytes,
+        sent_ns: int,
+        expected: Optional[int],
+        unicast_sent: Dict[str, int],
+        timeline: Optional[Timeline] = None,
+    ) -> None:
+        """Retransmit a reliable command until every slave acknowledged it.
+
+        Slaves known when the command was sent that have not acked get
+        unicast copies with exponential backoff. While fewer than
+        ``expected`` slaves are known the multicast is repeated as well.
+        Slaves drop duplicates by sequence number. ``unicast_sent`` maps
+        peers to when their first unicast copy went out. A slave that leaves
+        the rig before acking is no longer retransmitted to and is reported
+        as left.
+        """
+        acks = self._acks[seq]
+        targets = set(self.slaves)
+        left = set()
+        delay = self.retransmit_initial
+        deadline = self.loop.time() + self.retransmit_timeout
+        attempts = 1
+        try:
+            while self.loop.time() < deadline:
+                await asyncio.sleep(delay)
+                missing = targets - acks.keys()
+                for peer in [p for p in missing if p not in self.slaves]:
+                    # 重传期间离开了 rig (超时或被移除)，不再有地址可发
+                    left.add(peer)
+                    missing.discard(peer)
+                    targets.discard(peer)
+                repeat_multicast = expected is not None and len(acks) < expected
+                if not missing and not repeat_multicast:
+                    break
+                attempts += 1
+                if timeline is not None:
+                    timeline.instant("retransmit", "acks", seq=seq, unicast=len(missing), multicast=repeat_multicast)
+                for peer in missing:
+                    state = self.slaves.get(peer)
+                    if state is None:
+                        continue
+                    self._send(packet, self._command_address(state), quiet=True)
+                    unicast_sent.setdefault(peer, now_ns())
+                if repeat_multicast:
+                    self._send(packet, quiet=True)
+                delay = min(delay * 2, self.retransmit_max)
+        finally:
+            del self._acks[seq]
+
+        for peer, acked_ns in acks.items():
+            if timeline is not None:
+                timeline.instant("ACK", "acks", acked_ns, seq=seq, peer=peer, unicast=peer in unicast_sent)
+            state = self.slaves.get(peer)
+            if state is not None:
+                state.ack_ms = (acked_ns - sent_ns) / 1e6
+                self._record_path(state, sent_ns, acked_ns, unicast_sent.get(peer))
+        missing = sorted(targets - acks.keys())
+        latency = max((a - sent_ns for a in acks.values()), default=0) / 1e6
+        unicast = len(unicast_sent.keys() & acks.keys())
+        message = (
+            f"Command #{seq} acked by {len(acks)} slave(s) in {latency:.3f} ms "
+            f"after {attempts} transmission(s)" + (f", {unicast} by unicast" if unicast else "")
+        )
+        if left:
+            message += f", {len(left)} left the rig before acking: {sorted(left)}"
+        if missing or left or (expected is not None and len(acks) < expected):
+            logger.warning(f"{message}, missing {missing}")
+        else:
+            logger.info(message)
+
+    def _record_path(self, state: SlaveState, sent_ns: int, acked_ns: int, unicast_ns: Optional[int]) -> None:
+        """Attribute an ACK to the path that delivered the command and switch paths if needed.
+
+        A slave whose ACKs keep arriving only after its unicast copy gets
+        every following reliable command by unicast right away, next to the
+        multicast, until it answers ``multicast_restore_after`` multicast
+        probes again (:meth:`_on_multicast_probe`).
+        """
+        if unicast_ns is None or acked_ns < unicast_ns:
+            state.multicast_ack.record(acked_ns - sent_ns)
+            state.multicast_misses = 0
+            return
+        # ACK 晚于单播副本，视为单播送达 (单播模式下两者同时发出)
+        state.unicast_ack.record(acked_ns - unicast_ns)
+        if state.path == PATH_UNICAST:
+            return
+        state.multicast_misses += 1
+        if state.multicast_misses >= self.unicast_after:
+            state.path = PATH_UNICAST
+            state.multicast_probes = 0
+            logger.warning(
+                f"Multicast to {state.peer} not confirmed for {state.multicast_misses} commands, "
+                f"sending its commands by unicast as well"
+            )
+
+    def _fan_out(self, packet: bytes) -> Dict[str, int]:
+        """Unicast copies to the slaves on the unicast path; returns ``{peer: sent_ns}``."""
+        sent = {}
+        for peer, state in list(self.slaves.items()):
+            if state.path == PATH_UNICAST:
+                self._send(packet, self._command_address(state), quiet=True)
+                sent[peer] = now_ns()
+        return sent
+
+    def path_table(self) -> List[Dict]:
+        """Per slave: delivery path of reliable commands and ACK latency (ms) on each path."""
+
+        def ms(value):
+            return None if value is None else value / 1e6
+
+        rows = []
+        for peer, state in sorted(self.slaves.items()):
+            row = {"peer": peer, "path": state.path, "misses": state.multicast_misses}
+            for name, histogram in (("multicast", state.multicast_ack), ("unicast", state.unicast_ack)):
+                row[f"{name}_count"] = histogram.count
+                row[f"{name}_p50_ms"] = ms(histogram.percentile(50))
+                row[f"{name}_p99_ms"] = ms(histogram.percentile(99))
+            rows.append(row)
+        return rows
+
+    def _probe(self, status: int) -> bytes:
+        """Build a sequence-numbered timestamped probe; must run on the loop thread."""
+        self.probes.on_probe_sent(self.slaves.keys())
+        return pack_command(status, 0, "", now_ns(), next(self._probe_seq))
+
+    async def _clock_sync_loop(self, interval: float) -> None:
+        while True:
+            self._send(self._probe(CMD_SYNC), quiet=True)
+            await asyncio.sleep(interval)
+
+    async def _ping_burst(self, count: int, interval: float, timeout: float) -> List[Dict]:
+        for i in range(count):
+            if i:
+                await asyncio.sleep(interval)
+            self._send(self._probe(CMD_PING), quiet=True)
+        await asyncio.sleep(timeout)
+        return self.probes.table()
+
+    async def _discover(self, window: float) -> List[Member]:
+        self._send(pack_command(CMD_DISCOVER, int(window * 1000)))
+        await asyncio.sleep(window + 0.1)
+        return self.members.table()
+
+    def discover(self, window: float = 0.5) -> concurrent.futures.Future:
+        """Ask every slave to announce itself within ``window`` seconds.
+
+        The future resolves to the registry's members after the window.
+        """
+        return asyncio.run_coroutine_threadsafe(self._discover(window), self.loop)
+
+    def ping_burst(self, count: int = 10, interval: float = 0.01, timeout: float = 1.0) -> concurrent.futures.Future:
+        """Send ``count`` pings ``interval`` seconds apart.
+
+        The future resolves to :meth:`ProbeStatsTable.table` once the last
+        probe's reply window closed.
+        """
+        return asyncio.run_coroutine_threadsafe(self._ping_burst(count, interval, timeout), self.loop)
+
+    def start_clock_sync(self, interval: float = 1.0) -> None:
+        """Probe every slave's clock every ``interval`` seconds in the background."""
+        self.stop_clock_sync()
+        self._clock_task = asyncio.run_coroutine_threadsafe(self._clock_sync_loop(interval), self.loop)
+
+    def stop_clock_sync(self) -> None:
+        if self._clock_task is not None:
+            self._clock_task.cancel()
+            self._clock_task = None
+
+    def plan_start(self, margin: float = 0.2, default_arm: float = 3.0) -> int:
+        """Pick a start time (master clock, ns) that every known slave can meet.
+
+        The lead time covers the slowest one-way network delay and the
+        slowest slave's arm time estimate (see
+        :class:`libs.stats.ArmTimeEstimate`), or its last arm time for
+        slaves that do not report one.
+        """
+        arm_times = [
+            (s.arm_estimate_ms if s.arm_estimate_ms is not None else s.arm_ms) / 1000
+            for s in self.slaves.values()
+            if s.arm_estimate_ms is not None or s.arm_ms is not None
+        ]
+        arm = max(arm_times) if arm_times else default_arm
+        lead = self.clock.max_delay_ns() // 2 + int((arm + margin) * 1e9)
+        return now_ns() + lead
+
+    def _send(self, packet: bytes, address: Optional[Tuple] = None, quiet: bool = False) -> None:
+        if address is None:
+            address = group_address(self.multicast_group, self.port, self.interface)
+        if not quiet:
+            logger.debug(f"Sending packed data: {packet}, length: {len(packet)}")
+        try:
+            self._sock.sendto(packet, address)
+        except (BlockingIOError, InterruptedError):
+            logger.warning(f"Send buffer full, dropped {len(packet)} bytes to {address[0]}")
+
+    async def _request(
+        self, packet: Union[bytes, Callable[[], bytes]], msg_type: int, timeout: float, expected: Optional[int]
+    ) -> Dict[str, Reply]:
+        waiter = _ReplyWaiter(msg_type, expected, self.loop.create_future())
+        self._waiters.append(waiter)
+        try:
+            self._send(packet() if callable(packet) else packet)
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters.remove(waiter)
+        return waiter.replies
+
+    async def _reliable_request(
+        self,
+        status: int,
+        argument: int,
+        session_name: str,
+        timestamp: int,
+        timeout: float,
+        expected: Optional[int],
+        fail_fast: bool = False,
+    ) -> Dict[str, Reply]:
+        seq = next(self._command_seq) & 0x7FFFFFFF or 1
+        packet = pack_command(status, argument, session_name, timestamp, seq)
+        if status in (CMD_START, CMD_PREPARE):
+            self.session = session_name
+        timeline = self.traces.timeline(self.session) if self.session else None
+        waiter = _ReplyWaiter(status, expected, self.loop.create_future(), fail_fast)
+        self._waiters.append(waiter)
+        sent_ns = now_ns()
+        try:
+            self._acks[seq] = {}
+            self._send(packet)
+            unicast_sent = self._fan_out(packet)
+            delivery = self.loop.create_task(
+                self._deliver(seq, packet, sent_ns, expected, unicast_sent, timeline)
+            )
+            self._tasks.add(delivery)
+            delivery.add_done_callback(self._tasks.discard)
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters.remove(waiter)
+        if timeline is not None:
+            # 从发出命令到收齐回复 (或超时)
+            failed = sum(1 for r in waiter.replies.values() if r.status < 0)
+            timeline.span(
+                COMMAND_NAMES[status], sent_ns, track=TRACK_CONTROL, seq=seq, replies=len(waiter.replies), failed=failed
+            )
+        return waiter.replies
+
+    def request(
+        self,
+        packet: Union[bytes, Callable[[], bytes]],
+        msg_type: int,
+        timeout: float = 1.0,
+        expected: Optional[int] = None,
+    ) -> concurrent.futures.Future:
+        """Multicast ``packet`` and collect replies of ``msg_type``.
+
+        ``packet`` may be a callable, which is then built on the loop thread.
+
+        The future resolves to ``{peer: Reply}`` once ``expected`` slaves have
+        answered or ``timeout`` seconds have passed, whichever comes first.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._request(packet, msg_type, timeout, expected), self.loop
+        )
+
+    def send_start(
+        self,
+        session_name: str,
+        record_time: int,
+        target_ns: int = 0,
+        timeout: float = 30.0,
+        expected: Optional[int] = None,
+    ) -> concurrent.futures.Future:
+        """Start recording; with ``target_ns`` every slave aims to be armed at that master time."""
+        if target_ns:
+            timeout += max(0, target_ns - now_ns()) / 1e9
+        return asyncio.run_coroutine_threadsafe(
+            self._reliable_request(CMD_START, record_time, session_name, target_ns, timeout, expected), self.loop
+        )
+
+    async def _prepare(
+        self, session_name: str, record_time: int, timeout: float, expected: Optional[int]
+    ) -> BarrierResult:
+        # 已加入的成员就是屏障要等的 slave；没有成员信息时退回到已知的 slave
+        targets = set(self.members.members) or set(self.slaves)
+        if expected is None and targets:
+            expected = len(targets)
+        sent_ns = now_ns()
+        replies = await self._reliable_request(
+            CMD_PREPARE, record_time, session_name, 0, timeout, expected, fail_fast=True
+        )
+        result = BarrierResult(
+            session_name,
+            sent_ns,
+            max((r.received for r in replies.values()), default=now_ns()),
+            dict(replies),
+            failed=sorted(peer for peer, r in replies.items() if r.status < 0),
+            missing=sorted(targets - replies.keys()),
+        )
+        if expected is not None and len(replies) < expected and not result.missing and not result.failed:
+            result.missing = [f"{expected - len(replies)} unknown slave(s)"]
+        self.barrier = result
+        return result
+
+    def prepare(
+        self, session_name: str, record_time: int, timeout: float = 35.0, expected: Optional[int] = None
+    ) -> concurrent.futures.Future:
+        """Arm every recorder on every slave without triggering.
+
+        The future resolves to a :class:`BarrierResult` as soon as the last
+        slave reports all its devices armed, as soon as any slave reports a
+        failure, or after ``timeout`` seconds. Without ``expected`` the
+        barrier waits for every member of the rig.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._prepare(session_name, record_time, timeout, expected), self.loop
+        )
+
+    async def _go(self, timeout: float, expected: Optional[int]) -> GoResult:
+        barrier = self.barrier
+        go_ns = now_ns()
+        dead_ms = None if barrier is None or not barrier.armed else (go_ns - barrier.completed_ns) / 1e6
+        if expected is None and barrier is not None:
+            expected = len(barrier.replies)
+        session_name = barrier.session_name if barrier is not None else ""
+        replies = await self._reliable_request(CMD_GO, 0, session_name, go_ns, timeout, expected)
+        return GoResult(go_ns, dead_ms, dict(replies))
+
+    def go(self, timeout: float = 2.0, expected: Optional[int] = None) -> concurrent.futures.Future:
+        """Tell the prepared slaves the trigger fired; resolves to a :class:`GoResult`.
+
+        Call it right after starting the trigger. The result measures how
+        long the rig sat armed, and each slave reports how long every
+        device waited.
+        """
+        return asyncio.run_coroutine_threadsafe(self._go(timeout, expected), self.loop)
+
+    def send_stop(self, timeout: float = 5.0, expected: Optional[int] = None) -> concurrent.futures.Future:
+        self.barrier = None
+        return asyncio.run_coroutine_threadsafe(
+            self._reliable_request(CMD_STOP, 0, "", 0, timeout, expected), self.loop
+        )
+
+    def send_ping(self, timeout: float = 1.0, expected: Optional[int] = None) -> concurrent.futures.Future:
+        return self.request(lambda: self._probe(CMD_PING), REPLY_PING, timeout, expected)
+
+
+class SlaveControl:
+    """Slave side of the control plane.
+
+    Handlers are registered per command status with :meth:`on` and receive a
+    :class:`Command`. Quick handlers run inline on the event loop; handlers
+    registered with ``blocking=True`` are handed to a worker executor so the
+    receive loop keeps serving STOP and PING while they run. :meth:`reply` may
+    be called from any thread.
+    """
+
+    def __init__(
+        self,
+        multicast_group: str = DEFAULT_MULTICAST_GROUP,
+        port: int = DEFAULT_PORT,
+        reply_port: int = DEFAULT_REPLY_PORT,
+        workers: int = 1,
+        interface: Union[str, int, None] = None,
+        hop_limit: int = DEFAULT_HOP_LIMIT,
+        loopback: bool = True,
+    ):
+        self.multicast_group = multicast_group
+        self.port = port
+        self.reply_port = reply_port
+        self.interface = resolve_interface(interface)
+        self.handlers: Dict[int, Tuple[Callable[[Command], None], bool]] = {}
+        self.reply_socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        # 通告以组播发出，与 master 使用相同的接口和跳数
+        set_multicast_options(self.reply_socket, self.interface, hop_limit, loopback)
+        # 单播命令 (时钟推送、重传) 的专用端口，同一主机上的多个 slave 各不相同，随通告告知 master
+        self.command_socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        self.command_socket.bind(("::", 0))
+        self.command_socket.setblocking(False)
+        self.command_port: int = self.command_socket.getsockname()[1]
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.master_address: Optional[Tuple] = None  # 最近一次收到命令的来源，心跳发往这里
+        self._heartbeat: Optional[Tuple[float, Callable[[], Heartbeat]]] = None
+        self._announcement: Optional[Callable[[], str]] = None
+        # 最近处理过的可靠命令 (master 地址, 序号)，用于丢弃重传的重复命令
+        self._seen: Deque[Tuple[str, int]] = deque(maxlen=256)
+        # 单线程执行器: 长任务 (例如启动录像) 按到达顺序串行执行
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="slave-worker"
+        )
+
+    def on(self, status: int, handler: Callable[[Command], None], blocking: bool = False) -> None:
+        self.handlers[status] = (handler, blocking)
+
+    def announce(self, announcement: Callable[[], str]) -> None:
+        """Announce this slave with ``announcement()`` on start, on DISCOVER and on exit.
+
+        Announcements are multicast to ``reply_port``, so the master's
+        registry (:mod:`libs.membership`) reflects the rig without any
+        configuration. They should carry :attr:`command_port` as
+        ``command_port`` so unicast commands reach this slave.
+        """
+        self._announcement = announcement
+
+    def _send_announcement(self, address: Optional[Tuple] = None, status: int = ANNOUNCE_PRESENT) -> None:
+        if address is None:
+            address = group_address(self.multicast_group, self.reply_port, self.interface)
+        else:
+            address = (address[0], self.reply_port) + tuple(address[2:])
+        try:
+            packet = pack_reply(status, REPLY_ANNOUNCE, self._announcement())
+            self.reply_socket.sendto(packet, address)
+        except OSError as e:
+            logger.warning(f"Announcement to {address[0]} not sent: {e}")
+
+    async def _announce_loop(self, count: int = 3, interval: float = 0.3) -> None:
+        # 组播不可靠，启动时连发几次
+        for _ in range(count):
+            self._send_announcement()
+            await asyncio.sleep(interval)
+
+    def heartbeat(self, interval: float, snapshot: Callable[[], Heartbeat]) -> None:
+        """Send ``snapshot()`` to the master every ``interval`` seconds once :meth:`run` starts.
+
+        A heartbeat is a 28 byte datagram (about 110 bytes on the wire with
+        IPv6 and Ethernet headers), so 100 slaves at 1 Hz cost under 0.1 Mbit/s.
+        """
+        self._heartbeat = (interval, snapshot)
+
+    async def _heartbeat_loop(self, interval: float, snapshot: Callable[[], Heartbeat]) -> None:
+        # 随机相位，避免大量 slave 同时启动时心跳集中到达
+        await asyncio.sleep(random.uniform(0, interval))
+        seq = itertools.count(1)
+        last_error = ""
+        repeats = 0
+        next_at = self.loop.time()
+        while True:
+            if self.master_address is not None:
+                try:
+                    heartbeat = snapshot()
+                    heartbeat.interval_ms = int(interval * 1000)
+                    # 错误文本只在变化后的三次心跳中携带，丢一两个包也能送达
+                    if heartbeat.error != last_error:
+                        last_error = heartbeat.error
+                        repeats = 3
+                    if repeats:
+                        repeats -= 1
+                    else:
+                        heartbeat.error = ""
+                    address = (self.master_address[0], self.reply_port) + tuple(self.master_address[2:])
+                    self.reply_socket.sendto(pack_heartbeat(heartbeat, next(seq)), address)
+                except OSError as e:
+                    logger.debug(f"Heartbeat not sent: {e}")
+                except Exception as e:
+                    logger.exception(f"Heartbeat failed: {e}")
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - self.loop.time()))
+
+    def reply(
+        self,
+        command: Command,
+        status_code: int,
+        msg_type: int,
+        msg_text: str = "",
+        stamps: Optional[Tuple[int, int, int]] = None,
+    ) -> None:
+        """Send a status message back to the master that issued ``command``."""
+        # 使用 master 的来源地址 (保留 scope id，链路本地地址需要它)
+        address = (command.address[0], self.reply_port) + tuple(command.address[2:])
+        packet = pack_reply(status_code, msg_type, msg_text, command.seq, stamps)
+        self.reply_socket.sendto(packet, address)
+        if msg_type in (REPLY_SYNC, REPLY_ACK, REPLY_TRACE):
+            return
+        logger.info(
+            f"Sent status to {command.address[0]}, status_code: {status_code}, msg_type: {msg_type}, msg_text: {msg_text}"
+        )
+
+    def _dispatch(self, command: Command) -> None:
+        self.master_address = command.address
+        if command.status == CMD_DISCOVER:
+            if self._announcement is not None:
+                # 在 master 给出的窗口内随机延迟回复，避免所有 slave 同时回复
+                delay = random.uniform(0, command.argument / 1000 * 0.8)
+                self.loop.call_later(delay, self._send_announcement, command.address)
+            return
+        if command.status not in (CMD_SYNC, CMD_CLOCK):
+            logger.info(f"Received message from {command.address[0]}")
+        entry = self.handlers.get(command.status)
+        if entry is None:
+            logger.warning(f"Unknown command {command.status} from {command.address[0]}")
+            return
+        if command.seq and command.status in RELIABLE_COMMANDS:
+            # 先确认，重复的命令只再确认一次 (之前的 ACK 可能丢失)
+            self.reply(command, 0, REPLY_ACK)
+            key = (command.address[0], command.seq)
+            if key in self._seen:
+                logger.debug(f"Dropped duplicate command #{command.seq} from {command.address[0]}")
+                return
+            self._seen.append(key)
+        handler, blocking = entry
+        if blocking:
+            self.executor.submit(self._run_handler, handler, command)
+        else:
+            self._run_handler(handler, command)
+
+    @staticmethod
+    def _run_handler(handler: Callable[[Command], None], command: Command) -> None:
+        try:
+            handler(command)
+        except Exception as e:
+            logger.exception(f"Handler for command {command.status} failed: {e}")
+
+    def _on_datagram(self, data: memoryview, address: Tuple) -> None:
+        self._dispatch(unpack_command(data, address))
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        sock = create_multicast_socket(self.multicast_group, self.port, self.interface)
+        reader = DatagramReader(sock, self._on_datagram, "command")
+        reader.attach(self.loop)
+        unicast_reader = DatagramReader(self.command_socket, self._on_datagram, "unicast command")
+        unicast_reader.attach(self.loop)
+        where = f" on interface {self.interface}" if self.interface else ""
+        logger.info(f"Listening for multicast messages on {self.multicast_group}:{self.port}{where}")
+        announcing = None
+        if self._announcement is not None:
+            announcing = self.loop.create_task(self._announce_loop())
+        heartbeat = None
+        if self._heartbeat is not None and self._heartbeat[0] > 0:
+            heartbeat = self.loop.create_task(self._heartbeat_loop(*self._heartbeat))
+        try:
+            await asyncio.Future()
+        finally:
+            for task in (announcing, heartbeat):
+                if task is not None:
+                    task.cancel()
+            reader.close()
+            unicast_reader.close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self) -> None:
+        loop = new_event_loop()
+        try:
+            loop.run_until_complete(self.serve())
+        finally:
+            loop.close()
+            if self._announcement is not None:
+                # 告知 master 本机离开，不必等超时
+                self._send_announcement(status=ANNOUNCE_LEAVING)
+                if self.master_address is not None:
+                    self._send_announcement(self.master_address, ANNOUNCE_LEAVING)
@@ -0,0 +1,286 @@
+"""Background drain of recorder stdout/stderr.
+
+A recorder started with ``stdout=PIPE, stderr=PIPE`` blocks in ``write``
+once the OS pipe buffer (64 KiB on Linux, 4 KiB on some Windows setups)
+fills up and nobody reads it. :class:`LogPump` reads both pipes of every
+registered process for its whole lifetime: the lines go into a bounded ring
+buffer and an optional per-device log file, and known k4arecorder messages
+are turned into :class:`RecorderEvent` objects, the ready signal included,
+so arming is detected from the same stream.
+
+On POSIX a single thread multiplexes every pipe with a selector and sleeps
+in ``select`` between lines. Windows cannot select on pipes, so there each
+stream gets a small blocking reader thread instead.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+RECORDER_READY_SIGNAL = "Waiting for signal from master"
+
+# k4arecorder 输出中需要关注的消息: (事件类型, 正则)，按顺序匹配第一个
+EVENT_PATTERNS: List[Tuple[str, str]] = [
+    ("armed", re.escape(RECORDER_READY_SIGNAL)),
+    ("serial", r"Device serial number: (\S+)"),
+    ("firmware", r"(\w+(?: \w+)?) firmware: ?(\S+)"),
+    ("started", r"^Started recording|^Recording\b"),
+    ("stopping", r"^Stopping recording|^Saving recording"),
+    ("done", r"^Done\b"),
+    ("timeout", r"\btimed? ?out\b"),
+    ("error", r"\[error\]|\berror\b|failed"),
+    ("warning", r"\[warning\]|\bwarning\b"),
+]
+# 合并为一个正则，每行只扫描一次
+EVENT_REGEX = re.compile(
+    "|".join(f"(?P<{kind}>{pattern})" for kind, pattern in EVENT_PATTERNS), re.IGNORECASE
+)
+WARNING_EVENTS = frozenset(("timeout", "error", "warning"))
+LOG_INTERVAL = 1.0  # 同一进程的警告每秒最多打印一条，其余只计数
+
+READ_SIZE = 65536
+KEEP_FINISHED = 64  # 保留最近结束的进程日志，供事后查询
+
+
+@dataclass
+class RecorderEvent:
+    time: float  # time.time()
+    label: str
+    kind: str
+    text: str
+    groups: Tuple[str, ...] = ()
+    ns: int = 0  # perf_counter_ns，与控制面时间戳同一时钟
+
+
+class RecorderLog:
+    """Output of one recorder process: recent lines, parsed events and arm state."""
+
+    def __init__(self, process, label: str, log_path: Optional[str], lines: int, events: int):
+        self.process = process
+        self.label = label
+        self.log_path = log_path
+        self.lines: Deque[Tuple[float, str, str]] = deque(maxlen=lines)  # (time, stream, line)
+        self.events: Deque[RecorderEvent] = deque(maxlen=events)
+        self.line_count = 0
+        self.byte_count = 0
+        self.armed_at: Optional[float] = None  # perf_counter
+        self.warnings = 0  # 警告、错误和超时行数
+        self.suppressed = 0
+        self._last_logged = 0.0
+        self.open_streams = 0
+        self._file = None
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            self._file = open(log_path, "a", encoding="utf-8", buffering=1)
+
+    @property
+    def finished(self) -> bool:
+        return self.open_streams == 0
+
+    def tail(self, count: int = 10, stream: Optional[str] = None) -> List[str]:
+        lines = [line for _, s, line in self.lines if stream is None or s == stream]
+        return lines[-count:]
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class LogPump:
+    """Drains the output pipes of any number of processes in the background."""
+
+    def __init__(
+        self,
+        ring_lines: int = 1000,
+        ring_events: int = 200,
+        on_event: Optional[Callable[[RecorderEvent], None]] = None,
+    ):
+        self.ring_lines = ring_lines
+        self.ring_events = ring_events
+        self.on_event = on_event
+        self._logs: "OrderedDict[int, RecorderLog]" = OrderedDict()
+        self._changed = threading.Condition()
+        self._selector = None
+        self._pending: List[Tuple[int, RecorderLog, str]] = []
+        self._wakeup: Optional[Tuple[int, int]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, process, label: Optional[str] = None, log_path: Optional[str] = None) -> RecorderLog:
+        """Start draining ``process.stdout`` and ``process.stderr`` (whichever are pipes)."""
+        with self._changed:
+            log = self._logs.get(process.pid)
+            if log is not None and log.process is process:
+                return log
+            label = label or f"pid {process.pid}"
+            log = RecorderLog(process, label, log_path, self.ring_lines, self.ring_events)
+            self._logs[process.pid] = log
+            self._prune()
+        streams = [
+            (stream, name)
+            for stream, name in ((process.stdout, "stdout"), (process.stderr, "stderr"))
+            if stream is not None
+        ]
+        log.open_streams = len(streams)
+        if not streams:
+            log._close()
+        for stream, name in streams:
+            if os.name == "posix":
+                self._register(stream.fileno(), log, name)
+            else:
+                threading.Thread(
+                    target=self._read_blocking,
+                    args=(stream, log, name),
+                    name=f"pump-{process.pid}",
+                    daemon=True,
+                ).start()
+        return log
+
+    def get(self, process) -> Optional[RecorderLog]:
+        with self._changed:
+            log = self._logs.get(process.pid)
+        return log if log is not None and log.process is process else None
+
+    def wait_armed(self, processes, started=None, timeout: float = 30.0) -> Dict:
+        """``{process: seconds_until_armed or None}`` once every process armed or closed its output."""
+        now = time.perf_counter()
+        started = started or {}
+        deadline = now + timeout
+        logs = {p: self.get(p) or self.add(p) for p in processes}
+        with self._changed:
+            while True:
+                waiting = [log for log in logs.values() if log.armed_at is None and not log.finished]
+                remaining = deadline - time.perf_counter()
+                if not waiting or remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+        return {
+            p: None if log.armed_at is None else log.armed_at - started.get(p, now)
+            for p, log in logs.items()
+        }
+
+    def _prune(self) -> None:
+        finished = [pid for pid, log in self._logs.items() if log.finished]
+        for pid in finished[: max(0, len(finished) - KEEP_FINISHED)]:
+            del self._logs[pid]
+
+    # 行处理 (在读取线程中执行)
+    def _on_line(self, log: RecorderLog, stream: str, line: str) -> None:
+        line = line.rstrip("\r\n")
+        if not line:
+            return
+        now = time.time()
+        log.lines.append((now, stream, line))
+        log.line_count += 1
+        if log._file is not None:
+            log._file.write(f"{time.strftime('%H:%M:%S', time.localtime(now))} {stream}: {line}\n")
+        match = EVENT_REGEX.search(line)
+        if match is None:
+            return
+        kind = match.lastgroup
+        groups = tuple(g for g in match.groups()[match.lastindex :] if g is not None)
+        event = RecorderEvent(now, log.label, kind, line, groups, time.perf_counter_ns())
+        log.events.append(event)
+        if kind == "armed":
+            log.armed_at = time.perf_counter()
+            logger.info(f"{log.label} (pid {log.process.pid}) - Signal detected!")
+            with self._changed:
+                self._changed.notify_all()
+        elif kind in WARNING_EVENTS:
+            log.warnings += 1
+            if now - log._last_logged >= LOG_INTERVAL:
+                suppressed = f" ({log.suppressed} similar lines suppressed)" if log.suppressed else ""
+                logger.warning(f"{log.label}: {line}{suppressed}")
+                log._last_logged = now
+                log.suppressed = 0
+            else:
+                log.suppressed += 1
+        else:
+            logger.info(f"{log.label}: {line}")
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logger.exception(f"Recorder event handler failed: {e}")
+
+    def _on_eof(self, log: RecorderLog) -> None:
+        with self._changed:
+            log.open_streams -= 1
+            if log.finished:
+                log._close()
+            self._changed.notify_all()
+
+    # Windows: 每个管道一个阻塞读取线程
+    def _read_blocking(self, stream, log: RecorderLog, name: str) -> None:
+        try:
+            for line in iter(stream.readline, ""):
+                log.byte_count += len(line)
+                self._on_line(log, name, line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._on_eof(log)
+
+    # POSIX: 所有管道共用一个 selector 线程
+    def _register(self, fd: int, log: RecorderLog, name: str) -> None:
+        import selectors
+
+        os.set_blocking(fd, False)
+        with self._changed:
+            if self._thread is None:
+                self._selector = selectors.DefaultSelector()
+                self._wakeup = os.pipe()
+                os.set_blocking(self._wakeup[0], False)
+                self._selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+                self._thread = threading.Thread(target=self._run_selector, name="log-pump", daemon=True)
+                self._thread.start()
+            self._pending.append((fd, log, name))
+        os.write(self._wakeup[1], b"\0")
+
+    def _run_selector(self) -> None:
+        import selectors
+
+        selector = self._selector
+        partial: Dict[int, bytes] = {}
+        while True:
+            for key, _ in selector.select():
+                if key.data is None:
+                    try:
+                        os.read(key.fd, 4096)
+                    except BlockingIOError:
+                        pass
+                    with self._changed:
+                        pending, self._pending = self._pending, []
+                    for fd, log, name in pending:
+                        partial[fd] = b""
+                        selector.register(fd, selectors.EVENT_READ, (log, name))
+                    continue
+                log, name = key.data
+                try:
+                    chunk = os.read(key.fd, READ_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    chunk = b""
+                log.byte_count += len(chunk)
+                lines = (partial[key.fd] + chunk).split(b"\n")
+                partial[key.fd] = lines.pop()
+                if len(partial[key.fd]) > READ_SIZE:  # 没有换行的超长输出按一行处理
+                    lines.append(partial[key.fd])
+                    partial[key.fd] = b""
+                if not chunk:  # EOF: 进程已退出
+                    lines.append(partial.pop(key.fd))
+                    selector.unregister(key.fd)
+                for line in lines:
+                    self._on_line(log, name, line.decode("utf-8", "replace"))
+                if not chunk:
+                    self._on_eof(log)
+
+
+# 进程内共享的默认实例
+default_pump = LogPump()
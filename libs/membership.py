@@ -0,0 +1,165 @@
+"""Rig membership: which slaves exist and what they record with.
+
+Slaves announce themselves when they start, answer a master's DISCOVER
+and say goodbye when they shut down. An announcement is a small JSON
+object (see :func:`announcement`) describing the host, its devices and
+the features it supports. The master keeps one :class:`Member` per slave
+process in a :class:`MembershipRegistry`. A member leaves when it says
+so, when the same host and device offset announce again from a new
+process, or when nothing has been heard from it for ``leave_timeout``
+seconds. The registry can then check a session's expected topology
+before starting.
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+ANNOUNCE_PRESENT = 0
+ANNOUNCE_LEAVING = 1
+
+
+def announcement(
+    host: str,
+    devices: int,
+    device_offset: int,
+    sync_delay: int,
+    capabilities: List[str],
+    **extra,
+) -> str:
+    """Text of a slave's announcement."""
+    return json.dumps(
+        dict(
+            host=host,
+            devices=devices,
+            device_offset=device_offset,
+            sync_delay=sync_delay,
+            capabilities=sorted(capabilities),
+            **extra,
+        ),
+        separators=(",", ":"),
+    )
+
+
+@dataclass
+class Member:
+    peer: str
+    host: str
+    devices: int
+    device_offset: int
+    sync_delay: int  # 微秒
+    capabilities: List[str] = field(default_factory=list)
+    joined: int = 0  # now_ns
+    last_seen: int = 0  # 最近一次收到该 slave 任意数据包的时刻
+    extra: Dict = field(default_factory=dict)
+
+    @property
+    def sync_slots(self) -> range:
+        """Sync delay slots taken by this member's devices, see slave.py."""
+        return range(self.device_offset, self.device_offset + self.devices)
+
+
+class MembershipRegistry:
+    """Slaves currently in the rig, keyed by peer (address and reply port)."""
+
+    def __init__(self, leave_timeout: float = 10.0):
+        self.leave_timeout = leave_timeout
+        self.members: Dict[str, Member] = {}
+
+    def announce(self, peer: str, status: int, text: str, now: int) -> Tuple[Optional[Member], List[Member]]:
+        """Apply an announcement; returns ``(joined member or None, members that left)``."""
+        if status == ANNOUNCE_LEAVING:
+            member = self.members.pop(peer, None)
+            return None, [member] if member is not None else []
+        info = json.loads(text)
+        known = {"host", "devices", "device_offset", "sync_delay", "capabilities"}
+        extra = {k: v for k, v in info.items() if k not in known}
+        member = self.members.get(peer)
+        if member is None:
+            member = Member(
+                peer,
+                str(info["host"]),
+                int(info["devices"]),
+                int(info["device_offset"]),
+                int(info["sync_delay"]),
+                list(info.get("capabilities", [])),
+                joined=now,
+                last_seen=now,
+                extra=extra,
+            )
+            self.members[peer] = member
+            joined = member
+        else:
+            # 重复的通告 (例如回应 DISCOVER) 只刷新信息
+            member.devices = int(info["devices"])
+            member.device_offset = int(info["device_offset"])
+            member.sync_delay = int(info["sync_delay"])
+            member.capabilities = list(info.get("capabilities", []))
+            member.extra = extra  # 例如更新后的 arm_estimate_ms
+            member.last_seen = now
+            joined = None
+        # 同一主机上重启的 slave 换了端口，旧的记录立即离开
+        replaced = [
+            m
+            for m in list(self.members.values())
+            if m.host == member.host and m.device_offset == member.device_offset and m.peer != peer
+        ]
+        for old in replaced:
+            del self.members[old.peer]
+        return joined, replaced
+
+    def touch(self, peer: str, now: int) -> None:
+        member = self.members.get(peer)
+        if member is not None:
+            member.last_seen = now
+
+    def expire(self, now: int) -> List[Member]:
+        """Remove and return the members not heard from for ``leave_timeout``."""
+        limit = int(self.leave_timeout * 1e9)
+        gone = [m for m in list(self.members.values()) if now - m.last_seen > limit]
+        for member in gone:
+            del self.members[member.peer]
+        return gone
+
+    @property
+    def device_count(self) -> int:
+        return sum(m.devices for m in list(self.members.values()))
+
+    def validate(
+        self,
+        clients: Optional[int] = None,
+        devices: Optional[int] = None,
+        sync_delay: Optional[int] = None,
+        capabilities: Tuple[str, ...] = (),
+    ) -> List[str]:
+        """Problems of the current rig against the expected topology; empty when it matches.
+
+        ``devices`` is the expected number of devices per slave, as in the
+        master's settings.
+        """
+        problems = []
+        members = self.table()
+        if not members:
+            return ["No slaves have joined"]
+        if clients is not None and len(members) != clients:
+            problems.append(f"Expected {clients} slave(s), {len(members)} joined")
+        for m in members:
+            if devices is not None and m.devices != devices:
+                problems.append(f"{m.host} has {m.devices} device(s), expected {devices}")
+            if sync_delay is not None and m.sync_delay != sync_delay:
+                problems.append(f"{m.host} uses sync delay {m.sync_delay} us, expected {sync_delay} us")
+            missing = [c for c in capabilities if c not in m.capabilities]
+            if missing:
+                problems.append(f"{m.host} lacks {', '.join(missing)}")
+        # 所有设备的同步延迟档位不能重叠，否则红外发射会互相干扰
+        owners: Dict[int, str] = {}
+        for m in members:
+            for slot in m.sync_slots:
+                if slot in owners:
+                    problems.append(f"{m.host} and {owners[slot]} both use sync delay slot {slot}")
+                else:
+                    owners[slot] = m.host
+        return problems
+
+    def table(self) -> List[Member]:
+        # 先复制，调用方可能在控制面线程之外
+        return sorted(list(self.members.values()), key=lambda m: (m.device_offset, m.host))
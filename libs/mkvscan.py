@@ -0,0 +1,473 @@
+"""Structural integrity scan of Matroska recordings.
+
+The file is memory-mapped and walked element by element following the EBML
+sizes; frame payloads are skipped, only the few header bytes of every block
+(track, timestamp, lacing) are read. This finds what a killed or crashed
+k4arecorder leaves behind: elements cut off at the end of the file, a
+segment that was never finalized (unknown size, no Duration, no Cues) and
+cue points pointing past the end of the file.
+"""
+import glob
+import mmap
+import os
+import re
+import struct
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# EBML / Matroska 元素 ID
+EBML = 0x1A45DFA3
+DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+MUXING_APP = 0x4D80
+WRITING_APP = 0x5741
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+TRACK_NAME = 0x536E
+DEFAULT_DURATION = 0x23E383
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CLUSTER = 0x1F43B675
+CLUSTER_TIMESTAMP = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TRACK_POSITIONS = 0xB7
+CUE_CLUSTER_POSITION = 0xF1
+TAGS = 0x1254C367
+ATTACHMENTS = 0x1941A469
+CHAPTERS = 0x1043A770
+TAG = 0x7373
+SIMPLE_TAG = 0x67C8
+TAG_NAME = 0x45A3
+TAG_STRING = 0x4487
+
+# 未知大小的 Cluster 在遇到这些元素时结束
+SEGMENT_CHILDREN = frozenset((SEEK_HEAD, INFO, TRACKS, CLUSTER, CUES, TAGS, ATTACHMENTS, CHAPTERS))
+
+TRACK_TYPES = {1: "video", 2: "audio", 3: "complex", 16: "logo", 17: "subtitle", 18: "buttons", 32: "control"}
+
+DEVICE_FILE = re.compile(r"-Device(\d+)\.mkv$", re.IGNORECASE)
+
+
+class Truncated(Exception):
+    """An element extends past the end of the file."""
+
+
+@dataclass
+class TrackReport:
+    number: int
+    type: str = ""
+    codec: str = ""
+    name: str = ""
+    width: Optional[int] = None
+    height: Optional[int] = None
+    default_duration_ns: Optional[int] = None
+    frames: int = 0
+    dropped: int = 0  # 按 DefaultDuration 推算的缺帧数
+    first_ns: Optional[int] = None
+    last_ns: Optional[int] = None
+
+    @property
+    def duration_s(self) -> Optional[float]:
+        if self.first_ns is None:
+            return None
+        return (self.last_ns - self.first_ns + (self.default_duration_ns or 0)) / 1e9
+
+
+@dataclass
+class ScanReport:
+    path: str
+    size: int = 0
+    device: Optional[int] = None
+    doc_type: str = ""
+    muxing_app: str = ""
+    writing_app: str = ""
+    timestamp_scale: int = 1_000_000
+    duration_s: Optional[float] = None  # Info 中记录的时长，录像正常结束时才会写入
+    clusters: int = 0
+    cue_points: int = 0
+    finalized: bool = False
+    truncated: bool = False
+    tracks: Dict[int, TrackReport] = field(default_factory=dict)
+    tags: Dict[str, str] = field(default_factory=dict)  # 例如 K4A_START_OFFSET_NS
+    issues: List[str] = field(default_factory=list)
+    elapsed_s: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    @property
+    def frames(self) -> int:
+        return sum(t.frames for t in self.tracks.values())
+
+    def to_dict(self) -> Dict:
+        data = asdict(self)
+        data["tracks"] = [dict(asdict(t), duration_s=t.duration_s) for t in self.tracks.values()]
+        data["ok"] = self.ok
+        return data
+
+
+def read_id(buf, pos: int, end: int) -> Tuple[int, int]:
+    """Element ID (marker bit kept) and the position after it."""
+    if pos >= end:
+        raise Truncated(pos)
+    length = 9 - buf[pos].bit_length()
+    if not 1 <= length <= 4:
+        raise ValueError(f"Invalid element ID at {pos}")
+    if pos + length > end:
+        raise Truncated(pos)
+    return int.from_bytes(buf[pos : pos + length], "big"), pos + length
+
+
+def read_vint(buf, pos: int, end: int) -> Tuple[Optional[int], int]:
+    """Variable length integer (marker bit removed); None for the reserved unknown size."""
+    if pos >= end:
+        raise Truncated(pos)
+    first = buf[pos]
+    length = 9 - first.bit_length()
+    if length > 8:
+        raise ValueError(f"Invalid variable length integer at {pos}")
+    if pos + length > end:
+        raise Truncated(pos)
+    value = first & (0xFF >> length)
+    if length > 1:
+        value = (value << (8 * (length - 1))) | int.from_bytes(buf[pos + 1 : pos + length], "big")
+    if value == (1 << (7 * length)) - 1:
+        return None, pos + length
+    return value, pos + length
+
+
+def read_header(buf, pos: int, end: int) -> Tuple[int, int, Optional[int]]:
+    """``(element_id, data_position, size)`` of the element at ``pos``."""
+    element_id, pos = read_id(buf, pos, end)
+    size, pos = read_vint(buf, pos, end)
+    return element_id, pos, size
+
+
+def _uint(buf, pos, end) -> int:
+    return int.from_bytes(buf[pos:end], "big")
+
+
+def _float(buf, pos, end) -> float:
+    return struct.unpack(">f" if end - pos == 4 else ">d", buf[pos:end])[0]
+
+
+def _text(buf, pos, end) -> str:
+    return bytes(buf[pos:end]).rstrip(b"\0").decode("utf-8", "replace")
+
+
+class _Scanner:
+    def __init__(self, buf, size: int, report: ScanReport, collect: Optional[str] = None):
+        self.buf = buf
+        self.size = size
+        self.report = report
+        self.segment_data = 0
+        self.cluster_timestamp = 0
+        # 需要逐帧时间戳的轨道名称，以及收集到的时间戳 (ns)
+        self.collect = collect
+        self.collect_number = None
+        self.timestamps = array("q")
+
+    def children(self, pos: int, end: int):
+        """``(element_id, data_position, data_end)`` of every child of a sized element."""
+        while pos < end:
+            element_id, data, size = read_header(self.buf, pos, end)
+            if size is None or data + size > end:
+                raise Truncated(pos)
+            yield element_id, data, data + size
+            pos = data + size
+
+    def scan(self) -> None:
+        buf, size, report = self.buf, self.size, self.report
+        element_id, data, length = read_header(buf, 0, size)
+        if element_id != EBML:
+            report.issues.append("Not an EBML file")
+            return
+        for child, start, end in self.children(data, data + length):
+            if child == DOC_TYPE:
+                report.doc_type = _text(buf, start, end)
+        if report.doc_type not in ("matroska", "webm"):
+            report.issues.append(f"Unexpected DocType {report.doc_type!r}")
+
+        pos = data + length
+        while pos < size:
+            element_id, data, length = read_header(buf, pos, size)
+            if element_id == SEGMENT:
+                self.segment(data, length)
+                return
+            if length is None:
+                break
+            pos = data + length
+        report.issues.append("No Segment element")
+
+    def segment(self, data: int, length: Optional[int]) -> None:
+        buf, report = self.buf, self.report
+        self.segment_data = data
+        if length is None:
+            # 录像进程被杀死时 Segment 大小停留在 "未知"
+            report.issues.append("Segment size unknown (recording was not finalized)")
+            end = self.size
+        else:
+            end = data + length
+            if end > self.size:
+                report.truncated = True
+                report.issues.append(
+                    f"Segment truncated: {end - self.size} bytes missing at the end of the file"
+                )
+                end = self.size
+            else:
+                report.finalized = True
+
+        seen = set()
+        pos = data
+        while pos < end:
+            try:
+                element_id, data, length = read_header(buf, pos, end)
+            except Truncated:
+                report.truncated = True
+                report.issues.append(f"Element header cut off at offset {pos}")
+                break
+            if element_id == CLUSTER:
+                pos = self.cluster(data, length, end)
+                continue
+            if length is None or data + length > end:
+                report.truncated = True
+                report.issues.append(f"Element 0x{element_id:X} at offset {pos} cut off")
+                break
+            seen.add(element_id)
+            if element_id == INFO:
+                self.info(data, data + length)
+            elif element_id == TRACKS:
+                self.tracks(data, data + length)
+            elif element_id == CUES:
+                self.cues(data, data + length)
+            elif element_id == TAGS:
+                self.tags(data, data + length)
+            pos = data + length
+
+        if INFO in seen and report.duration_s is None:
+            report.finalized = False
+            report.issues.append("Missing Duration in segment Info")
+        if CUES not in seen:
+            report.issues.append("Missing Cues (file cannot be seeked)")
+        if TRACKS not in seen:
+            report.issues.append("Missing Tracks")
+        for track in report.tracks.values():
+            if track.frames == 0:
+                report.issues.append(f"Track {track.number} ({track.name or track.codec}) has no frames")
+
+    def info(self, pos: int, end: int) -> None:
+        buf, report = self.buf, self.report
+        duration = None
+        for element_id, start, stop in self.children(pos, end):
+            if element_id == TIMESTAMP_SCALE:
+                report.timestamp_scale = _uint(buf, start, stop)
+            elif element_id == DURATION:
+                duration = _float(buf, start, stop)
+            elif element_id == MUXING_APP:
+                report.muxing_app = _text(buf, start, stop)
+            elif element_id == WRITING_APP:
+                report.writing_app = _text(buf, start, stop)
+        if duration is not None:
+            # Duration 可能出现在 TimestampScale 之前，最后再换算
+            report.duration_s = duration * report.timestamp_scale / 1e9
+
+    def tracks(self, pos: int, end: int) -> None:
+        buf = self.buf
+        for element_id, start, stop in self.children(pos, end):
+            if element_id != TRACK_ENTRY:
+                continue
+            fields = {}
+            for child, data, data_end in self.children(start, stop):
+                if child == VIDEO:
+                    for video_child, vdata, vend in self.children(data, data_end):
+                        fields[video_child] = (vdata, vend)
+                else:
+                    fields[child] = (data, data_end)
+            if TRACK_NUMBER not in fields:
+                continue
+            track = TrackReport(_uint(buf, *fields[TRACK_NUMBER]))
+            if TRACK_TYPE in fields:
+                kind = _uint(buf, *fields[TRACK_TYPE])
+                track.type = TRACK_TYPES.get(kind, str(kind))
+            if CODEC_ID in fields:
+                track.codec = _text(buf, *fields[CODEC_ID])
+            if TRACK_NAME in fields:
+                track.name = _text(buf, *fields[TRACK_NAME])
+            if DEFAULT_DURATION in fields:
+                track.default_duration_ns = _uint(buf, *fields[DEFAULT_DURATION])
+            if PIXEL_WIDTH in fields:
+                track.width = _uint(buf, *fields[PIXEL_WIDTH])
+            if PIXEL_HEIGHT in fields:
+                track.height = _uint(buf, *fields[PIXEL_HEIGHT])
+            self.report.tracks[track.number] = track
+            if self.collect is not None and self.collect_number is None:
+                if track.name == self.collect or (self.collect == "" and track.type == "video"):
+                    self.collect_number = track.number
+
+    def cluster(self, data: int, length: Optional[int], segment_end: int) -> int:
+        """Scan one cluster; returns the position after it."""
+        buf, report = self.buf, self.report
+        report.clusters += 1
+        sized = length is not None
+        end = data + length if sized else segment_end
+        if end > segment_end:
+            report.truncated = True
+            report.issues.append(f"Cluster at offset {data} cut off")
+            end = segment_end
+        self.cluster_timestamp = 0
+        pos = data
+        while pos < end:
+            try:
+                element_id, start, size = read_header(buf, pos, end)
+            except Truncated:
+                report.truncated = True
+                report.issues.append(f"Block header cut off at offset {pos}")
+                return self.size
+            if not sized and element_id in SEGMENT_CHILDREN:
+                return pos  # 未知大小的 Cluster 到下一个顶层元素为止
+            if size is None or start + size > end:
+                report.truncated = True
+                report.issues.append(f"Block at offset {pos} cut off")
+                return self.size
+            stop = start + size
+            if element_id == CLUSTER_TIMESTAMP:
+                self.cluster_timestamp = _uint(buf, start, stop)
+            elif element_id == SIMPLE_BLOCK:
+                self.block(start, stop)
+            elif element_id == BLOCK_GROUP:
+                for child, block_start, block_stop in self.children(start, stop):
+                    if child == BLOCK:
+                        self.block(block_start, block_stop)
+            pos = stop
+        return end
+
+    def block(self, pos: int, end: int) -> None:
+        buf = self.buf
+        number, pos = read_vint(buf, pos, end)
+        if pos + 3 > end:
+            raise Truncated(pos)
+        relative = int.from_bytes(buf[pos : pos + 2], "big", signed=True)
+        lacing = (buf[pos + 2] >> 1) & 0x03
+        frames = buf[pos + 3] + 1 if lacing and pos + 3 < end else 1
+
+        track = self.report.tracks.get(number)
+        if track is None:
+            track = self.report.tracks[number] = TrackReport(number)
+            self.report.issues.append(f"Blocks for undeclared track {number}")
+        timestamp = (self.cluster_timestamp + relative) * self.report.timestamp_scale
+        if track.last_ns is not None and track.default_duration_ns:
+            gap = timestamp - track.last_ns
+            if gap > track.default_duration_ns * 1.5:
+                track.dropped += round(gap / track.default_duration_ns) - 1
+        if track.first_ns is None or timestamp < track.first_ns:
+            track.first_ns = timestamp
+        if track.last_ns is None or timestamp > track.last_ns:
+            track.last_ns = timestamp
+        track.frames += frames
+        if number == self.collect_number:
+            self.timestamps.append(timestamp)
+
+    def tags(self, pos: int, end: int) -> None:
+        buf = self.buf
+        for element_id, start, stop in self.children(pos, end):
+            if element_id != TAG:
+                continue
+            for child, data, data_end in self.children(start, stop):
+                if child != SIMPLE_TAG:
+                    continue
+                fields = {k: (a, b) for k, a, b in self.children(data, data_end)}
+                if TAG_NAME in fields and TAG_STRING in fields:
+                    self.report.tags[_text(buf, *fields[TAG_NAME])] = _text(buf, *fields[TAG_STRING])
+
+    def cues(self, pos: int, end: int) -> None:
+        last_cluster = 0
+        for element_id, start, stop in self.children(pos, end):
+            if element_id != CUE_POINT:
+                continue
+            self.report.cue_points += 1
+            for child, data, data_end in self.children(start, stop):
+                if child != CUE_TRACK_POSITIONS:
+                    continue
+                for position, value_start, value_end in self.children(data, data_end):
+                    if position == CUE_CLUSTER_POSITION:
+                        last_cluster = max(last_cluster, _uint(self.buf, value_start, value_end))
+        if self.segment_data + last_cluster >= self.size:
+            self.report.issues.append("Cues point past the end of the file")
+
+
+def scan_file(path: str) -> ScanReport:
+    """Scan one recording; problems are reported in ``ScanReport.issues``, never raised."""
+    return _scan(path)[0]
+
+
+def read_timestamps(path: str, track_name: str = "") -> Tuple[ScanReport, array]:
+    """Scan a recording and collect the timestamp (ns) of every frame of one track.
+
+    ``track_name`` selects the track by its Matroska name (k4arecorder writes
+    COLOR, DEPTH, IR and IMU); an empty name takes the first video track.
+    """
+    return _scan(path, track_name)
+
+
+def _scan(path: str, collect: Optional[str] = None) -> Tuple[ScanReport, array]:
+    start = time.perf_counter()
+    timestamps = array("q")
+    report = ScanReport(path)
+    match = DEVICE_FILE.search(path)
+    if match:
+        report.device = int(match.group(1))
+    try:
+        with open(path, "rb") as f:
+            report.size = os.fstat(f.fileno()).st_size
+            if report.size == 0:
+                report.issues.append("Empty file")
+                return report, timestamps
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                scanner = _Scanner(buf, report.size, report, collect)
+                timestamps = scanner.timestamps
+                scanner.scan()
+    except Truncated as e:
+        report.truncated = True
+        report.issues.append(f"File cut off at offset {e.args[0]}")
+    except (OSError, ValueError) as e:
+        report.issues.append(f"Unreadable: {e}")
+    finally:
+        report.elapsed_s = time.perf_counter() - start
+    return report, timestamps
+
+
+def find_recordings(paths: List[str]) -> List[str]:
+    """Expand directories into the ``.mkv`` files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.mkv"))))
+        else:
+            files.append(path)
+    return files
+
+
+def scan_paths(paths: List[str], workers: Optional[int] = None) -> List[ScanReport]:
+    """Scan files and directories, one file per process."""
+    files = find_recordings(paths)
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    if workers <= 1:
+        return [scan_file(path) for path in files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(scan_file, files))
@@ -1,19 +1,17 @@
 import os
 import platform
+import signal
 import subprocess
+import threading
 
 import ctypes
 import sys
 from loguru import logger
-import time
+from libs import logpump, timer
 
 def busy_wait_ms(milliseconds):
-    # 将等待时间转换为秒
-    target_duration = milliseconds / 1000.0
-    # 获取当前时间的高精度计时器值
-    start_time = time.perf_counter()
-    while (time.perf_counter() - start_time) < target_duration:
-        pass  # 忙等待，什么都不做
+    """Legacy alias of :func:`libs.timer.sleep_ms`; it no longer busy-waits."""
+    timer.sleep_ms(milliseconds)
 
 
 def check_admin():
@@ -86,21 +84,89 @@ def check_system_and_set_priority():
         return False
 
 
-def read_until_signal(process: subprocess.Popen):
-    # 持续读取输出，直到检测到目标字符串
+TERMINATE_TIMEOUT = 10.0  # 秒，Windows 上等待录像进程自行结束的时间
+
+
+def terminate_process_tree(process: subprocess.Popen, timeout: float = TERMINATE_TIMEOUT):
+    """Stop ``process`` and its children.
+
+    Recorders are started through a shell, so terminating only the shell
+    would leave k4arecorder running and holding the output pipes open.
+    Processes started with ``start_new_session=True`` on POSIX are signalled
+    as a whole process group, which avoids walking the process table. On
+    Windows a process started in its own process group (see
+    :meth:`libs.recorder.RecorderBackend.spawn`) gets ``CTRL_BREAK_EVENT``
+    so k4arecorder can finalise the file like on Ctrl-C; the tree is only
+    terminated if it is still running ``timeout`` seconds later. Returns
+    without waiting.
+    """
+    if process.poll() is not None:
+        return
+    if os.name == "posix":
+        try:
+            if os.getpgid(process.pid) == process.pid:
+                os.killpg(process.pid, signal.SIGTERM)
+                return
+        except ProcessLookupError:
+            return
+    elif getattr(process, "own_process_group", False):
+        try:
+            process.send_signal(signal.CTRL_BREAK_EVENT)
+        except OSError as e:
+            logger.warning(f"Failed to send CTRL_BREAK_EVENT to pid {process.pid}: {e}")
+        else:
+            timer_thread = threading.Timer(timeout, _terminate_if_running, (process, timeout))
+            timer_thread.daemon = True
+            timer_thread.start()
+            return
+    _kill_tree(process)
+
+
+def _terminate_if_running(process: subprocess.Popen, timeout: float):
+    if process.poll() is None:
+        logger.warning(f"Pid {process.pid} did not exit within {timeout}s of CTRL_BREAK_EVENT, terminating it")
+        _kill_tree(process)
+
+
+def _kill_tree(process: subprocess.Popen):
     try:
-        while True:
-            if process.poll() is None:
-                output = process.stdout.read()
-                logger.debug(f"Pid {process.pid}: {output.strip()}")
-                logger.error(f"Pid {process.pid} is dead with code {process.wait()}")
-                return False
-            output = process.stdout.readline()
-            logger.debug(f"Pid {process.pid}: {output.strip()}")
-            if output == "" and process.poll() is not None:
-                break
-            if "Waiting for signal from master" in output:
-                logger.info(f"Pid {process.pid} - Signal detected!")
-                break
-    except Exception as e:
-        ...
+        import psutil
+        children = psutil.Process(process.pid).children(recursive=True)
+    except ImportError:
+        children = []
+    except Exception:  # 进程已经退出
+        children = []
+    for child in children:
+        try:
+            child.terminate()
+        except Exception:
+            pass
+    if process.poll() is None:
+        process.terminate()
+
+
+def wait_for_signal(processes, started=None, timeout=30.0):
+    """Wait until every process prints the k4arecorder ready signal.
+
+    The output pipes are drained by :data:`libs.logpump.default_pump`, which
+    keeps reading them after arming so a recorder never blocks on a full
+    pipe; processes not registered with it yet are added here. All
+    processes are watched concurrently, so the total wait is the slowest
+    recorder's startup rather than the sum of them. ``started`` maps each
+    process to the ``perf_counter`` time it was spawned (defaults to now).
+    Returns ``{process: seconds_until_armed or None}``; ``None`` means the
+    process exited or did not arm before ``timeout``.
+    """
+    armed = logpump.default_pump.wait_armed(processes, started, timeout)
+    for process, elapsed in armed.items():
+        if elapsed is None:
+            code = process.poll()
+            if code is None:
+                logger.error(f"Pid {process.pid} did not arm within {timeout}s")
+            else:
+                logger.error(f"Pid {process.pid} is dead with code {code}")
+    return armed
+
+
+def read_until_signal(process: subprocess.Popen, timeout=30.0):
+    return wait_for_signal([process], timeout=timeout)[process] is not None
@@ -0,0 +1,252 @@
+"""Wire format of the KinectSync control protocol.
+
+Every datagram starts with a protocol version byte and a message type byte,
+followed by a fixed header precompiled as a :class:`struct.Struct`:
+
+* Commands (master -> slave, multicast ``port``)::
+
+    version:u8 command:u8 name_len:u16 argument:i32 timestamp:i64 seq:u32 name[name_len]
+
+* Replies (slave -> master, unicast ``reply_port``; announcements are also
+  multicast to the group on ``reply_port``)::
+
+    version:u8 msg_type:u8 status:i16 seq:u32 text_len:u16 body text[text_len]
+
+  where ``body`` is fixed per message type (three int64 timestamps for
+  PING/SYNC replies, the :data:`HEARTBEAT` fields for heartbeats, empty
+  otherwise).
+
+Decoders take a ``memoryview`` into a reusable receive buffer and reject
+any datagram whose length does not match its header exactly.
+"""
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from libs.clocksync import now_ns
+
+PROTOCOL_VERSION = 2
+
+# 命令状态码 (master -> slave)
+CMD_START = 1
+CMD_STOP = 2
+CMD_PING = 3
+CMD_CLOCK = 4  # master 推送测得的时钟偏移 (单播)
+CMD_SYNC = 5  # 后台时钟探测，与 PING 相同但不打印日志
+CMD_DISCOVER = 6  # 请求所有 slave 回复通告，参数为回复的分散窗口 (ms)
+# 7-9 和 12 是 slave 主动上报的回复类型，命令不使用这些编号
+CMD_PREPARE = 10  # 启动录像进程并等待全部就绪，但不触发 (两阶段启动的第一步)
+CMD_GO = 11  # 所有设备就绪后触发录像 (第二步)
+
+# 需要确认送达的命令 (带序号，slave 收到后立即回 ACK)
+RELIABLE_COMMANDS = (CMD_START, CMD_STOP, CMD_PREPARE, CMD_GO)
+
+# 回复类型 (slave -> master)。回复类型与命令号是两个独立的编号空间：
+# 只有请求/应答成对的回复才沿用所应答命令的编号，其余回复的编号与命令无关
+# (例如 ACK 是 6，与 DISCOVER 相同，但 DISCOVER 的应答是 ANNOUNCE)
+REPLY_START = CMD_START
+REPLY_STOP = CMD_STOP
+REPLY_PING = CMD_PING
+REPLY_SYNC = CMD_SYNC
+REPLY_PREPARE = CMD_PREPARE
+REPLY_GO = CMD_GO
+REPLY_ACK = 6  # 可靠命令的送达确认，序号与命令相同
+REPLY_RECORDED = 7  # 录像进程退出后主动上报的文件信息 (JSON)
+REPLY_HEARTBEAT = 8  # slave 周期性上报的状态，序号为心跳计数，文本为最近的错误
+REPLY_ANNOUNCE = 9  # slave 的主机信息 (JSON)，启动时组播、回应 DISCOVER、退出时状态为 1
+REPLY_TRACE = 12  # 录像结束后上报的会话时间线分片 (JSON，见 libs.trace)
+
+COMMAND_TYPES = frozenset(
+    (CMD_START, CMD_STOP, CMD_PING, CMD_CLOCK, CMD_SYNC, CMD_DISCOVER, CMD_PREPARE, CMD_GO)
+)
+REPLY_TYPES = frozenset(
+    (
+        REPLY_START,
+        REPLY_STOP,
+        REPLY_PING,
+        REPLY_SYNC,
+        REPLY_ACK,
+        REPLY_RECORDED,
+        REPLY_HEARTBEAT,
+        REPLY_ANNOUNCE,
+        REPLY_PREPARE,
+        REPLY_GO,
+        REPLY_TRACE,
+    )
+)
+COMMAND_NAMES = {
+    CMD_START: "START",
+    CMD_STOP: "STOP",
+    CMD_PING: "PING",
+    CMD_CLOCK: "CLOCK",
+    CMD_SYNC: "SYNC",
+    CMD_DISCOVER: "DISCOVER",
+    CMD_PREPARE: "PREPARE",
+    CMD_GO: "GO",
+}
+
+# 心跳中的 slave 状态
+STATE_IDLE = 0
+STATE_ARMING = 1
+STATE_RECORDING = 2
+STATE_UPLOADING = 3
+STATE_NAMES = {STATE_IDLE: "idle", STATE_ARMING: "arming", STATE_RECORDING: "recording", STATE_UPLOADING: "uploading"}
+
+COMMAND = struct.Struct("!BBHiqI")
+REPLY = struct.Struct("!BBhIH")
+TIMESTAMPS = struct.Struct("!qqq")  # t0 master 发送, t1 slave 接收, t2 slave 发送
+# state, devices, armed, alive, warnings, bytes_written, cpu (0.1%), interval (ms)
+HEARTBEAT = struct.Struct("!BBBBHQHH")
+EMPTY = struct.Struct("")
+REPLY_BODIES: Dict[int, struct.Struct] = {
+    REPLY_PING: TIMESTAMPS,
+    REPLY_SYNC: TIMESTAMPS,
+    REPLY_HEARTBEAT: HEARTBEAT,
+}
+
+MAX_SESSION_NAME = 255  # 字节
+MAX_DATAGRAM = 4096
+MAX_HEARTBEAT_ERROR = 120  # 字符
+
+
+class ProtocolError(ValueError):
+    """A datagram that does not follow the wire format."""
+
+
+@dataclass
+class Command:
+    """A command received by a slave."""
+
+    status: int
+    argument: int
+    session_name: str
+    address: Tuple
+    timestamp: int = 0  # master 时钟 (ns)，例如计划启动时刻
+    seq: int = 0  # 可靠命令或探测包的序号
+    received: int = field(default_factory=now_ns)
+
+
+@dataclass
+class Heartbeat:
+    """Periodic status of a slave."""
+
+    state: int = STATE_IDLE
+    devices: int = 0  # 配置的设备数
+    armed: int = 0  # 已就绪且仍在运行的录像进程
+    alive: int = 0  # 仍在运行的录像进程
+    warnings: int = 0  # 运行中录像进程输出的警告/错误行数
+    bytes_written: int = 0  # 本次录像文件的总大小
+    cpu_percent: float = 0.0  # 录像进程的 CPU 占用 (相对单核)
+    interval_ms: int = 0  # 心跳间隔，master 据此判断超时
+    error: str = ""  # 最近一次错误，只在变化后的几次心跳中携带
+
+    @property
+    def state_name(self) -> str:
+        return STATE_NAMES.get(self.state, str(self.state))
+
+
+@dataclass
+class Reply:
+    """A reply received by the master."""
+
+    address: Tuple
+    status: int
+    msg_type: int
+    msg_text: str
+    seq: int = 0  # 所回复命令的序号
+    stamps: Optional[Tuple[int, int, int]] = None
+    received: int = field(default_factory=now_ns)
+    heartbeat: Optional[Heartbeat] = None
+
+    @property
+    def host(self) -> str:
+        return self.address[0]
+
+    @property
+    def peer(self) -> str:
+        """Identifies one slave process: its address plus reply socket port."""
+        return format_peer(self.address)
+
+
+def format_peer(address: Tuple) -> str:
+    return f"[{address[0]}]:{address[1]}"
+
+
+def pack_command(
+    status: int, argument: int = 0, session_name: str = "", timestamp: int = 0, seq: int = 0
+) -> bytes:
+    name = session_name.encode("utf-8")
+    if len(name) > MAX_SESSION_NAME:
+        raise ProtocolError(f"Session name too long ({len(name)} > {MAX_SESSION_NAME} bytes)")
+    return COMMAND.pack(PROTOCOL_VERSION, status, len(name), argument, timestamp, seq) + name
+
+
+def unpack_command(data: memoryview, address: Tuple) -> Command:
+    if len(data) < COMMAND.size:
+        raise ProtocolError(f"Short command ({len(data)} bytes)")
+    version, status, name_len, argument, timestamp, seq = COMMAND.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if status not in COMMAND_TYPES:
+        raise ProtocolError(f"Unknown command {status}")
+    if len(data) != COMMAND.size + name_len:
+        raise ProtocolError(f"Command length {len(data)} does not match header ({COMMAND.size} + {name_len})")
+    session_name = str(data[COMMAND.size :], "utf-8") if name_len else ""
+    return Command(status, argument, session_name, address, timestamp, seq)
+
+
+def pack_reply(
+    status_code: int,
+    msg_type: int,
+    msg_text: str = "",
+    seq: int = 0,
+    stamps: Optional[Tuple[int, int, int]] = None,
+) -> bytes:
+    text = msg_text.encode("utf-8")
+    body = REPLY_BODIES.get(msg_type, EMPTY)
+    if body is HEARTBEAT:
+        raise ProtocolError("Heartbeats are packed with pack_heartbeat")
+    packed_body = body.pack(*stamps) if body is TIMESTAMPS else b""
+    if REPLY.size + body.size + len(text) > MAX_DATAGRAM:
+        raise ProtocolError(f"Reply text too long ({len(text)} bytes)")
+    return REPLY.pack(PROTOCOL_VERSION, msg_type, status_code, seq, len(text)) + packed_body + text
+
+
+def pack_heartbeat(heartbeat: Heartbeat, seq: int) -> bytes:
+    text = heartbeat.error[:MAX_HEARTBEAT_ERROR].encode("utf-8")
+    body = HEARTBEAT.pack(
+        heartbeat.state,
+        min(heartbeat.devices, 255),
+        min(heartbeat.armed, 255),
+        min(heartbeat.alive, 255),
+        min(heartbeat.warnings, 0xFFFF),
+        heartbeat.bytes_written,
+        min(int(heartbeat.cpu_percent * 10), 0xFFFF),
+        min(heartbeat.interval_ms, 0xFFFF),
+    )
+    return REPLY.pack(PROTOCOL_VERSION, REPLY_HEARTBEAT, 0, seq, len(text)) + body + text
+
+
+def unpack_reply(data: memoryview, address: Tuple) -> Reply:
+    if len(data) < REPLY.size:
+        raise ProtocolError(f"Short reply ({len(data)} bytes)")
+    version, msg_type, status, seq, text_len = REPLY.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if msg_type not in REPLY_TYPES:
+        raise ProtocolError(f"Unknown reply type {msg_type}")
+    body = REPLY_BODIES.get(msg_type, EMPTY)
+    start = REPLY.size + body.size
+    if len(data) != start + text_len:
+        raise ProtocolError(f"Reply length {len(data)} does not match header ({start} + {text_len})")
+    values = body.unpack_from(data, REPLY.size) if body.size else None
+    msg_text = str(data[start:], "utf-8") if text_len else ""
+    reply = Reply(address, status, msg_type, msg_text, seq)
+    if body is TIMESTAMPS:
+        reply.stamps = values
+    elif body is HEARTBEAT:
+        state, devices, armed, alive, warnings, written, cpu, interval_ms = values
+        reply.heartbeat = Heartbeat(
+            state, devices, armed, alive, warnings, written, cpu / 10, interval_ms, msg_text
+        )
+    return reply
@@ -0,0 +1,350 @@
+"""Serial driver for the PWM trigger controller.
+
+The controller takes fixed-length ASCII commands without a terminator,
+``dU<slot>:<duty %>`` and ``FR<slot>:<frequency Hz>`` with three-digit
+values (frequency ``000`` stops the output), and answers every command
+with one line. :class:`PwmController` writes commands as soon as they are
+issued, without waiting for the previous answer. A reader thread takes
+the next line as the answer to the oldest pending command, whatever its
+format; lines matching ``banner_pattern`` (the reset banner) and lines
+arriving while nothing is pending go to ``on_message``. Passing
+``reply_pattern`` (e.g. :data:`REPLY_PATTERN`) makes matching strict: only
+lines matching it answer commands. Controllers that reset
+when the port opens print a banner first and may drop commands during the
+reset, so commands wait ``settle`` seconds after opening.
+
+:meth:`PwmController.start` writes the duty and frequency commands in a
+single write and timestamps the moment the frequency command has left the
+serial port, which is when the sync pulses start within the controller's
+processing time. :class:`FakeController` emulates the controller on a
+pseudo terminal for testing without hardware (POSIX only).
+"""
+import concurrent.futures
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, List, Optional, Tuple
+
+from loguru import logger
+
+from libs.clocksync import now_ns
+
+DEFAULT_BAUDRATE = 9600
+COMMAND_PATTERN = re.compile(r"(dU|FR)(\d):(\d{3})")
+ERROR_PATTERN = re.compile(r"(?i)err|invalid|fail")
+REPLY_PATTERN = re.compile(r"(?i)(ok|err\w*|invalid|fail\w*)\b")  # 严格模式下应答行的开头
+BANNER_PATTERN = re.compile(r"(?i)pwm controller\b.*\bready")  # 控制器复位后打印的 banner，不是应答
+
+
+class PwmError(Exception):
+    """The controller rejected a command, did not answer, or the port failed."""
+
+
+@dataclass
+class PwmAck:
+    command: str
+    reply: str
+    sent_ns: int  # 命令写入串口 (已发送完毕) 的时刻
+    acked_ns: int  # 收到回复的时刻
+
+    @property
+    def ok(self) -> bool:
+        return ERROR_PATTERN.search(self.reply) is None
+
+    @property
+    def latency_ms(self) -> float:
+        return (self.acked_ns - self.sent_ns) / 1e6
+
+
+@dataclass
+class Trigger:
+    """When the sync pulses started, bounded by the write and the acknowledgement."""
+
+    slot: int
+    frequency: int
+    duty: int
+    started_ns: int  # FR 命令发送完毕的时刻，脉冲在控制器处理后开始
+    acked_ns: int
+
+    @property
+    def uncertainty_ms(self) -> float:
+        return (self.acked_ns - self.started_ns) / 1e6
+
+
+def format_command(kind: str, slot: int, value: int) -> str:
+    if not 0 <= value <= 999:
+        raise ValueError(f"{kind} value {value} out of range 0-999")
+    return f"{kind}{slot}:{value:03d}"
+
+
+class _Pending:
+    def __init__(self, command: str, deadline: float):
+        self.command = command
+        self.deadline = deadline  # perf_counter
+        self.sent_ns = 0
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+
+
+class PwmController:
+    """Pipelined command channel to the PWM controller; safe to use from any thread."""
+
+    def __init__(
+        self,
+        port: str,
+        baudrate: int = DEFAULT_BAUDRATE,
+        timeout: float = 1.0,
+        on_message: Optional[Callable[[str], None]] = None,
+        settle: float = 0.0,
+        reply_pattern: Optional["re.Pattern"] = None,
+        banner_pattern: Optional["re.Pattern"] = BANNER_PATTERN,
+    ):
+        self.port = port
+        self.settle = settle
+        self.reply_pattern = reply_pattern
+        self.banner_pattern = banner_pattern
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.on_message = on_message
+        self.trigger: Optional[Trigger] = None  # 最近一次启动
+        self._serial = None
+        self._write_lock = threading.Lock()
+        self._pending: Deque[_Pending] = deque()
+        self._reader: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        self._ready_at = 0.0  # perf_counter
+
+    def open(self) -> "PwmController":
+        import serial
+
+        self._serial = serial.Serial(
+            self.port,
+            self.baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=0.05,  # 读取线程的轮询间隔，用于检查命令超时
+        )
+        self._closed.clear()
+        self._ready_at = time.perf_counter() + self.settle
+        self._reader = threading.Thread(target=self._read_loop, name="pwm-reader", daemon=True)
+        self._reader.start()
+        logger.info(f"PWM controller connected on {self.port} at {self.baudrate} baud")
+        return self
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._reader is not None:
+            self._reader.join()
+            self._reader = None
+        if self._serial is not None:
+            self._serial.close()
+            self._serial = None
+        self._fail_pending(PwmError("Port closed"))
+
+    def __enter__(self) -> "PwmController":
+        return self.open()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def is_open(self) -> bool:
+        return self._serial is not None and self._serial.is_open
+
+    def send(self, *commands: str) -> List[concurrent.futures.Future]:
+        """Write ``commands`` back to back in one write; one future of :class:`PwmAck` each."""
+        if not self.is_open:
+            raise PwmError("PWM controller is not connected")
+        wait = self._ready_at - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        deadline = time.perf_counter() + self.timeout
+        pending = [_Pending(command, deadline) for command in commands]
+        with self._write_lock:
+            # 先登记再写入，回复不会早于登记到达
+            self._pending.extend(pending)
+            try:
+                self._serial.write("".join(commands).encode("ascii"))
+                self._serial.flush()  # 等待数据发送完毕，时间戳才有意义
+            except Exception as e:
+                error = PwmError(f"Write to {self.port} failed: {e}")
+                for p in pending:
+                    self._pending.remove(p)
+                    p.future.set_exception(error)
+                raise error from e
+            sent_ns = now_ns()
+        for p in pending:
+            p.sent_ns = sent_ns
+        return [p.future for p in pending]
+
+    def _check(self, future: concurrent.futures.Future) -> PwmAck:
+        ack = future.result()
+        if not ack.ok:
+            raise PwmError(f"Controller rejected {ack.command}: {ack.reply}")
+        return ack
+
+    def set_duty(self, slot: int, duty: int) -> PwmAck:
+        return self._check(self.send(format_command("dU", slot, duty))[0])
+
+    def set_frequency(self, slot: int, frequency: int) -> PwmAck:
+        return self._check(self.send(format_command("FR", slot, frequency))[0])
+
+    def start(self, slot: int, frequency: int, duty: int = 50) -> Trigger:
+        """Set the duty cycle and start the pulses; returns when the controller acknowledged both."""
+        duty_future, freq_future = self.send(
+            format_command("dU", slot, duty), format_command("FR", slot, frequency)
+        )
+        self._check(duty_future)
+        ack = self._check(freq_future)
+        self.trigger = Trigger(slot, frequency, duty, ack.sent_ns, ack.acked_ns)
+        logger.info(
+            f"Started PWM slot {slot} at {frequency} Hz {duty}% "
+            f"(acknowledged in {ack.latency_ms:.1f} ms: {ack.reply})"
+        )
+        return self.trigger
+
+    def stop(self, slot: int) -> PwmAck:
+        ack = self.set_frequency(slot, 0)
+        logger.info(f"Stopped PWM slot {slot} ({ack.reply})")
+        return ack
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._write_lock:
+            pending, self._pending = self._pending, deque()
+        for p in pending:
+            if not p.future.done():
+                p.future.set_exception(error)
+
+    def _on_line(self, line: str, received_ns: int) -> None:
+        pending = None
+        if self.banner_pattern is not None and self.banner_pattern.match(line):
+            pass
+        elif self.reply_pattern is None or self.reply_pattern.match(line):
+            with self._write_lock:
+                pending = self._pending.popleft() if self._pending else None
+        if pending is None:
+            logger.info(f"PWM controller: {line}")
+            if self.on_message is not None:
+                try:
+                    self.on_message(line)
+                except Exception as e:
+                    logger.exception(f"PWM message handler failed: {e}")
+            return
+        if not pending.future.done():
+            pending.future.set_result(PwmAck(pending.command, line, pending.sent_ns, received_ns))
+
+    def _expire(self) -> None:
+        now = time.perf_counter()
+        expired = []
+        with self._write_lock:
+            while self._pending and self._pending[0].deadline < now:
+                expired.append(self._pending.popleft())
+        for p in expired:
+            p.future.set_exception(PwmError(f"No answer to {p.command} within {self.timeout} s"))
+
+    def _read_loop(self) -> None:
+        buffer = b""
+        while not self._closed.is_set():
+            try:
+                chunk = self._serial.read(max(1, self._serial.in_waiting))
+            except Exception as e:
+                if not self._closed.is_set():
+                    logger.error(f"PWM controller read failed: {e}")
+                    self._fail_pending(PwmError(f"Read from {self.port} failed: {e}"))
+                return
+            received_ns = now_ns()
+            if chunk:
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    text = line.decode("ascii", "replace").strip()
+                    if text:
+                        self._on_line(text, received_ns)
+            self._expire()
+
+
+class FakeController:
+    """PWM controller emulated on a pseudo terminal; open :attr:`port` with :class:`PwmController`."""
+
+    def __init__(
+        self,
+        reply_delay: float = 0.0,
+        banner: Optional[str] = None,
+        banner_delay: float = 0.2,
+        reply_format: str = "OK {name} {slot} {value}",
+        error_format: str = "ERR invalid slot {slot}",
+    ):
+        import tty
+
+        self.reply_delay = reply_delay
+        self.reply_format = reply_format  # 可用字段: command, name (duty/freq), slot, value
+        self.error_format = error_format
+        self.banner = banner  # 启动 banner_delay 秒后主动发送的消息，模拟控制器复位
+        self.banner_delay = banner_delay
+        self.commands: List[Tuple[int, str]] = []  # (处理时刻 now_ns, 命令)
+        self.frequency = {}
+        self.duty = {}
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="fake-pwm", daemon=True)
+        self._thread.start()
+
+    def started_at(self, slot: int) -> Optional[int]:
+        """When the last non-zero frequency command for ``slot`` was processed."""
+        for processed, command in reversed(self.commands):
+            match = COMMAND_PATTERN.fullmatch(command)
+            if match and match.group(1) == "FR" and int(match.group(2)) == slot and int(match.group(3)):
+                return processed
+        return None
+
+    def close(self) -> None:
+        self._closed = True
+        # 先关闭从端使读取返回 EIO，线程退出后再关闭主端，避免线程写入被复用的文件描述符
+        os.close(self._slave)
+        self._thread.join(self.reply_delay + self.banner_delay + 1.0)
+        os.close(self._master)
+
+    def _reply(self, text: str) -> None:
+        if self._closed:
+            return
+        try:
+            os.write(self._master, (text + "\r\n").encode("ascii"))
+        except OSError:
+            pass  # 已关闭
+
+    def _run(self) -> None:
+        if self.banner:
+            time.sleep(self.banner_delay)
+            self._reply(self.banner)
+        buffer = ""
+        while not self._closed:
+            try:
+                data = os.read(self._master, 256)
+            except OSError:
+                return
+            buffer += data.decode("ascii", "replace")
+            while True:
+                match = COMMAND_PATTERN.search(buffer)
+                if match is None:
+                    # 丢弃无法识别的前缀，保留可能是命令开头的部分
+                    buffer = buffer[-6:]
+                    break
+                buffer = buffer[match.end() :]
+                if self.reply_delay:
+                    time.sleep(self.reply_delay)
+                kind, slot, value = match.group(1), int(match.group(2)), int(match.group(3))
+                self.commands.append((now_ns(), match.group(0)))
+                fields = dict(command=match.group(0), name="duty" if kind == "dU" else "freq", slot=slot, value=value)
+                if slot not in (1, 2, 3):
+                    self._reply(self.error_format.format(**fields))
+                    continue
+                if kind == "dU":
+                    self.duty[slot] = value
+                else:
+                    self.frequency[slot] = value
+                self._reply(self.reply_format.format(**fields))
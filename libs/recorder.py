@@ -0,0 +1,144 @@
+"""Recorder backends: how one recording process per device is started.
+
+A :class:`RecordingSpec` describes one device's recording. A backend turns
+it into a process. Every backend returns a ``Popen`` with text
+stdout/stderr pipes, so the log pump, the resource sampler and
+:func:`libs.processutils.terminate_process_tree` handle it the same way.
+:class:`K4aRecorder` runs the Azure Kinect ``k4arecorder.exe`` through the
+shell. :class:`SimulatedRecorder` runs :mod:`libs.simrecorder` with the
+same options, so the whole control path can run on a machine without
+Kinects.
+"""
+import abc
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+SYNC_MASTER = "Master"
+SYNC_SUBORDINATE = "Subordinate"
+SYNC_STANDALONE = "Standalone"
+
+
+@dataclass
+class RecordingSpec:
+    device: int
+    output: str
+    record_time: int  # 秒
+    sync_mode: str = SYNC_SUBORDINATE
+    sync_delay: int = 0  # 微秒，只对 Subordinate 有效
+    depth_mode: str = "WFOV_2X2BINNED"
+    color_mode: str = "1080p"
+    fps: int = 30
+
+
+class RecorderBackend(abc.ABC):
+    """Starts the recorder of one device; subclasses provide :meth:`command`."""
+
+    name = ""
+
+    def arguments(self, spec: RecordingSpec) -> List[str]:
+        """k4arecorder options for ``spec``, without the output file."""
+        arguments = ["--device", str(spec.device), "--external-sync", spec.sync_mode]
+        if spec.sync_mode == SYNC_SUBORDINATE:
+            arguments += ["--sync-delay", str(spec.sync_delay)]
+        arguments += ["-d", spec.depth_mode, "-c", spec.color_mode, "-r", str(spec.fps)]
+        return arguments + ["-l", str(spec.record_time)]
+
+    @abc.abstractmethod
+    def command(self, spec: RecordingSpec) -> Union[str, List[str]]:
+        """Command line starting the recorder, a string when run through the shell."""
+
+    def popen_options(self) -> Dict:
+        return {}
+
+    def spawn(self, spec: RecordingSpec, new_session: bool = True) -> subprocess.Popen:
+        """Start the recorder; ``new_session`` puts it in its own process group.
+
+        On Windows the group lets :func:`libs.processutils.terminate_process_tree`
+        stop the shell and the recorder with ``CTRL_BREAK_EVENT``.
+        """
+        options = self.popen_options()
+        if new_session and sys.platform == "win32":
+            options["creationflags"] = options.get("creationflags", 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+        process = subprocess.Popen(
+            self.command(spec),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            start_new_session=new_session,
+            **options,
+        )
+        process.own_process_group = new_session  # Popen 不记录 creationflags
+        return process
+
+
+class K4aRecorder(RecorderBackend):
+    """The Azure Kinect SDK recorder, run through the shell in ``recorder_path``."""
+
+    name = "k4a"
+
+    def __init__(self, recorder_path: Optional[str] = None, executable: str = "k4arecorder.exe"):
+        self.recorder_path = recorder_path
+        self.executable = executable
+
+    def command(self, spec: RecordingSpec) -> str:
+        return " ".join([self.executable, *self.arguments(spec), f'"{spec.output}"'])
+
+    def popen_options(self) -> Dict:
+        return {"shell": True, "cwd": self.recorder_path}
+
+
+class SimulatedRecorder(RecorderBackend):
+    """:mod:`libs.simrecorder` in place of k4arecorder; see there for what is simulated."""
+
+    name = "sim"
+
+    def __init__(
+        self,
+        startup: float = 1.5,
+        startup_jitter: float = 0.3,
+        bitrate: Optional[float] = None,
+        fail_rate: float = 0.0,
+        drop_rate: float = 0.0,
+        trigger_file: Optional[str] = None,
+    ):
+        self.startup = startup
+        self.startup_jitter = startup_jitter
+        self.bitrate = bitrate  # MB/s，None 时按分辨率计算
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.trigger_file = trigger_file  # 文件出现时开始录像，模拟同步信号
+
+    def command(self, spec: RecordingSpec) -> List[str]:
+        command = [sys.executable, "-m", "libs.simrecorder", *self.arguments(spec)]
+        command += ["--startup", str(self.startup), "--startup-jitter", str(self.startup_jitter)]
+        if self.bitrate:
+            command += ["--bitrate", str(self.bitrate)]
+        if self.fail_rate:
+            command += ["--fail-rate", str(self.fail_rate)]
+        if self.drop_rate:
+            command += ["--drop-rate", str(self.drop_rate)]
+        if self.trigger_file:
+            command += ["--trigger-file", self.trigger_file]
+        return command + [spec.output]
+
+    def popen_options(self) -> Dict:
+        # 以模块方式运行，工作目录保持不变 (输出路径可能是相对路径)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        path = os.environ.get("PYTHONPATH")
+        env = dict(os.environ, PYTHONPATH=root + (os.pathsep + path if path else ""))
+        return {"env": env}
+
+
+RECORDERS = {K4aRecorder.name: K4aRecorder, SimulatedRecorder.name: SimulatedRecorder}
+
+
+def create_recorder(name: str, recorder_path: Optional[str] = None, **options) -> RecorderBackend:
+    """Backend by name; ``recorder_path`` is used by k4a, ``options`` by the simulator."""
+    if name == K4aRecorder.name:
+        return K4aRecorder(recorder_path)
+    if name == SimulatedRecorder.name:
+        return SimulatedRecorder(**options)
+    raise ValueError(f"Unknown recorder {name!r}, expected one of {', '.join(RECORDERS)}")
@@ -0,0 +1,276 @@
+"""Resource usage of the recorders on a slave.
+
+:class:`ResourceSampler` polls every tracked recorder (including the
+children of the shell it was started through) and the slave itself at a
+fixed interval with psutil. Each process keeps its last ``capacity``
+samples in a ring buffer, and running aggregates per session are updated
+on every sample, so a summary covers the whole session even after the ring
+has wrapped. A sample costs a few ``/proc`` reads per process on Linux,
+grouped with ``Process.oneshot()``.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+from loguru import logger
+
+KEEP_SESSIONS = 16  # 保留最近几次录像的统计
+
+
+@dataclass
+class ResourceSample:
+    time: float  # time.time()
+    cpu_percent: float  # 相对单核，多线程可超过 100
+    rss: int  # 字节
+    write_bytes: Optional[int]  # 累计写入字节，平台不支持时为 None
+    write_rate: Optional[float]  # 字节/秒
+    threads: int
+
+
+class SeriesStats:
+    """Running aggregates of the samples of one process."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0  # 采样覆盖的总时长 (秒)
+        self.cpu_sum = 0.0
+        self.cpu_max = 0.0
+        self.rss_max = 0
+        self.threads_max = 0
+        self.written = 0
+        self.write_rate_max = 0.0
+
+    def update(self, sample: ResourceSample, written: int, interval: float) -> None:
+        self.count += 1
+        self.duration += interval
+        self.cpu_sum += sample.cpu_percent
+        self.cpu_max = max(self.cpu_max, sample.cpu_percent)
+        self.rss_max = max(self.rss_max, sample.rss)
+        self.threads_max = max(self.threads_max, sample.threads)
+        self.written += written
+        if sample.write_rate is not None:
+            self.write_rate_max = max(self.write_rate_max, sample.write_rate)
+
+    def summary(self) -> Dict:
+        return {
+            "samples": self.count,
+            "cpu_mean": round(self.cpu_sum / self.count, 1) if self.count else None,
+            "cpu_max": round(self.cpu_max, 1),
+            "rss_max_mb": round(self.rss_max / 1e6, 1),
+            "threads_max": self.threads_max,
+            "written_mb": round(self.written / 1e6, 1),
+            "write_mbps_mean": round(self.written / self.duration / 1e6, 2) if self.duration else None,
+            "write_mbps_max": round(self.write_rate_max / 1e6, 2),
+        }
+
+
+class _Tracked:
+    def __init__(self, process, label: str, session: Optional[str], capacity: int, children: bool = True):
+        import psutil
+
+        self.popen = process if hasattr(process, "poll") else None
+        self.pid = process.pid if self.popen is not None else int(process)
+        self.label = label
+        self.session = session
+        self.samples: Deque[ResourceSample] = deque(maxlen=capacity)
+        self.finished = False
+        self.children = children
+        self._root = psutil.Process(self.pid)
+        self._children: Dict[int, "psutil.Process"] = {}
+        # 每个进程上次的 (cpu 秒, 写入字节)，按进程累加差值，子进程退出不会让总量倒退
+        self._last: Dict[int, tuple] = {}
+        self._last_time: Optional[float] = None
+
+    def _processes(self):
+        import psutil
+
+        if not self.children:
+            return [self._root]
+        try:
+            # 录像进程通过 shell 启动，k4arecorder 是它的子进程
+            children = self._root.children(recursive=True)
+        except psutil.Error:
+            children = []
+        alive = {}
+        for child in children:
+            alive[child.pid] = self._children.get(child.pid, child)
+        self._children = alive
+        return [self._root, *alive.values()]
+
+    def sample(self, now: float, perf: float) -> Optional[tuple]:
+        """Take one sample; returns ``(sample, bytes_written, interval)`` since the last one.
+
+        Returns None on the first call, which only primes the counters, and
+        once the process has exited.
+        """
+        import psutil
+
+        if self.popen is not None and self.popen.poll() is not None:
+            self.finished = True
+            return None
+        cpu = 0.0
+        written = 0
+        rss = 0
+        threads = 0
+        io_supported = False
+        seen = {}
+        for process in self._processes():
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    rss += process.memory_info().rss
+                    threads += process.num_threads()
+                    try:
+                        write_bytes = process.io_counters().write_bytes
+                        io_supported = True
+                    except (AttributeError, psutil.AccessDenied):
+                        write_bytes = 0
+            except psutil.NoSuchProcess:
+                if process is self._root:
+                    self.finished = True
+                    return None
+                continue
+            except psutil.AccessDenied:
+                continue
+            total_cpu = times.user + times.system
+            seen[process.pid] = (total_cpu, write_bytes)
+            last = self._last.get(process.pid)
+            if last is None and self._last_time is not None:
+                last = (0.0, 0)  # 两次采样之间新出现的子进程
+            if last is not None:
+                cpu += max(0.0, total_cpu - last[0])
+                written += max(0, write_bytes - last[1])
+        self._last = seen
+        interval = None if self._last_time is None else perf - self._last_time
+        self._last_time = perf
+        if not interval:
+            return None
+        cumulative = (self.samples[-1].write_bytes or 0) + written if self.samples else 0
+        sample = ResourceSample(
+            time=now,
+            cpu_percent=cpu / interval * 100,
+            rss=rss,
+            write_bytes=cumulative if io_supported else None,
+            write_rate=written / interval if io_supported else None,
+            threads=threads,
+        )
+        self.samples.append(sample)
+        return sample, written, interval
+
+
+class ResourceSampler:
+    """Samples CPU, RSS, written bytes and threads of tracked processes in a background thread."""
+
+    def __init__(self, interval: float = 1.0, capacity: int = 3600, include_self: bool = True):
+        self.interval = interval
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._tracked: List[_Tracked] = []
+        self._sessions: "OrderedDict[str, Dict[str, SeriesStats]]" = OrderedDict()
+        self._self: Optional[_Tracked] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if include_self:
+            self._self = _Tracked(os.getpid(), "slave", None, capacity, children=False)
+
+    def start(self) -> None:
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def track(self, process, label: str, session: Optional[str] = None) -> None:
+        """Sample ``process`` (a ``Popen`` or a pid) and its children until it exits."""
+        import psutil
+
+        try:
+            tracked = _Tracked(process, label, session, self.capacity)
+        except psutil.Error as e:
+            logger.warning(f"Cannot sample {label}: {e}")
+            return
+        with self._lock:
+            self._tracked.append(tracked)
+            if session is not None and session not in self._sessions:
+                self._sessions[session] = {}
+                while len(self._sessions) > KEEP_SESSIONS:
+                    self._sessions.popitem(last=False)
+
+    def sample_once(self) -> None:
+        now = time.time()
+        perf = time.perf_counter()
+        with self._lock:
+            tracked = list(self._tracked)
+        active = set()
+        for item in tracked:
+            if item.finished:
+                continue
+            result = item.sample(now, perf)
+            if result is None:
+                continue
+            if item.session is not None:
+                active.add(item.session)
+                self._stats(item.session, item.label).update(*result)
+        if self._self is not None:
+            result = self._self.sample(now, perf)
+            # slave 自身的开销计入当前正在录像的每个会话
+            if result is not None:
+                for session in active:
+                    self._stats(session, self._self.label).update(*result)
+        with self._lock:
+            # 已退出的进程不再采样，但保留其时间序列直到会话被淘汰
+            # 会话被淘汰后其进程即使仍在运行也不再采样
+            kept = self._sessions
+            self._tracked = [t for t in self._tracked if t.session in kept or (t.session is None and not t.finished)]
+
+    def _stats(self, session: str, label: str) -> SeriesStats:
+        with self._lock:
+            labels = self._sessions.get(session)
+            if labels is None:  # 会话已被淘汰，统计丢弃
+                return SeriesStats()
+            stats = labels.get(label)
+            if stats is None:
+                stats = labels[label] = SeriesStats()
+            return stats
+
+    def _run(self) -> None:
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self.sample_once()
+            except Exception as e:
+                logger.exception(f"Resource sampling failed: {e}")
+            next_at += self.interval
+            delay = next_at - time.perf_counter()
+            if delay < 0:  # 采样落后时不补采
+                next_at = time.perf_counter()
+                delay = 0
+            self._stop.wait(delay)
+
+    def series(self, label: str, session: Optional[str] = None) -> List[ResourceSample]:
+        """Samples still in the ring buffer of the latest process with ``label``."""
+        with self._lock:
+            if self._self is not None and label == self._self.label:
+                return list(self._self.samples)
+            for item in reversed(self._tracked):
+                if item.label == label and (session is None or item.session == session):
+                    return list(item.samples)
+        return []
+
+    def active_cpu(self) -> float:
+        """Summed latest CPU usage (percent of one core) of the tracked processes still running."""
+        with self._lock:
+            return sum(t.samples[-1].cpu_percent for t in self._tracked if not t.finished and t.samples)
+
+    def summary(self, session: str) -> Dict[str, Dict]:
+        """``{label: aggregates}`` over every sample taken while ``session`` was recording."""
+        with self._lock:
+            labels = dict(self._sessions.get(session, {}))
+        return {label: stats.summary() for label, stats in sorted(labels.items())}
@@ -0,0 +1,310 @@
+"""Simulated k4arecorder for running the rig without Kinects.
+
+Takes the k4arecorder options the slaves pass and behaves like the real
+recorder on the outside. After a device start-up delay it prints the
+serial number and, in subordinate mode, the "Waiting for signal from
+master" line. It then starts on the trigger and writes a Matroska file
+with COLOR, DEPTH and IR tracks. Frame sizes follow the configured modes,
+and frames are written one by one in real time, so disk and CPU load match
+a real device. Frames are timestamped on a grid shared by every simulated
+device of the host: the monotonic clock rounded to the frame period, plus
+the sync delay, like cameras driven by one sync signal. A recorder that
+falls behind drops frames instead of queueing them.
+
+Ctrl-C (SIGINT, or SIGBREAK on Windows) or the end of ``-l`` finalizes the file as k4arecorder
+does. Any other termination leaves a file without Cues, Duration and
+segment size, as a killed k4arecorder would.
+
+Run as ``python -m libs.simrecorder --device 0 --external-sync Subordinate -l 10 out.mkv``.
+"""
+import argparse
+import os
+import random
+import signal
+import socket
+import struct
+import sys
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+from libs.clocksync import now_ns
+
+# 深度模式的分辨率 (DEPTH 与 IR 轨道都是 16 位)
+DEPTH_MODES = {
+    "NFOV_2X2BINNED": (320, 288),
+    "NFOV_UNBINNED": (640, 576),
+    "WFOV_2X2BINNED": (512, 512),
+    "WFOV_UNBINNED": (1024, 1024),
+    "PASSIVE_IR": (1024, 1024),
+    "OFF": None,
+}
+COLOR_MODES = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "1536p": (2048, 1536),
+    "2160p": (3840, 2160),
+    "3072p": (4096, 3072),
+    "OFF": None,
+}
+MJPEG_BYTES_PER_PIXEL = 0.12  # k4arecorder 的 MJPEG 彩色帧约为像素数的 12%
+LATE_FRAMES = 3  # 落后超过这么多帧时丢帧
+
+READY_SIGNAL = "[subordinate mode] Waiting for signal from master"
+TIMESTAMP_SCALE = 1000  # 纳秒，与 k4arecorder 相同 (块时间戳单位为微秒)
+UNKNOWN_SIZE = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+
+
+def _id(element_id: int) -> bytes:
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+
+
+def _size(n: int, length: Optional[int] = None) -> bytes:
+    if length is None:
+        length = 1
+        while n >= (1 << (7 * length)) - 1:
+            length += 1
+    return ((1 << (7 * length)) | n).to_bytes(length, "big")
+
+
+def element(element_id: int, payload: bytes) -> bytes:
+    return _id(element_id) + _size(len(payload)) + payload
+
+
+def uint_element(element_id: int, value: int) -> bytes:
+    return element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def text_element(element_id: int, value: str) -> bytes:
+    return element(element_id, value.encode("utf-8"))
+
+
+def frame_sizes(depth_mode: str, color_mode: str) -> List[Tuple[str, str, int, int, int]]:
+    """``(name, codec, width, height, bytes per frame)`` of every track the modes record."""
+    tracks = []
+    color = COLOR_MODES[color_mode]
+    if color is not None:
+        tracks.append(("COLOR", "V_MJPEG", *color, int(color[0] * color[1] * MJPEG_BYTES_PER_PIXEL)))
+    depth = DEPTH_MODES[depth_mode]
+    if depth is not None:
+        size = depth[0] * depth[1] * 2
+        if depth_mode != "PASSIVE_IR":
+            tracks.append(("DEPTH", "V_MS/VFW/FOURCC", *depth, size))
+        tracks.append(("IR", "V_MS/VFW/FOURCC", *depth, size))
+    return tracks
+
+
+class MkvWriter:
+    """Writes a recording the way k4arecorder lays it out: one cluster per frame, Cues and Tags at the end."""
+
+    def __init__(self, path: str, tracks, frame_period_ns: int, app: str = "k4arecorder (simulated)"):
+        self.file = open(path, "wb")
+        self.tracks = tracks
+        self.frame_period_ns = frame_period_ns
+        self.cues: List[Tuple[int, int]] = []  # (时间戳, Cluster 相对 Segment 数据的位置)
+        self.frames = 0
+        self.last_timestamp = 0
+        self.payload = os.urandom(max((t[4] for t in tracks), default=0) * 2 or 1)
+
+        header = element(
+            0x1A45DFA3,
+            uint_element(0x4286, 1)
+            + uint_element(0x42F7, 1)
+            + uint_element(0x42F2, 4)
+            + uint_element(0x42F3, 8)
+            + text_element(0x4282, "matroska")
+            + uint_element(0x4287, 4)
+            + uint_element(0x4285, 2),
+        )
+        self.file.write(header)
+        self.segment_size_at = self.file.tell() + 4
+        self.file.write(_id(0x18538067) + UNKNOWN_SIZE)
+        self.segment_data = self.file.tell()
+        # Duration 先用 Void 占位，结束时原地改写 (两者都是 11 字节)
+        info = (
+            uint_element(0x2AD7B1, TIMESTAMP_SCALE)
+            + text_element(0x4D80, "libebml")
+            + text_element(0x5741, app)
+        )
+        self.file.write(_id(0x1549A966) + _size(len(info) + 11) + info)
+        self.duration_at = self.file.tell()
+        self.file.write(element(0xEC, bytes(9)))
+        entries = b""
+        for number, (name, codec, width, height, _) in enumerate(tracks, 1):
+            entries += element(
+                0xAE,
+                uint_element(0xD7, number)
+                + uint_element(0x73C5, number)
+                + uint_element(0x83, 1)
+                + text_element(0x86, codec)
+                + text_element(0x536E, name)
+                + uint_element(0x23E383, frame_period_ns)
+                + element(0xE0, uint_element(0xB0, width) + uint_element(0xBA, height)),
+            )
+        self.file.write(element(0x1654AE6B, entries))
+        self.file.flush()
+
+    def write_frame(self, timestamp_ns: int, scale: float = 1.0) -> int:
+        """Append one frame of every track; returns the bytes written."""
+        timestamp = timestamp_ns // TIMESTAMP_SCALE
+        blocks = []
+        size = 0
+        for number, track in enumerate(self.tracks, 1):
+            length = int(track[4] * scale)
+            if track[0] == "COLOR":
+                length = int(length * random.uniform(0.9, 1.1))  # MJPEG 帧大小随画面变化
+            head = _size(number) + struct.pack(">hB", 0, 0x80)
+            blocks.append((_id(0xA3) + _size(len(head) + length, 4) + head, length))
+            size += 5 + len(head) + length
+        cluster_time = uint_element(0xE7, timestamp)
+        size += len(cluster_time)
+        self.cues.append((timestamp, self.file.tell() - self.segment_data))
+        self.file.write(_id(0x1F43B675) + _size(size, 8) + cluster_time)
+        for head, length in blocks:
+            if length > len(self.payload):
+                self.payload = os.urandom(length)
+            self.file.write(head)
+            self.file.write(memoryview(self.payload)[:length])
+        self.frames += 1
+        self.last_timestamp = timestamp
+        return size + 12
+
+    def finalize(self, tags) -> None:
+        cue_points = b"".join(
+            element(
+                0xBB,
+                uint_element(0xB3, timestamp)
+                + element(0xB7, uint_element(0xF7, 1) + uint_element(0xF1, position)),
+            )
+            for timestamp, position in self.cues
+        )
+        self.file.write(element(0x1C53BB6B, cue_points))
+        simple_tags = b"".join(
+            element(0x67C8, text_element(0x45A3, name) + text_element(0x4487, str(value)))
+            for name, value in tags.items()
+        )
+        self.file.write(element(0x1254C367, element(0x7373, element(0x63C0, b"") + simple_tags)))
+        end = self.file.tell()
+        duration = self.last_timestamp + self.frame_period_ns / TIMESTAMP_SCALE if self.frames else 0.0
+        self.file.seek(self.duration_at)
+        self.file.write(_id(0x4489) + _size(8) + struct.pack(">d", duration))
+        self.file.seek(self.segment_size_at)
+        self.file.write(_size(end - self.segment_data, 8))
+        self.file.close()
+
+
+def serial_number(device: int) -> str:
+    # 同一主机上同一设备号的序列号保持不变
+    return f"{zlib.crc32(socket.gethostname().encode()) % 10**9:09d}{device:03d}"
+
+
+def wait_for_trigger(trigger_file: Optional[str], stopped) -> Optional[int]:
+    """Monotonic time of the trigger, read from ``trigger_file`` once it exists; now without one."""
+    if not trigger_file:
+        return now_ns()
+    while not stopped():
+        try:
+            with open(trigger_file) as f:
+                text = f.read().strip()
+        except OSError:
+            time.sleep(0.005)
+            continue
+        return int(text) if text.isdigit() else now_ns()
+    return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--device", type=int, default=0)
+    parser.add_argument("--external-sync", default="Standalone", choices=["Master", "Subordinate", "Standalone"])
+    parser.add_argument("--sync-delay", type=int, default=0, help="Microseconds")
+    parser.add_argument("-d", "--depth-mode", default="NFOV_UNBINNED", choices=list(DEPTH_MODES))
+    parser.add_argument("-c", "--color-mode", default="1080p", choices=list(COLOR_MODES))
+    parser.add_argument("-r", "--rate", type=int, default=30, choices=[5, 15, 30])
+    parser.add_argument("-l", "--record-length", type=int, default=0, help="Seconds, 0 records until Ctrl-C")
+    parser.add_argument("--startup", type=float, default=1.5, help="Seconds to open and start the device")
+    parser.add_argument("--startup-jitter", type=float, default=0.3)
+    parser.add_argument("--bitrate", type=float, default=None, help="MB/s instead of the modes' own bitrate")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Probability that the device fails to start")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Probability of dropping each frame")
+    parser.add_argument("--trigger-file", default=None, help="Start when this file exists")
+    parser.add_argument("output")
+    args = parser.parse_args(argv)
+
+    stop = []
+    signal.signal(signal.SIGINT, lambda *_: stop.append(True))
+    if hasattr(signal, "SIGBREAK"):  # Windows 上 terminate_process_tree 发送 CTRL_BREAK_EVENT
+        signal.signal(signal.SIGBREAK, lambda *_: stop.append(True))
+
+    def say(text: str, stream=sys.stdout) -> None:
+        print(text, file=stream, flush=True)
+
+    tracks = frame_sizes(args.depth_mode, args.color_mode)
+    period_ns = 1_000_000_000 // args.rate
+    scale = 1.0
+    if args.bitrate:
+        natural = sum(t[4] for t in tracks) * args.rate
+        scale = args.bitrate * 1e6 / natural if natural else 1.0
+
+    # 打开设备和启动相机各占一部分启动时间
+    startup = max(0.0, args.startup + random.uniform(-args.startup_jitter, args.startup_jitter))
+    time.sleep(startup * 0.4)
+    serial = serial_number(args.device)
+    say(f"Device serial number: {serial}")
+    say("Device version: Rgb: 1.6.110, Depth: 1.6.79[6109.7], Audio: 1.6.14")
+    if random.random() < args.fail_rate:
+        say("[error] k4a_device_start_cameras() failed", sys.stderr)
+        say("Runtime error: k4a_device_start_cameras() returned failure", sys.stderr)
+        return 1
+    writer = MkvWriter(args.output, tracks, period_ns)
+    time.sleep(startup * 0.6)
+    say("Device started")
+
+    subordinate = args.external_sync == "Subordinate"
+    if subordinate:
+        say(READY_SIGNAL)
+    trigger_ns = wait_for_trigger(args.trigger_file if subordinate else None, lambda: bool(stop))
+    started = trigger_ns is not None
+    if started:
+        # 第一帧落在帧周期网格上，再加上本设备的同步延迟
+        first_ns = -(-trigger_ns // period_ns) * period_ns + args.sync_delay * 1000
+        say("Started recording")
+        say("Press Ctrl-C to stop recording.")
+        total = args.record_length * args.rate
+        index = 0
+        dropped = 0
+        while not stop and (not total or index < total):
+            due = first_ns + index * period_ns
+            delay = due - now_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+            elif -delay > LATE_FRAMES * period_ns:
+                dropped += 1
+                index += 1
+                continue
+            if random.random() < args.drop_rate:
+                dropped += 1
+            else:
+                writer.write_frame(due - first_ns, scale)
+            index += 1
+        if dropped:
+            say(f"[warning] Dropped {dropped} of {index} frames", sys.stderr)
+    say("Stopping recording...")
+    say("Saving recording...")
+    writer.finalize(
+        {
+            "K4A_DEVICE_SERIAL_NUMBER": serial,
+            "K4A_COLOR_MODE": f"MJPG_{args.color_mode.upper()}" if COLOR_MODES[args.color_mode] else "OFF",
+            "K4A_DEPTH_MODE": args.depth_mode,
+            "K4A_WIRED_SYNC_MODE": args.external_sync.upper(),
+            "K4A_SUBORDINATE_DELAY_OFF_MASTER_NS": args.sync_delay * 1000,
+            "K4A_START_OFFSET_NS": first_ns if started else 0,
+        }
+    )
+    say("Done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
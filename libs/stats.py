@@ -0,0 +1,230 @@
+"""Streaming latency statistics with fixed memory per slave, and arm time estimates."""
+import math
+from array import array
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of latencies in nanoseconds.
+
+    Buckets are geometrically spaced between ``min_ns`` and ``max_ns`` so the
+    relative error of a percentile is bounded (about 6% with 20 buckets per
+    decade) while the memory stays fixed no matter how many samples arrive.
+    """
+
+    def __init__(self, min_ns: int = 1_000, max_ns: int = 10_000_000_000, buckets_per_decade: int = 20):
+        self.min_ns = min_ns
+        self.buckets_per_decade = buckets_per_decade
+        self.size = int(math.ceil(math.log10(max_ns / min_ns) * buckets_per_decade)) + 2
+        self.counts = array("Q", bytes(8 * self.size))
+        self.count = 0
+        self.total_ns = 0
+        self.min_value: Optional[int] = None
+        self.max_value: Optional[int] = None
+
+    def _bucket(self, value_ns: int) -> int:
+        if value_ns < self.min_ns:
+            return 0
+        index = int(math.log10(value_ns / self.min_ns) * self.buckets_per_decade) + 1
+        return min(index, self.size - 1)
+
+    def _bucket_value(self, index: int) -> float:
+        # 桶的几何中点
+        if index == 0:
+            return self.min_ns
+        return self.min_ns * 10 ** ((index - 0.5) / self.buckets_per_decade)
+
+    def record(self, value_ns: int) -> None:
+        self.counts[self._bucket(value_ns)] += 1
+        self.count += 1
+        self.total_ns += value_ns
+        if self.min_value is None or value_ns < self.min_value:
+            self.min_value = value_ns
+        if self.max_value is None or value_ns > self.max_value:
+            self.max_value = value_ns
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Approximate ``p``-th percentile (0-100) in nanoseconds."""
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                value = self._bucket_value(index)
+                return min(max(value, self.min_value), self.max_value)
+        return float(self.max_value)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total_ns / self.count if self.count else None
+
+
+class ProbeStats:
+    """Round trip statistics of one slave: histogram, jitter and loss."""
+
+    def __init__(self, late_ns: int = 1_000_000_000, dedup_window: int = 256):
+        self.histogram = LatencyHistogram()
+        self.late_ns = late_ns
+        self.sent = 0
+        self.received = 0
+        self.late = 0
+        self.duplicates = 0
+        self.jitter_ns = 0.0
+        self.last_rtt: Optional[int] = None
+        self._recent: Deque[int] = deque(maxlen=dedup_window)
+
+    def on_sent(self) -> None:
+        self.sent += 1
+
+    def on_reply(self, seq: int, rtt_ns: int) -> None:
+        if seq in self._recent:
+            self.duplicates += 1
+            return
+        self._recent.append(seq)
+        self.received += 1
+        # 首次出现的 slave 回复的探测包发出时还不在已知列表中
+        self.sent = max(self.sent, self.received)
+        if rtt_ns > self.late_ns:
+            self.late += 1
+            return
+        self.histogram.record(rtt_ns)
+        if self.last_rtt is not None:
+            # RFC 3550 式平滑抖动
+            self.jitter_ns += (abs(rtt_ns - self.last_rtt) - self.jitter_ns) / 16
+        self.last_rtt = rtt_ns
+
+    @property
+    def loss_rate(self) -> float:
+        if self.sent == 0:
+            return 0.0
+        on_time = self.received - self.late
+        return max(0.0, 1 - on_time / self.sent)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        """Milliseconds everywhere, loss as a fraction."""
+        h = self.histogram
+
+        def ms(value):
+            return None if value is None else value / 1e6
+
+        return {
+            "sent": self.sent,
+            "received": self.received,
+            "min_ms": ms(h.min_value),
+            "p50_ms": ms(h.percentile(50)),
+            "p99_ms": ms(h.percentile(99)),
+            "max_ms": ms(h.max_value),
+            "jitter_ms": ms(self.jitter_ns),
+            "loss": self.loss_rate,
+        }
+
+
+class ProbeStatsTable:
+    """Per-slave :class:`ProbeStats`, keyed by peer."""
+
+    def __init__(self):
+        self.stats: Dict[str, ProbeStats] = {}
+
+    def get(self, peer: str) -> ProbeStats:
+        stats = self.stats.get(peer)
+        if stats is None:
+            stats = self.stats[peer] = ProbeStats()
+        return stats
+
+    def on_probe_sent(self, peers: Iterable[str]) -> None:
+        """A multicast probe is expected to be answered by every known slave."""
+        for peer in peers:
+            self.get(peer).on_sent()
+
+    def on_reply(self, peer: str, seq: int, rtt_ns: int) -> None:
+        self.get(peer).on_reply(seq, rtt_ns)
+
+    def table(self) -> List[Dict]:
+        return [dict(peer=peer, **stats.summary()) for peer, stats in sorted(self.stats.items())]
+
+
+SKEW_FLOOR_MS = 10.0  # 定时器和调度误差
+
+
+class ArmTimeEstimate:
+    """Arm time of one device over recent runs: exponentially weighted mean and variance.
+
+    ``estimate_ms`` is the mean plus ``k`` standard deviations, so a
+    recorder spawned that long before the scheduled time is armed in time
+    in most runs; until ``min_samples`` runs were seen it is at least the
+    slowest run so far. Spawning ``estimate_ms`` early, the armed time
+    should land within ``skew_bound_ms`` of the scheduled time.
+    """
+
+    def __init__(self, initial_ms: float, alpha: float = 0.25, k: float = 3.0, min_samples: int = 3):
+        self.initial_ms = initial_ms
+        self.alpha = alpha
+        self.k = k
+        self.min_samples = min_samples
+        self.count = 0
+        self.mean_ms = 0.0
+        self.var_ms2 = 0.0
+        self.max_ms: Optional[float] = None
+
+    def record(self, ms: float) -> None:
+        if self.count == 0:
+            self.mean_ms = ms
+        else:
+            # 指数加权的均值和方差 (增量形式)
+            diff = ms - self.mean_ms
+            increment = self.alpha * diff
+            self.mean_ms += increment
+            self.var_ms2 = (1 - self.alpha) * (self.var_ms2 + diff * increment)
+        self.count += 1
+        self.max_ms = ms if self.max_ms is None else max(self.max_ms, ms)
+
+    @property
+    def margin_ms(self) -> float:
+        return self.k * math.sqrt(self.var_ms2)
+
+    @property
+    def estimate_ms(self) -> float:
+        if self.count == 0:
+            return self.initial_ms
+        estimate = self.mean_ms + self.margin_ms
+        if self.count < self.min_samples:
+            return max(estimate, self.max_ms)
+        return estimate
+
+    @property
+    def skew_bound_ms(self) -> Optional[float]:
+        """Expected ``|armed - scheduled|``; ``None`` until ``min_samples`` runs were seen."""
+        if self.count < self.min_samples:
+            return None
+        # 就绪时刻落在 [均值 - margin, 均值 + margin]，提前量是均值 + margin
+        return 2 * self.margin_ms + SKEW_FLOOR_MS
+
+
+
+class ArmTimeEstimates:
+    """Per-device :class:`ArmTimeEstimate`; a host is armed when its slowest device is."""
+
+    def __init__(self, initial_ms: float, **options):
+        self.initial_ms = initial_ms
+        self.options = options
+        self.devices: Dict[int, ArmTimeEstimate] = {}
+
+    def record(self, device: int, ms: float) -> None:
+        estimate = self.devices.get(device)
+        if estimate is None:
+            estimate = self.devices[device] = ArmTimeEstimate(self.initial_ms, **self.options)
+        estimate.record(ms)
+
+    @property
+    def estimate_ms(self) -> float:
+        return max((d.estimate_ms for d in self.devices.values()), default=self.initial_ms)
+
+    @property
+    def skew_bound_ms(self) -> Optional[float]:
+        bounds = [d.skew_bound_ms for d in self.devices.values()]
+        if not bounds or None in bounds:
+            return None
+        return max(bounds)
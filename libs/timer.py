@@ -0,0 +1,120 @@
+"""High precision waits without burning a core.
+
+A wait is split in two: a coarse sleep that gives the CPU (and the GIL)
+away until shortly before the deadline, and a short spin for the remaining
+slice. On Linux the coarse part is an absolute ``clock_nanosleep`` on
+CLOCK_MONOTONIC, the same clock as :func:`time.perf_counter_ns`, so the
+kernel wakes us relative to the deadline itself rather than to when the
+call was made. Elsewhere :func:`time.sleep` is used, which on Windows is
+backed by a high resolution waitable timer since Python 3.11.
+"""
+import ctypes
+import ctypes.util
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from libs.stats import LatencyHistogram
+
+CLOCK_MONOTONIC = 1
+TIMER_ABSTIME = 1
+EINTR = 4
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _load_clock_nanosleep():
+    if not sys.platform.startswith("linux"):
+        return None
+    if time.get_clock_info("perf_counter").implementation != "clock_gettime(CLOCK_MONOTONIC)":
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        func = libc.clock_nanosleep
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(_timespec), ctypes.c_void_p]
+    func.restype = ctypes.c_int
+    return func
+
+
+_clock_nanosleep = _load_clock_nanosleep()
+
+# Windows 的定时器唤醒误差明显更大，需要更长的自旋
+DEFAULT_SPIN_NS = 200_000 if _clock_nanosleep is not None else 1_500_000
+
+
+def _coarse_sleep_until(deadline_ns: int) -> None:
+    if _clock_nanosleep is not None:
+        ts = _timespec(deadline_ns // 1_000_000_000, deadline_ns % 1_000_000_000)
+        # ctypes 调用期间释放 GIL
+        while _clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, ctypes.byref(ts), None) == EINTR:
+            pass
+    else:
+        remaining = deadline_ns - time.perf_counter_ns()
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+
+
+class PreciseTimer:
+    """Sleeps until a ``perf_counter_ns`` deadline and records the wake-up error.
+
+    ``spin_ns`` is the slice before the deadline that is spun instead of
+    slept: longer slices absorb more scheduler wake-up jitter at the cost of
+    CPU time. Only the spin holds the GIL, so other threads of the process
+    keep running for the rest of the wait.
+    """
+
+    def __init__(self, spin_ns: int = DEFAULT_SPIN_NS):
+        self.spin_ns = spin_ns
+        self.errors = LatencyHistogram(min_ns=100)
+        self._lock = threading.Lock()
+
+    def sleep_until_ns(self, deadline_ns: int) -> int:
+        """Return once ``perf_counter_ns() >= deadline_ns``; returns the lateness in ns."""
+        coarse_deadline = deadline_ns - self.spin_ns
+        if coarse_deadline > time.perf_counter_ns():
+            _coarse_sleep_until(coarse_deadline)
+        now = time.perf_counter_ns()
+        while now < deadline_ns:
+            now = time.perf_counter_ns()
+        error = now - deadline_ns
+        with self._lock:
+            self.errors.record(error)
+        return error
+
+    def sleep_ns(self, duration_ns: int) -> int:
+        return self.sleep_until_ns(time.perf_counter_ns() + duration_ns)
+
+    def sleep_ms(self, milliseconds: float) -> int:
+        return self.sleep_ns(int(milliseconds * 1_000_000))
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """Wake-up error statistics in microseconds."""
+        h = self.errors
+
+        def us(value):
+            return None if value is None else value / 1e3
+
+        return {
+            "count": h.count,
+            "mean_us": us(h.mean),
+            "p50_us": us(h.percentile(50)),
+            "p99_us": us(h.percentile(99)),
+            "max_us": us(h.max_value),
+        }
+
+
+# 进程内共享的默认定时器
+default_timer = PreciseTimer()
+
+
+def sleep_until_ns(deadline_ns: int) -> int:
+    return default_timer.sleep_until_ns(deadline_ns)
+
+
+def sleep_ms(milliseconds: float) -> int:
+    return default_timer.sleep_ms(milliseconds)
@@ -0,0 +1,224 @@
+"""Session timelines of the whole rig, exported as a Chrome trace.
+
+Master and slaves record the phases of a session in a :class:`Timeline`.
+Phases include commands sent and received, waits, recorder spawn, arming,
+trigger, stop and exit. Each is a span or an instant on the host's own
+monotonic clock (:func:`libs.clocksync.now_ns`). Recording only appends a
+tuple; nothing is formatted until the timeline is shipped.
+
+Once a session's recorders have exited, a slave sends its timeline to the
+master in ``REPLY_TRACE`` datagrams (:meth:`Timeline.chunks`). The master
+keeps them in a :class:`TraceStore` next to its own timeline of the session.
+:func:`chrome_trace` moves every slave's timestamps onto the master clock
+with the offset measured for that slave. The result is the Chrome trace
+event format, which chrome://tracing and https://ui.perfetto.dev open.
+"""
+import json
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from libs.clocksync import ClockEstimate, now_ns
+
+TRACK_CONTROL = "control"
+CHUNK_BYTES = 3800  # 留出回复头部，保证一个数据包装得下
+
+# (名称, 轨道, 开始时刻, 结束时刻 (瞬时事件为 None), 参数)
+Event = Tuple[str, str, int, Optional[int], Optional[Dict]]
+
+
+class Timeline:
+    """Spans and instants of one session on one host; safe to append from any thread."""
+
+    def __init__(self, session: str, limit: int = 10000):
+        self.session = session
+        self.limit = limit
+        self.events: List[Event] = []
+        self.dropped = 0
+
+    def _add(self, event: Event) -> None:
+        if len(self.events) < self.limit:
+            self.events.append(event)  # list.append 是原子操作
+        else:
+            self.dropped += 1
+
+    def instant(self, name: str, track: str = TRACK_CONTROL, at_ns: Optional[int] = None, **args) -> None:
+        self._add((name, track, now_ns() if at_ns is None else at_ns, None, args or None))
+
+    def span(
+        self, name: str, start_ns: int, end_ns: Optional[int] = None, track: str = TRACK_CONTROL, **args
+    ) -> None:
+        """A finished span; ``end_ns`` defaults to now."""
+        self._add((name, track, start_ns, now_ns() if end_ns is None else end_ns, args or None))
+
+    @contextmanager
+    def measure(self, name: str, track: str = TRACK_CONTROL, **args) -> Iterator[None]:
+        start = now_ns()
+        try:
+            yield
+        finally:
+            self.span(name, start, None, track, **args)
+
+    def chunks(self, max_bytes: int = CHUNK_BYTES) -> List[str]:
+        """The events as JSON texts of at most ``max_bytes`` bytes, one per datagram."""
+        session = json.dumps(self.session, ensure_ascii=False)
+        budget = max_bytes - len(session.encode("utf-8")) - 40  # 头部: 会话名、分片序号和总数
+        parts: List[List[str]] = [[]]
+        size = 0
+        for event in list(self.events):
+            text = json.dumps(list(event), separators=(",", ":"), ensure_ascii=False, default=str)
+            length = len(text.encode("utf-8")) + 1
+            if length > budget:
+                self.dropped += 1
+                continue
+            if parts[-1] and size + length > budget:
+                parts.append([])
+                size = 0
+            parts[-1].append(text)
+            size += length
+        return [
+            f'{{"s":{session},"i":{i},"n":{len(parts)},"e":[{",".join(events)}]}}'
+            for i, events in enumerate(parts)
+        ]
+
+
+def parse_chunk(text: str) -> Tuple[str, int, int, List[Event]]:
+    """``(session, part, parts, events)`` of one chunk; raises ValueError when malformed."""
+    data = json.loads(text)
+    try:
+        events = [
+            (
+                str(name),
+                str(track),
+                int(start),
+                None if end is None else int(end),
+                args if isinstance(args, dict) else None,
+            )
+            for name, track, start, end, args in data["e"]
+        ]
+        return str(data["s"]), int(data["i"]), int(data["n"]), events
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Bad trace chunk: {e}") from e
+
+
+class TraceStore:
+    """Master side: its own timeline and the slaves' timelines of the last ``keep`` sessions."""
+
+    def __init__(self, keep: int = 16):
+        self.keep = keep
+        self.local: "OrderedDict[str, Timeline]" = OrderedDict()
+        # 会话 -> slave -> 分片序号 -> 事件
+        self.remote: "OrderedDict[str, Dict[str, Dict[int, List[Event]]]]" = OrderedDict()
+        self.parts: Dict[Tuple[str, str], int] = {}  # (会话, slave) -> 分片总数
+
+    def timeline(self, session: str) -> Timeline:
+        timeline = self.local.get(session)
+        if timeline is None:
+            timeline = self.local[session] = Timeline(session)
+            while len(self.local) > self.keep:
+                self.local.popitem(last=False)
+        return timeline
+
+    def add_chunk(self, peer: str, text: str) -> Tuple[str, bool]:
+        """Store a slave's chunk; returns ``(session, whether that slave's timeline is complete)``."""
+        session, part, parts, events = parse_chunk(text)
+        slaves = self.remote.get(session)
+        if slaves is None:
+            slaves = self.remote[session] = {}
+            while len(self.remote) > self.keep:
+                old, _ = self.remote.popitem(last=False)
+                self.parts = {k: v for k, v in self.parts.items() if k[0] != old}
+        held = slaves.get(peer)
+        if held is None or part in held or len(held) == self.parts.get((session, peer)):
+            # 同一会话再次上报 (例如重复录像) 时以新的为准
+            # 分片可能乱序到达，序号 0 不一定最先到
+            slaves[peer] = {}
+        slaves[peer][part] = events
+        self.parts[(session, peer)] = parts
+        return session, len(slaves[peer]) == parts
+
+    def sessions(self) -> List[str]:
+        return list(OrderedDict.fromkeys(list(self.local) + list(self.remote)))
+
+    def events(self, session: str) -> Dict[str, List[Event]]:
+        """Every slave's events of ``session``, as received so far."""
+        return {
+            peer: [event for part in sorted(parts) for event in parts[part]]
+            for peer, parts in list(self.remote.get(session, {}).items())
+        }
+
+    def incomplete(self, session: str) -> List[str]:
+        """Slaves of ``session`` whose timeline is missing chunks."""
+        return sorted(
+            peer
+            for peer, parts in list(self.remote.get(session, {}).items())
+            if len(parts) != self.parts.get((session, peer), 0)
+        )
+
+
+def chrome_trace(
+    session: str,
+    master: Optional[Timeline],
+    slaves: Dict[str, List[Event]],
+    clocks: Dict[str, Optional[ClockEstimate]],
+    names: Optional[Dict[str, str]] = None,
+) -> Dict:
+    """Chrome trace (JSON object format) of a session on the master's clock.
+
+    ``clocks`` holds the clock estimate of every slave; events of a slave
+    without one keep their own clock and the process is marked unaligned.
+    ``names`` maps peers to readable process names (e.g. the host name).
+    """
+    names = names or {}
+    processes: List[Tuple[str, List[Event], Optional[ClockEstimate], bool]] = []
+    if master is not None:
+        processes.append(("master", list(master.events), None, True))
+    for peer in sorted(slaves, key=lambda p: (names.get(p, p), p)):
+        estimate = clocks.get(peer)
+        name = f"{names[peer]} {peer}" if peer in names else peer
+        processes.append((name, slaves[peer], estimate, estimate is not None))
+
+    def aligned(ns: int, estimate: Optional[ClockEstimate]) -> int:
+        return ns if estimate is None else estimate.to_master(ns)
+
+    starts = [aligned(e[2], estimate) for _, events, estimate, _ in processes for e in events]
+    origin = min(starts, default=0)
+    trace_events = []
+    for pid, (name, events, estimate, is_aligned) in enumerate(processes, 1):
+        label = name if is_aligned else f"{name} (clock not aligned)"
+        trace_events.append({"ph": "M", "pid": pid, "name": "process_name", "args": {"name": label}})
+        trace_events.append({"ph": "M", "pid": pid, "name": "process_sort_index", "args": {"sort_index": pid}})
+        tracks: Dict[str, int] = {}
+        for event_name, track, start, end, args in events:
+            tid = tracks.get(track)
+            if tid is None:
+                tid = tracks[track] = len(tracks) + 1
+                trace_events.append({"ph": "M", "pid": pid, "tid": tid, "name": "thread_name", "args": {"name": track}})
+            ts = (aligned(start, estimate) - origin) / 1e3  # 微秒
+            event = {"name": event_name, "pid": pid, "tid": tid, "ts": round(ts, 3)}
+            if end is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=round(max(0, end - start) / 1e3, 3))
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+    return {
+        "traceEvents": trace_events,
+        "displayTimeUnit": "ms",
+        "otherData": {
+            "session": session,
+            "origin_ns": origin,  # master 时钟
+            "clocks": {
+                peer: None
+                if e is None
+                else {"offset_ms": e.offset_ns / 1e6, "rtt_ms": e.delay_ns / 1e6, "drift_ppm": e.drift_ppm}
+                for peer, e in sorted(clocks.items())
+            },
+        },
+    }
+
+
+def save_trace(trace: Dict, path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(trace, f, separators=(",", ":"))
@@ -0,0 +1,592 @@
+"""Chunked transfer of finished recordings to a collection node.
+
+A file is cut into fixed size chunks that are sent over several TCP
+connections at once, with ``socket.sendfile`` (zero-copy ``os.sendfile``
+where the platform has it). Every chunk carries its SHA-256 so a corrupted
+chunk is retried alone, and the collector journals each verified chunk next
+to the partial file, so an interrupted transfer resumes where it stopped.
+The file is renamed into place only once the digest over all chunk digests
+matches the sender's.
+
+Every request starts with the same header::
+
+    version:u8 op:u8 name_len:u16 file_size:u64 offset:u64 length:u64 digest[32] name[name_len]
+
+``OP_QUERY`` asks which chunks of ``length`` bytes the collector already
+holds, ``OP_CHUNK`` is followed by ``length`` bytes of data and
+``OP_COMMIT`` finalizes the file. Responses are ``status:i8 count:u32``
+followed by ``count`` u64 chunk offsets (``OP_QUERY`` only). A query
+carries the file's root digest; the collector answers ``STATUS_COMPLETE``
+only if it holds a file of that size and digest (a query without a digest
+from older senders is matched by size alone).
+"""
+import hashlib
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+TRANSFER_VERSION = 1
+DEFAULT_TRANSFER_PORT = 4330
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+OP_QUERY = 1
+OP_CHUNK = 2
+OP_COMMIT = 3
+
+STATUS_OK = 0
+STATUS_COMPLETE = 1  # 目标文件已存在且大小和校验和一致
+STATUS_CHECKSUM = -1
+STATUS_ERROR = -2
+
+REQUEST = struct.Struct("!BBHQQQ32s")
+RESPONSE = struct.Struct("!bI")
+OFFSET = struct.Struct("!Q")
+JOURNAL = struct.Struct("!QQ32s")  # offset, length, sha256
+
+PART_SUFFIX = ".part"
+JOURNAL_SUFFIX = ".chunks"
+IO_BUFFER = 1024 * 1024
+SOCKET_BUFFER = 4 * 1024 * 1024
+IDLE_GAP_NS = 5_000_000_000
+
+
+class TransferError(Exception):
+    """A transfer request the peer could not complete."""
+
+
+def recv_exact(sock: socket.socket, view: memoryview) -> None:
+    while view:
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("Connection closed by peer")
+        view = view[n:]
+
+
+def chunk_ranges(size: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """``(offset, length)`` of every chunk; an empty file is one empty chunk."""
+    if size == 0:
+        return [(0, 0)]
+    return [(offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)]
+
+
+def root_digest(chunk_digests: List[bytes]) -> bytes:
+    """Digest of a whole file from its chunk digests in offset order."""
+    return hashlib.sha256(b"".join(chunk_digests)).digest()
+
+
+def hash_chunk(f, offset: int, length: int, buffer: bytearray) -> bytes:
+    digest = hashlib.sha256()
+    view = memoryview(buffer)
+    f.seek(offset)
+    remaining = length
+    while remaining:
+        n = f.readinto(view[: min(remaining, len(view))])
+        if not n:
+            raise TransferError(f"File shrank while reading chunk at {offset}")
+        digest.update(view[:n])
+        remaining -= n
+    return digest.digest()
+
+
+def file_digest(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """Hex root digest of a file, the value the collector verifies on commit."""
+    buffer = bytearray(IO_BUFFER)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        digests = [hash_chunk(f, offset, length, buffer) for offset, length in chunk_ranges(size, chunk_size)]
+    return root_digest(digests).hex()
+
+
+def pack_request(
+    op: int, name: str, file_size: int = 0, offset: int = 0, length: int = 0, digest: bytes = b""
+) -> bytes:
+    encoded = name.encode("utf-8")
+    return REQUEST.pack(TRANSFER_VERSION, op, len(encoded), file_size, offset, length, digest) + encoded
+
+
+def parse_address(text: str, default_port: int) -> Tuple[str, int]:
+    """Split ``host``, ``host:port``, ``[v6]:port`` or a bare IPv6 address."""
+    if text.startswith("["):
+        host, _, rest = text[1:].partition("]")
+        return host, int(rest[1:]) if rest.startswith(":") else default_port
+    if text.count(":") == 1:
+        host, port = text.split(":")
+        return host, int(port)
+    return text, default_port
+
+
+def _safe_relative_path(name: str) -> str:
+    # 远端名称形如 "<主机名>/<文件名>"，拒绝绝对路径和 ".."
+    parts = name.replace("\\", "/").split("/")
+    if not name or name.startswith(("/", "\\")) or any(p in ("", ".", "..") for p in parts) or ":" in name:
+        raise TransferError(f"Invalid file name {name!r}")
+    return os.path.join(*parts)
+
+
+@dataclass
+class HostStats:
+    bytes: int = 0
+    chunks: int = 0
+    files: int = 0
+    retries: int = 0
+    active_ns: int = 0  # 有数据在传输的总时长，不计两次传输之间的空闲
+    first_ns: int = 0
+    last_ns: int = 0
+
+    def on_chunk(self, length: int, started_ns: int, finished_ns: int) -> None:
+        if not self.first_ns or started_ns - self.last_ns > IDLE_GAP_NS:
+            self.active_ns += self.last_ns - self.first_ns
+            self.first_ns = started_ns
+        self.last_ns = max(self.last_ns, finished_ns)
+        self.bytes += length
+        self.chunks += 1
+
+    @property
+    def throughput_mbps(self) -> float:
+        elapsed = (self.active_ns + self.last_ns - self.first_ns) / 1e9
+        return self.bytes / elapsed / 1e6 if elapsed > 0 else 0.0
+
+
+class _PartialFile:
+    """Collector side state of one file being received."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.lock = threading.Lock()
+        self.chunks: Dict[int, Tuple[int, bytes]] = {}
+        self._load_journal()
+        with open(self.part_path, "ab") as f:
+            if f.tell() != size:
+                f.truncate(size)
+
+    @property
+    def part_path(self) -> str:
+        return self.path + PART_SUFFIX
+
+    @property
+    def journal_path(self) -> str:
+        return self.path + JOURNAL_SUFFIX
+
+    def _load_journal(self) -> None:
+        if not os.path.exists(self.journal_path):
+            return
+        if not os.path.exists(self.part_path) or os.path.getsize(self.part_path) != self.size:
+            # 文件大小变了，旧的进度作废
+            os.remove(self.journal_path)
+            return
+        with open(self.journal_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % JOURNAL.size  # 丢弃写到一半的记录
+        for offset, length, digest in JOURNAL.iter_unpack(data[:usable]):
+            self.chunks[offset] = (length, digest)
+
+    @property
+    def chunk_size(self) -> Optional[int]:
+        """Length of the first held chunk, the sender's chunk size."""
+        with self.lock:
+            first = self.chunks.get(0)
+        return None if first is None else first[0]
+
+    def matching(self, chunk_size: int) -> List[int]:
+        """Offsets of held chunks that line up with ``chunk_size``; others are forgotten."""
+        expected = dict(chunk_ranges(self.size, chunk_size))
+        with self.lock:
+            for offset, (length, _) in list(self.chunks.items()):
+                if expected.get(offset) != length:
+                    del self.chunks[offset]
+            return sorted(self.chunks)
+
+    def record(self, offset: int, length: int, digest: bytes) -> None:
+        with self.lock:
+            with open(self.journal_path, "ab") as f:
+                f.write(JOURNAL.pack(offset, length, digest))
+            self.chunks[offset] = (length, digest)
+
+    def digest(self) -> Optional[bytes]:
+        """Root digest if the held chunks tile the whole file, else None."""
+        with self.lock:
+            position = 0
+            digests = []
+            for offset in sorted(self.chunks):
+                length, digest = self.chunks[offset]
+                if offset != position:
+                    return None
+                digests.append(digest)
+                position += length
+        if position != self.size or not digests:
+            return None
+        return root_digest(digests)
+
+    def discard(self) -> None:
+        with self.lock:
+            self.chunks.clear()
+            for path in (self.journal_path, self.part_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class _CollectorHandler(socketserver.BaseRequestHandler):
+    server: "CollectorServer"
+
+    def setup(self):
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        self.header = bytearray(REQUEST.size)
+        self.buffer = bytearray(IO_BUFFER)
+
+    def handle(self):
+        try:
+            while True:
+                view = memoryview(self.header)
+                n = self.request.recv_into(view)
+                if n == 0:
+                    return
+                recv_exact(self.request, view[n:])
+                version, op, name_len, file_size, offset, length, digest = REQUEST.unpack(self.header)
+                name = bytearray(name_len)
+                recv_exact(self.request, memoryview(name))
+                if version != TRANSFER_VERSION:
+                    raise TransferError(f"Unsupported transfer version {version}")
+                name = name.decode("utf-8")
+                if op == OP_QUERY:
+                    self.on_query(name, file_size, length, digest)
+                elif op == OP_CHUNK:
+                    self.on_chunk(name, file_size, offset, length, digest)
+                elif op == OP_COMMIT:
+                    self.on_commit(name, file_size, digest)
+                else:
+                    raise TransferError(f"Unknown transfer op {op}")
+        except (ConnectionError, TransferError, UnicodeDecodeError) as e:
+            logger.warning(f"Transfer connection from {self.client_address[0]} closed: {e}")
+
+    def respond(self, status: int, offsets: Tuple[int, ...] = ()):
+        self.request.sendall(
+            RESPONSE.pack(status, len(offsets)) + b"".join(OFFSET.pack(o) for o in offsets)
+        )
+
+    def on_query(self, name, file_size, chunk_size, digest):
+        path = self.server.local_path(name)
+        if os.path.exists(path) and os.path.getsize(path) == file_size:
+            if not any(digest) or self.server.digest(path, chunk_size) == digest:
+                self.respond(STATUS_COMPLETE)
+                return
+            logger.warning(f"{name} differs from the collected file of the same size, receiving it again")
+        partial = self.server.partial(name, path, file_size)
+        self.respond(STATUS_OK, tuple(partial.matching(chunk_size)))
+
+    def on_chunk(self, name, file_size, offset, length, digest):
+        started = time.perf_counter_ns()
+        path = self.server.local_path(name)
+        partial = self.server.partial(name, path, file_size)
+        if offset + length > file_size:
+            raise TransferError(f"Chunk {offset}+{length} beyond end of {name}")
+        received = hashlib.sha256()
+        view = memoryview(self.buffer)
+        with open(partial.part_path, "r+b") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining:
+                n = self.request.recv_into(view[: min(remaining, len(view))])
+                if n == 0:
+                    raise ConnectionError("Connection closed in the middle of a chunk")
+                received.update(view[:n])
+                f.write(view[:n])
+                remaining -= n
+            f.flush()
+            os.fsync(f.fileno())  # 先落盘再写进度，断电后不会把未写入的块当作已完成
+        stats = self.server.host_stats(name)
+        if received.digest() != digest:
+            stats.retries += 1
+            logger.warning(f"Checksum mismatch in {name} at offset {offset}")
+            self.respond(STATUS_CHECKSUM)
+            return
+        partial.record(offset, length, digest)
+        stats.on_chunk(length, started, time.perf_counter_ns())
+        self.respond(STATUS_OK)
+
+    def on_commit(self, name, file_size, digest):
+        path = self.server.local_path(name)
+        partial = self.server.partial(name, path, file_size)
+        held = partial.digest()
+        if held != digest:
+            logger.error(f"Checksum mismatch for {name}, discarding partial file")
+            partial.discard()
+            self.server.forget(name)
+            self.respond(STATUS_CHECKSUM)
+            return
+        os.replace(partial.part_path, path)
+        os.remove(partial.journal_path)
+        self.server.forget(name)
+        self.server.remember_digest(path, held, partial.chunk_size)
+        stats = self.server.host_stats(name)
+        stats.files += 1
+        logger.info(
+            f"Received {name} ({file_size / 1e6:.1f} MB), "
+            f"{stats.bytes / 1e6:.1f} MB from this host at {stats.throughput_mbps:.1f} MB/s"
+        )
+        self.respond(STATUS_OK)
+
+
+class CollectorServer(socketserver.ThreadingTCPServer):
+    """Receives files from any number of slaves, one thread per connection."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, save_path: str, host: str = "", port: int = DEFAULT_TRANSFER_PORT):
+        if ":" in host:
+            self.address_family = socket.AF_INET6
+        super().__init__((host, port), _CollectorHandler)
+        self.save_path = save_path
+        self.stats: Dict[str, HostStats] = {}
+        self._partials: Dict[str, _PartialFile] = {}
+        # 已收齐文件的根校验和: path -> (size, mtime_ns, chunk_size, digest)，避免每次查询都重读文件
+        self._digests: Dict[str, Tuple[int, int, int, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def local_path(self, name: str) -> str:
+        path = os.path.join(self.save_path, _safe_relative_path(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def partial(self, name: str, path: str, file_size: int) -> _PartialFile:
+        with self._lock:
+            partial = self._partials.get(name)
+            if partial is None or partial.size != file_size:
+                partial = self._partials[name] = _PartialFile(path, file_size)
+            return partial
+
+    def forget(self, name: str) -> None:
+        with self._lock:
+            self._partials.pop(name, None)
+
+    def remember_digest(self, path: str, digest: bytes, chunk_size: Optional[int]) -> None:
+        if chunk_size is None:
+            return
+        stat = os.stat(path)
+        with self._lock:
+            self._digests[path] = (stat.st_size, stat.st_mtime_ns, chunk_size, digest)
+
+    def digest(self, path: str, chunk_size: int) -> bytes:
+        """Root digest of a collected file, computed once per file and chunk size."""
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached is not None and cached[:3] == (stat.st_size, stat.st_mtime_ns, chunk_size):
+            return cached[3]
+        digest = bytes.fromhex(file_digest(path, chunk_size))
+        self.remember_digest(path, digest, chunk_size)
+        return digest
+
+    def host_stats(self, name: str) -> HostStats:
+        host = name.replace("\\", "/").split("/", 1)[0]
+        with self._lock:
+            stats = self.stats.get(host)
+            if stats is None:
+                stats = self.stats[host] = HostStats()
+            return stats
+
+    def table(self) -> List[Tuple[str, int, float, float, int]]:
+        """Rows of ``(host, files, megabytes, MB/s, retries)``."""
+        with self._lock:
+            return [
+                (host, s.files, s.bytes / 1e6, s.throughput_mbps, s.retries)
+                for host, s in sorted(self.stats.items())
+            ]
+
+
+@dataclass
+class TransferReport:
+    files: int = 0
+    skipped: int = 0  # 对端已有完整文件
+    failed: List[str] = field(default_factory=list)
+    done: List[str] = field(default_factory=list)  # 对端确认完整的文件 (本次发送或已有)
+    bytes: int = 0
+    resumed_bytes: int = 0  # 对端已有、无需重传的块
+    retries: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput_mbps(self) -> float:
+        return self.bytes / self.elapsed / 1e6 if self.elapsed > 0 else 0.0
+
+
+@dataclass
+class _Upload:
+    path: str
+    name: str
+    size: int
+    digests: Dict[int, bytes] = field(default_factory=dict)
+    pending: int = 0
+    failed: bool = False
+
+
+class TransferClient:
+    """Sends files to a :class:`CollectorServer` over ``connections`` parallel sockets."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int = DEFAULT_TRANSFER_PORT,
+        connections: int = 4,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retries: int = 3,
+        timeout: float = 30.0,
+    ):
+        self.address = (host, port)
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.timeout = timeout
+
+    def _connect(self) -> socket.socket:
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER)
+        return sock
+
+    @staticmethod
+    def _request(sock: socket.socket, packet: bytes) -> Tuple[int, List[int]]:
+        sock.sendall(packet)
+        header = bytearray(RESPONSE.size)
+        recv_exact(sock, memoryview(header))
+        status, count = RESPONSE.unpack(header)
+        offsets = bytearray(OFFSET.size * count)
+        recv_exact(sock, memoryview(offsets))
+        return status, [o for (o,) in OFFSET.iter_unpack(offsets)]
+
+    def send_files(
+        self,
+        files: List[Tuple[str, str]],
+        busy: Optional[Callable[[], bool]] = None,
+        digests: Optional[Dict[str, str]] = None,
+    ) -> TransferReport:
+        """Send ``(local_path, remote_name)`` pairs; resumes whatever the collector already holds.
+
+        ``busy`` is polled before every chunk and pauses the transfer while it
+        returns True, e.g. while a recording is running on this host.
+        ``digests`` maps remote names to :func:`file_digest` values computed
+        with this client's ``chunk_size`` (e.g. from the session catalog);
+        other files are hashed before the query.
+        """
+        report = TransferReport()
+        start = time.perf_counter()
+        jobs: "queue.Queue[Tuple[_Upload, int, int, bool, int]]" = queue.Queue()
+        uploads: List[_Upload] = []
+
+        with self._connect() as sock:
+            for path, name in files:
+                size = os.path.getsize(path)
+                digest = (digests or {}).get(name) or file_digest(path, self.chunk_size)
+                status, held = self._request(
+                    sock, pack_request(OP_QUERY, name, size, length=self.chunk_size, digest=bytes.fromhex(digest))
+                )
+                if status == STATUS_COMPLETE:
+                    report.skipped += 1
+                    report.done.append(name)
+                    continue
+                if status != STATUS_OK:
+                    report.failed.append(name)
+                    continue
+                upload = _Upload(path, name, size)
+                held = set(held)
+                ranges = chunk_ranges(size, self.chunk_size)
+                upload.pending = len(ranges)
+                uploads.append(upload)
+                for offset, length in ranges:
+                    # 对端已有的块只计算校验和，用于最终的整体校验
+                    jobs.put((upload, offset, length, offset in held, 0))
+
+        lock = threading.Lock()
+
+        def finish_chunk(upload: _Upload, offset: int, digest: Optional[bytes]) -> None:
+            with lock:
+                if digest is None:
+                    upload.failed = True
+                else:
+                    upload.digests[offset] = digest
+                upload.pending -= 1
+
+        def worker():
+            buffer = bytearray(IO_BUFFER)
+            sock = None
+            try:
+                while True:
+                    try:
+                        upload, offset, length, held, attempt = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    if upload.failed:
+                        finish_chunk(upload, offset, None)
+                        continue
+                    while busy is not None and busy():
+                        time.sleep(1)
+                    try:
+                        with open(upload.path, "rb") as f:
+                            digest = hash_chunk(f, offset, length, buffer)
+                            if held:
+                                with lock:
+                                    report.resumed_bytes += length
+                                finish_chunk(upload, offset, digest)
+                                continue
+                            if sock is None:
+                                sock = self._connect()
+                            sock.sendall(
+                                pack_request(OP_CHUNK, upload.name, upload.size, offset, length, digest)
+                            )
+                            if length:
+                                sock.sendfile(f, offset, length)
+                        status, _ = self._request(sock, b"")
+                    except (OSError, TransferError) as e:
+                        logger.warning(f"Chunk {offset} of {upload.name} failed: {e}")
+                        if sock is not None:
+                            sock.close()
+                            sock = None
+                        status = STATUS_ERROR
+                    if status == STATUS_OK:
+                        with lock:
+                            report.bytes += length
+                        finish_chunk(upload, offset, digest)
+                    elif attempt < self.retries:
+                        with lock:
+                            report.retries += 1
+                        jobs.put((upload, offset, length, held, attempt + 1))
+                    else:
+                        finish_chunk(upload, offset, None)
+            finally:
+                if sock is not None:
+                    sock.close()
+
+        threads = [
+            threading.Thread(target=worker, name=f"transfer-{i}", daemon=True)
+            for i in range(self.connections)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with self._connect() as sock:
+            for upload in uploads:
+                if upload.failed or upload.pending:
+                    report.failed.append(upload.name)
+                    continue
+                digest = root_digest([upload.digests[o] for o in sorted(upload.digests)])
+                status, _ = self._request(
+                    sock, pack_request(OP_COMMIT, upload.name, upload.size, digest=digest)
+                )
+                if status == STATUS_OK:
+                    report.files += 1
+                    report.done.append(upload.name)
+                else:
+                    report.failed.append(upload.name)
+
+        report.elapsed = time.perf_counter() - start
+        return report
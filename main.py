@@ -3,11 +3,9 @@ from loguru import logger
 logger.info("KinectSync: PWM Controller ver.1.0 by Kenvix <i@kenvix.com>")
 
 import FreeSimpleGUI as sg
-import serial
 import traceback
-import threading
-import time
 from libs import processutils
+from libs.pwm import PwmController
 
 processutils.make_dpi_aware()
 
@@ -22,13 +20,7 @@ layout = [
     [sg.Button("Connect Serial"), sg.Button("✔️ Start"), sg.Button("❌ Stop")],
 ]
 
-com: serial.Serial = None
-com_thread = None
-
-stop_event = threading.Event()
-def com_reader():
-    while not stop_event.is_set():
-        print(com.read().decode('ascii'), end='')
+pwm: PwmController = None  # 控制器主动发送的消息由驱动的读取线程打印
 
 # 创造窗口
 window = sg.Window("PWM Controller ver.1.0 by Kenvix <i@kenvix.com>", layout)
@@ -41,46 +33,30 @@ while True:
     try:
         event, values = window.read()
         if event is None:
-            # stop_event.set()
+            if pwm is not None:
+                pwm.close()
             exit(0)
         elif 'Start' in event:  # 如果用户关闭窗口或点击`Cancel`
-            if com is None:
+            if pwm is None:
                 continue
-            pwmFreq = values[0]
-            pwmDuty = values[1]
-            pwmSlot = values[2]
-            com.write(f"dU{pwmSlot}:{pwmDuty}".encode("ascii"))
-            status_duty = com.read_until(b"\n")
-            com.write(f"FR{pwmSlot}:{pwmFreq}".encode("ascii"))
-            status_freq = com.read_until(b"\n")
-            logger.info(
-                f"Started PWM in {pwmFreq}Hz {pwmDuty}% [Duty {status_duty} Freq {status_freq}]"
-            )
+            pwmFreq = int(values[0])
+            pwmDuty = int(values[1])
+            pwmSlot = int(values[2])
+            pwm.start(pwmSlot, pwmFreq, pwmDuty)
             continue
         elif "Stop" in event:
-            if com is None:
+            if pwm is None:
                 continue
-            pwmSlot = values[2]
-            com.write(f"FR{pwmSlot}:000".encode("ascii"))
-            status_freq = com.read_until(b"\n")
-            logger.info(f"Stopped PWM {status_freq}")
+            pwm.stop(int(values[2]))
             continue
         elif "Connect Serial" in event:
             logger.info(f"Connect Serial")
-            if com is not None:
-                # stop_event.set()
-                com.close()
-            com = serial.Serial()
-            com.port = values[4]  # 串口设备路径
-            com.baudrate = int(values[3])  # 波特率
-            com.bytesize = serial.EIGHTBITS  # 数据位长度为8位
-            com.parity = serial.PARITY_NONE  # 无奇偶校验
-            com.stopbits = serial.STOPBITS_ONE  # 1位停止位
-            com.timeout = 1  # 读取超时时间为1秒
-            com.open()
+            if pwm is not None:
+                pwm.close()
+                pwm = None
+            # 串口设备路径、波特率；8 位数据位，无校验，1 位停止位
+            pwm = PwmController(values[4], int(values[3]), timeout=1.0).open()
             logger.info(f"Connected Serial")
-            # com_thread = threading.Thread(target=com_reader)
-            # com_thread.start()
             continue
         logger.trace("You entered ", values)
     except Exception as e:
@@ -1,21 +1,31 @@
-import socket
-import struct
-import time
-import FreeSimpleGUI as sg  # 假设替换为 FreeSimpleGUI
+import json
+import os
+import sys
 import threading
+import FreeSimpleGUI as sg  # 假设替换为 FreeSimpleGUI
 from loguru import logger
 import argparse
+from functools import partial
 from libs import processutils
+from libs.catalog import RigCatalog
+from libs.clocksync import now_ns
+from libs.pwm import DEFAULT_BAUDRATE, PwmController, PwmError
+from libs.trace import save_trace
+from libs.controlplane import (
+    DEFAULT_HOP_LIMIT,
+    DEFAULT_MULTICAST_GROUP,
+    DEFAULT_PORT,
+    DEFAULT_REPLY_PORT,
+    MasterControl,
+)
+from libs.protocol import REPLY_ACK, REPLY_PING, REPLY_RECORDED, REPLY_SYNC, Reply
 
 processutils.make_dpi_aware()
 
 # 全局变量
-is_listening = False  # 是否在监听
-sock = None  # 监听的socket
+control: MasterControl = None  # 控制面 (后台事件循环)
 recording_processes = []  # 记录所有设备的进程
-listen_thread = None  # 用于保存监听线程
-start_time = time.perf_counter()
-ping_replies = {}  # 保存ping回复
+pwm: PwmController = None  # 同步脉冲控制器 (可选)，PREPARE 完成后由 master 直接触发
 
 # 回调函数占位，您可以根据业务逻辑实现
 def on_start(session_name):
@@ -24,118 +34,311 @@ def on_start(session_name):
 def on_stop():
     logger.info("Stopping session")
 
-# 默认的回调函数，当收到slave回复时调用
-def on_slave_reply(address, status, msg_type, msg_length, msg_text):
+# 默认的回调函数，当收到slave回复时调用 (在控制面线程中执行)
+def on_slave_reply(reply: Reply, catalog: RigCatalog):
+    if reply.msg_type in (REPLY_SYNC, REPLY_ACK):  # 后台时钟探测和送达确认，不打印
+        return
+    if reply.msg_type == REPLY_RECORDED:
+        on_file_recorded(reply, catalog)
+        return
+    address = reply.peer
+    status, msg_type, msg_text = reply.status, reply.msg_type, reply.msg_text
     logger.info(
         f"Received reply from {address}: Status = {status}, Message Type = {msg_type}"
     )
 
     # 如果消息长度不为 0，表示有错误信息或状态信息
-    if msg_length > 0:
+    if len(msg_text) > 0:
         logger.info(f"Message from {address}: {msg_text}")
         if status < 0:
             logger.warning(f"Slave {address} reported an error: {msg_text}")
         if "stopped" in msg_text.lower():
             logger.info(f"Slave {address} confirmed stopped.")
-    if msg_type == 3:
-        ping_replies[address] = time.perf_counter() - start_time
+    if msg_type == REPLY_PING:
+        rtt = control.probes.get(address).last_rtt
+        if rtt is not None:
+            logger.info(f"RTT: Slave {address} pinged back in {rtt / 1e9} seconds.")
+
+
+def on_file_recorded(reply: Reply, catalog: RigCatalog):
+    try:
+        record = catalog.add_report(json.loads(reply.msg_text))
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Bad file report from {reply.peer}: {e}")
+        return
+    size = "?" if record.size is None else f"{record.size / 1e6:.1f} MB"
+    logger.info(
+        f"Recorded [{record.session}] {record.host} device {record.device}: {record.status}, {size}, "
+        f"{record.duration} s"
+    )
+
+
+def log_catalog(catalog: RigCatalog, session_name):
+    files = catalog.find(session=session_name)
+    if not files:
+        logger.info(f"No files recorded for session [{session_name}].")
+    for f in files:
+        size = "?" if f.size is None else f"{f.size / 1e6:.1f} MB"
+        checksum = f.checksum[:16] if f.checksum else "-"
+        logger.info(
+            f"[{f.session}] round {f.round} {f.host} device {f.device}: {f.status}, {size}, "
+            f"{f.duration} s, sha256 {checksum} {f.path}"
+        )
+    for session, hosts, count, size, failed in catalog.sessions()[-5:]:
+        logger.info(
+            f"Session [{session}]: {count} file(s) on {hosts} host(s), {size / 1e9:.2f} GB, {failed} failed"
+        )
+
+
+def on_request_done(name):
+    """Log a summary once a request's reply window closes."""
+    def callback(future):
+        if future.cancelled():
+            return
+        replies = future.result()
+        failed = [peer for peer, reply in replies.items() if reply.status < 0]
+        logger.info(f"{name}: {len(replies)} slave(s) replied, {len(failed)} failed {failed}")
+    return callback
+
+
+def on_start_done(future):
+    """Summarize the per-device arm times reported in start replies."""
+    on_request_done("Start")(future)
+    if future.cancelled():
+        return
+    slowest = None
+    skews = {}
+    for peer, reply in future.result().items():
+        try:
+            report = json.loads(reply.msg_text)
+        except ValueError:
+            continue
+        logger.info(f"Arm time {peer}: devices {report['arm_ms']} ms, total {report['total_ms']} ms")
+        if slowest is None or report["total_ms"] > slowest[1]:
+            slowest = (peer, report["total_ms"])
+        if "skew_ms" in report:
+            skews[peer] = report["skew_ms"]
+            bound = report.get("skew_bound_ms")
+            if bound is not None and abs(report["skew_ms"]) > bound:
+                logger.warning(f"{peer} armed {report['skew_ms']} ms from the scheduled time, expected ±{bound} ms")
+    if slowest is not None:
+        logger.info(f"Rig armed in {slowest[1]} ms (slowest: {slowest[0]})")
+    if skews:
         logger.info(
-            f"RTT: Slave {address} pinged back in {ping_replies[address]} seconds."
+            f"Ready vs. scheduled time: {min(skews.values())} .. {max(skews.values())} ms, "
+            f"spread {max(skews.values()) - min(skews.values()):.3f} ms"
         )
 
 
+def is_listening():
+    return control is not None and control.is_running
+
+
 # 发送“开始”消息给slaves
 def send_start_message(multicast_group, port, session_name, args):
-    global sock
-    if not is_listening:  # 如果没有监听，提示用户
+    if not is_listening():  # 如果没有监听，提示用户
         sg.popup_error("Please click 'Listen' before starting the session.")
         return
 
-    session_name_len = len(session_name)
-    if session_name_len > 128:
+    if len(session_name.encode("utf-8")) > 128:
         logger.error("Session name too long!")
         return
 
-    # 数据包格式: 状态码 (int4), 会话名字长度 (int4), 会话名字 (str)
-    status = 1
-    packed_data = struct.pack(
-        f"!iii{session_name_len}s",
-        status,
-        args.record_time,
-        session_name_len,
-        session_name.encode("utf-8"),
-    )
+    # 按实际加入的 slave 校验拓扑，并以其数量作为期望的回复数
+    expected = args.client_num
+    problems = control.members.validate(args.client_num, args.device_num, args.sync_delay)
+    if problems:
+        for problem in problems:
+            logger.warning(f"Rig topology: {problem}")
+        if sg.popup_yes_no("Rig does not match the settings:\n\n" + "\n".join(problems) + "\n\nStart anyway?") != "Yes":
+            return
+    if control.members.members:
+        expected = len(control.members.members)
+
+    target_ns = 0
+    if args.scheduled_start:
+        if len(control.clock.estimates) == 0:
+            logger.warning("No clock estimates yet, starting immediately.")
+        else:
+            target_ns = control.plan_start()
+            logger.info(f"Scheduled start in {(target_ns - now_ns()) / 1e6:.1f} ms")
+    future = control.send_start(session_name, args.record_time, target_ns, expected=expected)
+    future.add_done_callback(on_start_done)
+    on_start(session_name)
 
-    # 打印发送的数据包
-    logger.debug(f"Sending packed data: {packed_data}, length: {len(packed_data)}")
 
-    # 使用已经创建的socket发送消息
-    sock.sendto(packed_data, (multicast_group, port))
+# 两阶段启动: PREPARE 让所有设备就绪，屏障完成后 GO
+def send_prepare_message(session_name, args):
+    problems = control.members.validate(args.client_num, args.device_num, args.sync_delay)
+    if problems:
+        for problem in problems:
+            logger.warning(f"Rig topology: {problem}")
+        if sg.popup_yes_no("Rig does not match the settings:\n\n" + "\n".join(problems) + "\n\nPrepare anyway?") != "Yes":
+            return
+    expected = None if control.members.members else args.client_num
+    logger.info(f"Preparing session [{session_name}]")
+    future = control.prepare(session_name, args.record_time, expected=expected)
+    future.add_done_callback(lambda f: f.cancelled() or on_prepare_done(f.result(), args))
     on_start(session_name)
 
 
-# 发送“停止”消息给slaves
-def send_stop_message(multicast_group, port):
-    global sock
-    status = 2
-    packed_data = struct.pack("!ii", status, 0)
+def on_prepare_done(barrier, args):
+    """Barrier reached (or failed): log the per-device arm times, then GO or abort."""
+    devices = barrier.device_arm_ms()
+    for device, ms in devices.items():
+        logger.info(f"Armed {device}: {'FAILED' if ms is None else f'{ms} ms'}")
+    if not barrier.armed:
+        logger.error(
+            f"Prepare [{barrier.session_name}] failed after {barrier.elapsed_ms:.1f} ms: "
+            f"failed {barrier.failed}, missing {barrier.missing}. Stopping all slaves."
+        )
+        threading.Thread(target=send_stop_message, args=(None, None, args.pwm_slot), daemon=True).start()
+        return
+    slowest = max((d for d in devices.items() if d[1] is not None), key=lambda d: d[1], default=None)
+    logger.info(
+        f"Rig armed: {len(devices)} device(s) on {len(barrier.replies)} slave(s) in {barrier.elapsed_ms:.1f} ms"
+        + (f", slowest {slowest[0]} ({slowest[1]} ms)" if slowest else "")
+    )
+    if args.go_when_armed:
+        # 在独立线程中触发，串口往返不占用控制面线程
+        threading.Thread(target=send_go_message, args=(args,), name="go", daemon=True).start()
+
+
+def send_go_message(args):
+    """Start the sync pulses (when a PWM controller is connected), then send GO."""
+    if pwm is not None:
+        try:
+            trigger = pwm.start(args.pwm_slot, args.pwm_frequency, args.pwm_duty)
+        except PwmError as e:
+            logger.error(f"Failed to start the PWM trigger: {e}")
+            return
+        if control.session:
+            control.traces.timeline(control.session).span(
+                "PWM trigger", trigger.started_ns, trigger.acked_ns, "pwm", slot=trigger.slot, frequency=trigger.frequency
+            )
+        barrier = control.barrier
+        if barrier is not None and barrier.armed:
+            logger.info(
+                f"Trigger started {(trigger.started_ns - barrier.completed_ns) / 1e6:.1f} ms after the rig was armed "
+                f"(+{trigger.uncertainty_ms:.1f} ms until acknowledged)"
+            )
+    future = control.go()
+    future.add_done_callback(lambda f: f.cancelled() or on_go_done(f.result()))
+
+
+def on_go_done(result):
+    if result.dead_ms is not None:
+        logger.info(f"GO sent {result.dead_ms:.1f} ms after the rig was armed")
+    for peer, reply in sorted(result.replies.items()):
+        try:
+            report = json.loads(reply.msg_text)
+        except ValueError:
+            logger.warning(f"GO {peer}: {reply.msg_text}")
+            continue
+        log = logger.warning if reply.status < 0 else logger.info
+        log(f"GO {peer}: waited {report.get('waited_ms')} ms, latency {report.get('latency_ms')} ms, {report.get('error', 'ok')}")
 
-    # 打印发送的数据包
-    logger.debug(f"Sending packed data: {packed_data}, length: {len(packed_data)}")
 
-    # 使用已经创建的socket发送消息
-    sock.sendto(packed_data, (multicast_group, port))
+def connect_pwm(port, baudrate):
+    global pwm
+    if pwm is not None:
+        pwm.close()
+        pwm = None
+    if not port:
+        return
+    try:
+        # 控制器打开串口时可能复位并输出启动信息
+        pwm = PwmController(port, baudrate, settle=2.0).open()
+    except Exception as e:
+        logger.error(f"Failed to connect the PWM controller on {port}: {e}")
+        sg.popup_error(f"Failed to connect the PWM controller on {port}: {e}")
+
+
+# 发送“停止”消息给slaves
+def send_stop_message(multicast_group, port, pwm_slot=None):
+    if pwm is not None and pwm_slot is not None:
+        try:
+            ack = pwm.stop(pwm_slot)
+            if control.session:
+                control.traces.timeline(control.session).span("PWM stop", ack.sent_ns, ack.acked_ns, "pwm")
+        except PwmError as e:
+            logger.error(f"Failed to stop the PWM trigger: {e}")
+    future = control.send_stop()
+    future.add_done_callback(on_request_done("Stop"))
     on_stop()
 
 
-def send_ping_message(multicast_group, port):
-    global sock
-    global start_time
-    start_time = time.perf_counter()
-    status = 3
-    packed_data = struct.pack("!iii", status, 114514, 0)
+def send_ping_message(multicast_group, port, count=1, interval_ms=10):
+    if count <= 1:
+        future = control.send_ping()
+        future.add_done_callback(on_request_done("Ping"))
+    else:
+        logger.info(f"Sending {count} pings {interval_ms} ms apart")
+        future = control.ping_burst(count, interval_ms / 1000)
+        future.add_done_callback(lambda f: f.cancelled() or log_ping_stats())
 
-    # 打印发送的数据包
-    logger.debug(f"Sending packed data: {packed_data}, length: {len(packed_data)}")
 
-    # 使用已经创建的socket发送消息
-    sock.sendto(packed_data, (multicast_group, port))
+def log_ping_stats():
+    rows = control.probes.table()
+    if not rows:
+        logger.info("No ping statistics yet.")
 
+    def ms(value):
+        return "-" if value is None else f"{value:.3f}"
 
-# 接收slave回复的线程
-def receive_slave_replies(reply_port, on_reply_callback):
-    global sock
-    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-    sock.bind(("::", reply_port))  # 监听指定端口用于接收slave回复
+    for row in rows:
+        logger.info(
+            f"Ping {row['peer']}: min {ms(row['min_ms'])} p50 {ms(row['p50_ms'])} "
+            f"p99 {ms(row['p99_ms'])} max {ms(row['max_ms'])} ms, jitter {ms(row['jitter_ms'])} ms, "
+            f"loss {row['loss'] * 100:.1f}% ({row['received']}/{row['sent']})"
+        )
 
-    logger.info(f"Listening for replies on port {reply_port}")
 
-    while is_listening:  # 当监听状态为True时
-        try:
-            data, address = sock.recvfrom(1024)  # 接收来自slave的回复
-            if len(data) >= 12:  # 期望收到 状态码 (4字节), 类型字段 (4字节), 消息长度 (4字节)
-                status, msg_type, msg_length = struct.unpack("!iii", data[:12])  # 解包状态码、消息类型和消息长度
-                msg_text = data[12:12 + msg_length].decode("utf-8") if msg_length > 0 else ""
-                on_reply_callback(address, status, msg_type, msg_length, msg_text)
-        except Exception as e:
-            logger.error(f"Error while receiving data: {e}")
-            break
+def log_path_table():
+    def ms(value):
+        return "-" if value is None else f"{value:.3f}"
 
-# 创建组播套接字（只初始化一次）
-def create_multicast_socket(multicast_group, port):
-    global sock
-    if sock is None:
-        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    for row in control.path_table():
+        logger.info(
+            f"Delivery {row['peer']}: {row['path']}, multicast ACK p50 {ms(row['multicast_p50_ms'])} "
+            f"p99 {ms(row['multicast_p99_ms'])} ms ({row['multicast_count']}), unicast ACK p50 "
+            f"{ms(row['unicast_p50_ms'])} p99 {ms(row['unicast_p99_ms'])} ms ({row['unicast_count']})"
+        )
 
-        # 绑定套接字到所有接口和给定端口
-        sock.bind(("::", port))
 
-        # 设置组播接口为所有接口
-        interface_index = 0  # 0表示所有接口
-        group_bin = socket.inet_pton(socket.AF_INET6, multicast_group)
-        mreq = group_bin + struct.pack("I", interface_index)
-        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
+def log_ingest_stats():
+    stats = control.ingest_stats()
+    if not stats:
+        return
+    kernel_drops = "n/a" if stats["kernel_drops"] is None else stats["kernel_drops"]
+    logger.info(
+        f"Replies: {stats['received']} received, {stats['rejected']} malformed, {stats['failed']} failed, "
+        f"{kernel_drops} dropped by the kernel; queue peak {stats['queue_peak']}, reading paused "
+        f"{stats['queue_pauses']} time(s), receive buffer {stats['receive_buffer']} bytes"
+    )
+
+
+def save_session_trace(session_name):
+    """Write the timeline of a session on the master and every slave as a Chrome trace."""
+    session = session_name or control.session
+    if not session:
+        logger.info("No session to trace yet.")
+        return
+    slaves = control.traces.events(session)
+    path = os.path.join("traces", f"{session}.trace.json")
+    try:
+        os.makedirs("traces", exist_ok=True)
+        save_trace(control.trace(session), path)
+    except OSError as e:
+        logger.error(f"Cannot save the trace of [{session}]: {e}")
+        return
+    incomplete = control.traces.incomplete(session)
+    logger.info(
+        f"Trace of [{session}] with {len(slaves)} slave timeline(s) saved to {path} "
+        f"(open in https://ui.perfetto.dev or chrome://tracing)"
+        + (f", incomplete: {incomplete}" if incomplete else "")
+    )
+
 
 # 终止所有设备进程
 def terminate_processes():
@@ -145,44 +348,112 @@ def terminate_processes():
             logger.info(f"Terminated process with PID {process.pid}")
 
 # 启动或重启监听
-def restart_listen(multicast_address, reply_port):
-    global is_listening, listen_thread, sock
+def restart_listen(catalog, multicast_address, port, reply_port, interface=None, hop_limit=1, loopback=True):
+    global control
 
-    if is_listening:
+    if control is not None:
         # 停止当前监听
         logger.info("Restarting listening")
-        is_listening = False
-        if sock:
-            sock.close()  # 关闭套接字
-        listen_thread.join()  # 等待旧的监听线程结束
-        sock = None  # 重置socket
+        control.close()
 
     # 启动新的监听
     logger.info("Starting listening")
-    is_listening = True
-    listen_thread = threading.Thread(
-        target=receive_slave_replies, args=(reply_port, on_slave_reply), daemon=True
-    )
-    listen_thread.start()
+    try:
+        control = MasterControl(
+            multicast_address,
+            port,
+            reply_port,
+            on_reply=partial(on_slave_reply, catalog=catalog),
+            interface=interface,
+            hop_limit=hop_limit,
+            loopback=loopback,
+        )
+        control.start()
+    except (OSError, ValueError) as e:
+        control = None
+        logger.error(f"Failed to listen on port {reply_port}: {e}")
+        sg.popup_error(f"Failed to listen on port {reply_port}: {e}")
+        return
+    control.start_clock_sync()
     logger.info(f"Listening on {multicast_address}:{reply_port}")
+    control.discover().add_done_callback(lambda f: f.cancelled() or log_members())
+
+
+def log_members():
+    members = control.members.table()
+    if not members:
+        logger.info("No slaves have joined.")
+    for m in members:
+        logger.info(
+            f"Member {m.host} {m.peer}: {m.devices} device(s), slots {m.sync_slots.start}-"
+            f"{m.sync_slots.stop - 1}, sync delay {m.sync_delay} us, {', '.join(m.capabilities)}"
+        )
+
+
+def format_status_table():
+    """Text of the live status table, one line per slave that sends heartbeats."""
+    if not is_listening():
+        return "Not listening."
+    rows = control.status_table()
+    if not rows:
+        return "No heartbeats yet."
+    lines = [f"{'Slave':<40} {'State':<10} {'Armed':>7} {'Warn':>5} {'Written':>10} {'CPU':>7} {'Lost':>5}  Last error"]
+    for row in rows:
+        state = "STALE" if row["stale"] else row["state"]
+        lines.append(
+            f"{row['peer']:<40} {state:<10} {row['armed']:>3}/{row['devices']:<3} {row['warnings']:>5} "
+            f"{row['written_mb']:>7.1f} MB {row['cpu_percent']:>6.1f}% {row['lost']:>5}  {row['last_error']}"
+        )
+    return "\n".join(lines)
+
+
+def log_status_table():
+    for line in format_status_table().splitlines():
+        logger.info(line)
+
+
+def log_clock_table():
+    rows = control.clock.table()
+    if not rows:
+        logger.info("No clock estimates yet.")
+    for peer, offset_ms, rtt_ms, drift_ppm, samples in rows:
+        logger.info(
+            f"Clock {peer}: offset {offset_ms:+.3f} ms, min RTT {rtt_ms:.3f} ms, "
+            f"drift {drift_ppm:+.2f} ppm ({samples} samples)"
+        )
 
 # GUI部分
 def main():
-    global is_listening
-    global start_time
+    # 日志由后台线程写出，控制面线程处理大量回复时不会阻塞在控制台输出上
+    logger.remove()
+    logger.add(sys.stderr, enqueue=True)
+
+    parser = argparse.ArgumentParser(description="Master control panel")
+    parser.add_argument("--catalog", type=str, default="./master_catalog.sqlite3", help="Catalog database")
+    cli_args = parser.parse_args()
+    rig_catalog = RigCatalog(cli_args.catalog)  # 所有 slave 上报的录像文件
 
     # GUI布局
     layout = [
         [sg.Text("Session Name"), sg.Input(key="session_name")],
         [
-            sg.Text("Multicast Address (default ff02:ca11:4514:1919::)"),
-            sg.Input(default_text="ff02:ca11:4514:1919::", key="multicast_address"),
+            sg.Text(f"Multicast Address (default {DEFAULT_MULTICAST_GROUP})"),
+            sg.Input(default_text=DEFAULT_MULTICAST_GROUP, key="multicast_address"),
         ],
         [sg.Checkbox("Legacy Sync Mode", key="legacy_sync")],
-        [sg.Text("Port (default 4329)"), sg.Input(default_text="4329", key="port")],
+        [sg.Checkbox("Scheduled Start", default=True, key="scheduled_start")],
+        [sg.Checkbox("Go When Armed (Prepare)", default=False, key="go_when_armed")],
+        [sg.Text(f"Port (default {DEFAULT_PORT})"), sg.Input(default_text=str(DEFAULT_PORT), key="port")],
+        [
+            sg.Text(f"Reply Port (default {DEFAULT_REPLY_PORT})"),
+            sg.Input(default_text=str(DEFAULT_REPLY_PORT), key="reply_port"),
+        ],
         [
-            sg.Text("Reply Port (default 4328)"),
-            sg.Input(default_text="4328", key="reply_port"),
+            sg.Text("Interface (name or index, empty: system default)"),
+            sg.Input(default_text="", key="interface", size=(12, 1)),
+            sg.Text("Hop Limit"),
+            sg.Input(default_text=str(DEFAULT_HOP_LIMIT), key="hop_limit", size=(4, 1)),
+            sg.Checkbox("Multicast Loopback", default=True, key="multicast_loop"),
         ],
         
         [sg.Text("Number of Clients"), sg.Input(default_text="2", key="client_num")],
@@ -191,15 +462,51 @@ def main():
             sg.Input(default_text="20", key="record_time"),
         ],
         [sg.Text("Number of Devices"), sg.Input(default_text="2", key="device_num")],
+        [
+            sg.Text("PWM Port"),
+            sg.Input(default_text="", key="pwm_port", size=(10, 1)),
+            sg.Text("Baud"),
+            sg.Input(default_text=str(DEFAULT_BAUDRATE), key="pwm_baud", size=(7, 1)),
+            sg.Text("Hz"),
+            sg.Input(default_text="30", key="pwm_frequency", size=(4, 1)),
+            sg.Text("Duty %"),
+            sg.Input(default_text="50", key="pwm_duty", size=(4, 1)),
+            sg.Text("Slot"),
+            sg.Input(default_text="1", key="pwm_slot", size=(2, 1)),
+            sg.Button("Connect PWM"),
+        ],
         [
             sg.Text("Sync Delay (microseconds)"),
             sg.Input(default_text="160", key="sync_delay"),
         ],
+        [
+            sg.Text("Ping Count"),
+            sg.Input(default_text="1", key="ping_count", size=(6, 1)),
+            sg.Text("Ping Interval (ms)"),
+            sg.Input(default_text="10", key="ping_interval", size=(6, 1)),
+        ],
         [
             sg.Button("Listen"),
             sg.Button("Start"),
+            sg.Button("Prepare"),
+            sg.Button("Go"),
             sg.Button("Stop"),
             sg.Button("Ping"),
+            sg.Button("Clocks"),
+            sg.Button("Stats"),
+            sg.Button("Trace"),
+            sg.Button("Catalog"),
+            sg.Button("Status"),
+            sg.Button("Members"),
+        ],
+        [
+            sg.Multiline(
+                "Not listening.",
+                key="status",
+                size=(110, 8),
+                disabled=True,
+                font=("Courier New", 9),
+            )
         ],
         [
             sg.Text("<!> Notice: Click 'Listen' before starting the session."),
@@ -215,12 +522,15 @@ def main():
         "KinectSync: Master Controller ver.1.2 by Kenvix <i@kenvix.com>", layout
     )
 
-    # 主循环
+    # 主循环，每秒刷新一次状态表
     while True:
-        event, values = window.read()
+        event, values = window.read(timeout=1000)
 
         if event == sg.WINDOW_CLOSED or event == "Exit":
             break
+        if event == sg.TIMEOUT_EVENT:
+            window["status"].update(format_status_table())
+            continue
 
         session_name = values["session_name"]
         multicast_address = values["multicast_address"]
@@ -241,33 +551,94 @@ def main():
             record_time=int(values["record_time"]),
             device_num=int(values["device_num"]),
             sync_delay=int(values["sync_delay"]),
+            scheduled_start=values["scheduled_start"],
+            go_when_armed=values["go_when_armed"],
+            pwm_frequency=int(values["pwm_frequency"]),
+            pwm_duty=int(values["pwm_duty"]),
+            pwm_slot=int(values["pwm_slot"]),
             recorder_path="C:\\Program Files\\Azure Kinect SDK v1.4.2\\tools",
             save_path="./Goatdata",
         )
 
         if event == "Listen":
             # 重启监听
-            restart_listen(multicast_address, reply_port)
+            restart_listen(
+                rig_catalog,
+                multicast_address,
+                port,
+                reply_port,
+                values["interface"].strip() or None,
+                int(values["hop_limit"]),
+                values["multicast_loop"],
+            )
 
         elif event == "Start":
-            if not is_listening:  # 检查是否已经监听
+            if not is_listening():  # 检查是否已经监听
                 sg.popup_error("Please click 'Listen' before starting the session.")
             else:
                 send_start_message(multicast_address, port, session_name, args)
 
+        elif event == "Prepare":
+            if not is_listening():  # 检查是否已经监听
+                sg.popup_error("Please click 'Listen' before starting the session.")
+            else:
+                send_prepare_message(session_name, args)
+        elif event == "Go":
+            if not is_listening():  # 检查是否已经监听
+                sg.popup_error("Please click 'Listen' before starting the session.")
+            else:
+                threading.Thread(target=send_go_message, args=(args,), name="go", daemon=True).start()
+        elif event == "Connect PWM":
+            connect_pwm(values["pwm_port"], int(values["pwm_baud"]))
         elif event == "Stop":
-            if not is_listening:  # 检查是否已经监听
+            if not is_listening():  # 检查是否已经监听
                 sg.popup_error("Please click 'Listen' before starting the session.")
             else:
-                send_stop_message(multicast_address, port)
+                send_stop_message(multicast_address, port, args.pwm_slot)
                 terminate_processes()
         elif event == "Ping":
-            if not is_listening:  # 检查是否已经监听
+            if not is_listening():  # 检查是否已经监听
+                sg.popup_error("Please click 'Listen' before starting the session.")
+            else:
+                send_ping_message(
+                    multicast_address,
+                    port,
+                    int(values["ping_count"]),
+                    float(values["ping_interval"]),
+                )
+        elif event == "Clocks":
+            if not is_listening():  # 检查是否已经监听
+                sg.popup_error("Please click 'Listen' before starting the session.")
+            else:
+                log_clock_table()
+        elif event == "Stats":
+            if not is_listening():  # 检查是否已经监听
+                sg.popup_error("Please click 'Listen' before starting the session.")
+            else:
+                log_ping_stats()
+                log_path_table()
+                log_ingest_stats()
+        elif event == "Trace":
+            if not is_listening():  # 检查是否已经监听
+                sg.popup_error("Please click 'Listen' before starting the session.")
+            else:
+                save_session_trace(session_name)
+        elif event == "Catalog":
+            log_catalog(rig_catalog, session_name)
+        elif event == "Status":
+            log_status_table()
+        elif event == "Members":
+            if not is_listening():  # 检查是否已经监听
                 sg.popup_error("Please click 'Listen' before starting the session.")
             else:
-                send_ping_message(multicast_address, port)
+                control.discover().add_done_callback(lambda f: f.cancelled() or log_members())
 
     window.close()
+    if pwm is not None:
+        pwm.close()
+    if control is not None:
+        control.close()
+    rig_catalog.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+import argparse
+import json
+from dataclasses import asdict
+
+from loguru import logger
+
+from libs.catalog import RigCatalog
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up recorded files in the master's catalog.")
+    parser.add_argument("--catalog", type=str, default="./master_catalog.sqlite3", help="Catalog database")
+    parser.add_argument("--session", type=str, default=None, help="Session name")
+    parser.add_argument("--host", type=str, default=None, help="Slave host name")
+    parser.add_argument("--device", type=int, default=None, help="Device index")
+    parser.add_argument("--day", type=str, default=None, help="Recording date, YYYY-MM-DD")
+    parser.add_argument("--sessions", action="store_true", help="List sessions instead of files")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    catalog = RigCatalog(args.catalog)
+    if args.sessions:
+        rows = catalog.sessions(args.day)
+        if args.json:
+            keys = ("session", "hosts", "files", "bytes", "failed")
+            print(json.dumps([dict(zip(keys, row)) for row in rows], indent=2))
+        else:
+            for session, hosts, count, size, failed in rows:
+                logger.info(
+                    f"[{session}]: {count} file(s) on {hosts} host(s), {size / 1e9:.2f} GB, {failed} failed"
+                )
+    else:
+        files = catalog.find(args.session, args.host, args.device, args.day)
+        if args.json:
+            print(json.dumps([asdict(f) for f in files], indent=2))
+        else:
+            for f in files:
+                size = "?" if f.size is None else f"{f.size / 1e6:.1f} MB"
+                logger.info(
+                    f"[{f.session}] {f.host} device {f.device}: {f.status}, {size}, "
+                    f"{f.checksum or '-'} {f.path}"
+                )
+    catalog.close()
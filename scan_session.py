@@ -0,0 +1,43 @@
+import argparse
+import json
+import sys
+
+from loguru import logger
+
+from libs.mkvscan import ScanReport, scan_paths
+
+
+def log_report(report: ScanReport):
+    duration = "?" if report.duration_s is None else f"{report.duration_s:.3f}s"
+    logger.info(
+        f"{report.path}: {report.size / 1e6:.1f} MB, {duration}, {report.clusters} clusters, "
+        f"{report.cue_points} cue points, scanned in {report.elapsed_s * 1000:.1f} ms"
+    )
+    for track in report.tracks.values():
+        size = f" {track.width}x{track.height}" if track.width else ""
+        span = "" if track.duration_s is None else f", {track.duration_s:.3f}s"
+        dropped = f", {track.dropped} dropped" if track.dropped else ""
+        logger.info(
+            f"  track {track.number} {track.name or '-'} ({track.type} {track.codec}{size}): "
+            f"{track.frames} frames{span}{dropped}"
+        )
+    for issue in report.issues:
+        logger.warning(f"  {issue}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the structure of recorded .mkv files.")
+    parser.add_argument("paths", nargs="+", help="Recordings or session directories to scan")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel processes (default: all cores)")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    reports = scan_paths(args.paths, args.workers)
+    if args.json:
+        print(json.dumps([r.to_dict() for r in reports], indent=2))
+    else:
+        for report in reports:
+            log_report(report)
+    bad = [r.path for r in reports if not r.ok]
+    logger.info(f"Scanned {len(reports)} file(s), {len(bad)} with problems")
+    sys.exit(1 if bad else 0)
@@ -1,152 +1,633 @@
 import socket
-import struct
 import subprocess
+import threading
+import time
+import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from loguru import logger
 import argparse
 import os
 import datetime
 from libs import processutils
-import socket
+from libs.logpump import default_pump
+from libs.catalog import (
+    STATUS_COMPLETE,
+    STATUS_FAILED,
+    STATUS_RECORDING,
+    STATUS_STOPPED,
+    SessionCatalog,
+    file_report,
+)
+from libs.clocksync import SlaveClock, now_ns
+from libs.membership import announcement
+from libs.recorder import RECORDERS, SYNC_MASTER, RecorderBackend, RecordingSpec, create_recorder
+from libs.resources import ResourceSampler
+from libs.stats import ArmTimeEstimates
+from libs.timer import sleep_ms, sleep_until_ns
+from libs.trace import Timeline
+from libs.transfer import DEFAULT_CHUNK_SIZE, DEFAULT_TRANSFER_PORT, TransferClient, file_digest, parse_address
+from libs.controlplane import (
+    DEFAULT_HOP_LIMIT,
+    DEFAULT_MULTICAST_GROUP,
+    DEFAULT_PORT,
+    DEFAULT_REPLY_PORT,
+    SlaveControl,
+)
+from libs.protocol import (
+    CMD_CLOCK,
+    CMD_GO,
+    CMD_PING,
+    CMD_PREPARE,
+    CMD_START,
+    CMD_STOP,
+    CMD_SYNC,
+    COMMAND_NAMES,
+    REPLY_RECORDED,
+    REPLY_TRACE,
+    STATE_ARMING,
+    STATE_IDLE,
+    STATE_RECORDING,
+    STATE_UPLOADING,
+    Command,
+    Heartbeat,
+)
 
 # 获取主机名称
 pc_name = socket.gethostname()
-reply_socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-
-# 发送状态消息给 master，自动使用 master 的来源地址，并添加消息长度和文本字段
-def send_status_to_master(master_addr, port, status_code, msg_type, msg_text=""):
-    strbytes = msg_text.encode("utf-8")
-    msg_length = len(strbytes)
-    packed_status = struct.pack(
-            "!iii", status_code, msg_type, msg_length
-    )  # 状态码, 类型, 消息长度
-    packed_message = packed_status + strbytes
-    reply_socket.sendto(packed_message, (master_addr, port))
-    logger.info(
-        f"Sent status to {master_addr}, status_code: {status_code}, msg_type: {msg_type}, msg_text: {msg_text}"
+
+# 启动在工作线程中执行，停止在接收线程中执行，二者通过锁共享进程列表
+process_lock = threading.Lock()
+last_stop_received = 0  # 最近一次 STOP 命令的到达时间 (now_ns)
+spawn_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="spawn")
+
+# master 测得的本机时钟偏移，以及本机录像进程从启动到就绪的预计耗时
+slave_clock = SlaveClock()
+arm_estimates: ArmTimeEstimates = None
+
+# 本机录像轮次和文件记录 (save_path 下的 SQLite)
+catalog: SessionCatalog = None
+
+# 录像结束后把文件传到收集节点 (--collector)，同一时间只有一个传输任务
+transfer_client: TransferClient = None
+upload_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload")
+upload_future = None
+FINISH_TIMEOUT = 300  # 秒，等待录像记录计算完校验和再传输
+
+# 心跳上报的状态: 是否正在启动录像、本次录像的文件、最近一次错误
+arming = False
+current_files: List[str] = []
+last_error = ""
+
+# 最近一次全部就绪的录像: 会话名和每个设备的就绪时刻 (now_ns)，供 GO 统计等待时间
+prepared = None
+
+# 启动录像进程的后端 (--recorder)，k4arecorder 或模拟录像程序
+recorder: RecorderBackend = None
+
+# 录像进程和本进程的 CPU、内存、写盘采样 (--sample_interval)
+resource_sampler: ResourceSampler = None
+
+# 最近一次会话的时间线 (libs.trace)，录像进程全部退出后上报给 master
+timeline: Timeline = None
+TIMELINE_EVENTS = frozenset(("started", "stopping", "done", "timeout", "error", "warning"))
+
+
+def is_cancelled(command: Command) -> bool:
+    """A START is cancelled by any STOP that arrived after it."""
+    return last_stop_received > command.received
+
+
+def wait_until_spawn_time(command: Command, target_local_ns: int) -> int:
+    """Sleep so that recorders spawned afterwards are armed at ``target_local_ns``.
+
+    Returns the local time at which the recorders should be spawned.
+    """
+    spawn_at = target_local_ns - int(arm_estimates.estimate_ms * 1e6)
+    # 粗等待可被 STOP 打断，最后一小段精确等待
+    while spawn_at - now_ns() > 50_000_000:
+        if is_cancelled(command):
+            return spawn_at
+        time.sleep(0.04)
+    if spawn_at < now_ns():
+        logger.warning(f"Start is {(now_ns() - spawn_at) / 1e6:.1f} ms late for the scheduled time")
+    sleep_until_ns(spawn_at)
+    return spawn_at
+
+
+def set_error(message: str):
+    global last_error
+    last_error = f"{datetime.datetime.now():%H:%M:%S} {message}"
+
+
+def heartbeat_snapshot(args: argparse.Namespace, process_list: List[subprocess.Popen]) -> Heartbeat:
+    """Current state of this slave for the periodic heartbeat."""
+    with process_lock:
+        running = [p for p in process_list if p.poll() is None]
+    logs = [log for log in map(default_pump.get, running) if log is not None]
+    if arming:
+        state = STATE_ARMING
+    elif running:
+        state = STATE_RECORDING
+    elif upload_future is not None and upload_future.running():
+        state = STATE_UPLOADING
+    else:
+        state = STATE_IDLE
+    written = 0
+    for save_file_name in current_files:
+        try:
+            written += os.path.getsize(save_file_name)
+        except OSError:
+            pass
+    return Heartbeat(
+        state=state,
+        devices=args.device_num,
+        armed=sum(1 for log in logs if log.armed_at is not None),
+        alive=len(running),
+        warnings=sum(log.warnings for log in logs),
+        bytes_written=written,
+        cpu_percent=resource_sampler.active_cpu() if resource_sampler is not None else 0.0,
+        error=last_error,
+    )
+
+
+def log_resources(session_name: str, log_dir: str):
+    """Log the resource usage of a finished session and save it next to the recorder logs."""
+    if resource_sampler is None:
+        return
+    summary = resource_sampler.summary(session_name)
+    if not summary:
+        return
+    for label, usage in summary.items():
+        logger.info(
+            f"Resources [{session_name}] {label}: CPU {usage['cpu_mean']}% (max {usage['cpu_max']}%), "
+            f"RSS max {usage['rss_max_mb']} MB, written {usage['written_mb']} MB "
+            f"(max {usage['write_mbps_max']} MB/s), threads {usage['threads_max']}"
+        )
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+        with open(os.path.join(log_dir, f"{session_name}-{pc_name}-resources.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+    except OSError as e:
+        logger.warning(f"Cannot save resource summary: {e}")
+
+
+def send_timeline(control: SlaveControl, command: Command, session_timeline: Timeline):
+    """Ship a session's timeline to the master that issued ``command``."""
+    try:
+        chunks = session_timeline.chunks()
+        for chunk in chunks:
+            control.reply(command, 0, REPLY_TRACE, chunk)
+    except OSError as e:
+        logger.warning(f"Cannot send the timeline of [{session_timeline.session}]: {e}")
+        return
+    logger.debug(
+        f"Sent timeline of [{session_timeline.session}]: {len(session_timeline.events)} event(s) "
+        f"in {len(chunks)} datagram(s)"
     )
 
 
+def trace_recorder(session_timeline: Timeline, device: int, process: subprocess.Popen, ended_ns: int):
+    """Add a recorder's output events, recording span and exit to the timeline."""
+    track = f"Device{device}"
+    log = default_pump.get(process)
+    events = [] if log is None else [e for e in list(log.events) if e.kind in TIMELINE_EVENTS]
+    for event in events:
+        session_timeline.instant(event.kind, track, event.ns, line=event.text[:160])
+    # 录像从收到同步信号 (Started recording) 开始，没有该输出时从就绪开始
+    begin = next((e.ns for e in events if e.kind == "started"), None)
+    if begin is None and log is not None and log.armed_at is not None:
+        begin = int(log.armed_at * 1e9)
+    if begin is not None:
+        session_timeline.span("recording", begin, ended_ns, track)
+    session_timeline.instant("exit", track, ended_ns, returncode=process.returncode)
+
+
+def watch_session(control: SlaveControl, command: Command, recordings, ready_at, log_dir, session_timeline):
+    """Record the outcome of every recorder of a session once it exits and report it to the master."""
+    ended = {}
+    ended_ns = {}
+    # 轮询所有进程，按各自的退出时刻记录 (依次 wait 会把先退出的进程记晚)
+    running = [process for process, _ in recordings]
+    while running:
+        for process in [p for p in running if p.poll() is not None]:
+            ended[process] = time.perf_counter()
+            ended_ns[process] = now_ns()
+            running.remove(process)
+        if running:
+            time.sleep(0.01)
+    for device, (process, _) in enumerate(recordings):
+        trace_recorder(session_timeline, device, process, ended_ns[process])
+    log_resources(command.session_name, log_dir)
+    # 全部退出后再计算校验和，避免把校验耗时算进录像时长
+    for process, save_file_name in recordings:
+        if is_cancelled(command):
+            status = STATUS_STOPPED
+        elif process.returncode == 0:
+            status = STATUS_COMPLETE
+        else:
+            status = STATUS_FAILED
+        duration = None if ready_at.get(process) is None else round(ended[process] - ready_at[process], 3)
+        checksum = None
+        try:
+            checksum = file_digest(save_file_name)
+        except OSError as e:
+            logger.warning(f"Cannot checksum {save_file_name}: {e}")
+        record = catalog.finish_file(save_file_name, status, duration, checksum)
+        if record is not None:
+            # 上报给 master 的汇总目录 (UDP，丢失时 master 侧缺少这一条记录)
+            control.reply(
+                command, 0, REPLY_RECORDED, json.dumps(file_report(pc_name, record))
+            )
+    send_timeline(control, command, session_timeline)
+
+
+def cancelled_before_spawn(control: SlaveControl, command: Command, session_timeline: Timeline):
+    """Answer a START that a STOP cancelled before any recorder was spawned."""
+    global arming
+    arming = False
+    logger.warning(f"Recording [{command.session_name}] was stopped before it started")
+    session_timeline.instant("cancelled")
+    send_timeline(control, command, session_timeline)
+    control.reply(command, -1, command.status, "Cancelled by stop")
+
+
 # 启动录像进程
 def start_recording(
     args: argparse.Namespace,
     save_path: str,
     process_list: List[subprocess.Popen],
-    master_addr,
-    reply_port,
+    control: SlaveControl,
+    command: Command,
     session_name,
     record_time,
     **kwargs,
 ):
+    global arming, current_files, prepared, timeline
+    arming = True
+    prepared = None
+    target_local = None
+    session_timeline = timeline = Timeline(session_name)
+    session_timeline.instant(f"{COMMAND_NAMES[command.status]} received", at_ns=command.received, seq=command.seq)
+    session_timeline.span("dispatch", command.received)  # 等待工作线程
+    if command.timestamp:
+        if slave_clock.is_synced:
+            target_local = slave_clock.to_local(command.timestamp)
+            with session_timeline.measure("wait for scheduled start"):
+                wait_until_spawn_time(command, target_local)
+        else:
+            logger.warning("Scheduled start received before clock sync, starting immediately")
+
+    # 等待期间收到 STOP 时不再延时，也不登记文件 (否则目录里会留下一直处于 recording 的记录)
+    if is_cancelled(command):
+        cancelled_before_spawn(control, command, session_timeline)
+        return
+
     if 'init_delay' in kwargs:
+        init_start = now_ns()
         for _ in range(1): # Do not delete this line
-            processutils.busy_wait_ms(kwargs['init_delay'])
-    
+            sleep_ms(kwargs['init_delay'])
+        session_timeline.span("init_delay", init_start, ms=kwargs['init_delay'])
+        if is_cancelled(command):
+            cancelled_before_spawn(control, command, session_timeline)
+            return
+
+    save_file_names = []
+    current_files = save_file_names
+    watching = False
     try:
-        current_round = len(os.listdir(save_path)) // 2 + 1
+        current_round = catalog.allocate_round(session_name, record_time, args.device_num)
+        specs = []
+        log_dir = args.log_path or os.path.join(save_path, "logs")
 
         for i in range(args.device_num):
-            sync_delay = (args.device_offset + i) * args.sync_delay
-            save_file_name = f"{save_path}/{session_name}-{pc_name}-Device{i}.mkv"
-            
+            save_file_name = f"{save_path}/{session_name}-r{current_round}-{pc_name}-Device{i}.mkv"
+            save_file_names.append(save_file_name)
+            catalog.add_file(save_file_name, current_round, session_name, i)
+
+            spec = RecordingSpec(i, save_file_name, record_time)
             if 'legacy_master_device' in kwargs and kwargs['legacy_master_device'] == i:
-                record_command = (
-                    f"k4arecorder.exe --device {i} --external-sync Master "
-                    f'-d WFOV_2X2BINNED -c 1080p -r 30 -l {record_time} "{save_file_name}"'
-                )
+                spec.sync_mode = SYNC_MASTER
             else:
-                record_command = (
-                    f"k4arecorder.exe --device {i} --external-sync Subordinate "
-                    f'--sync-delay {sync_delay} -d WFOV_2X2BINNED -c 1080p -r 30 -l {record_time} "{save_file_name}"'
-                )
-
-            process = subprocess.Popen(
-                record_command,
-                shell=True,
-                cwd=args.recorder_path,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
+                spec.sync_delay = (args.device_offset + i) * args.sync_delay
+            specs.append(spec)
+
+        def spawn(i):
+            spawn_ns = now_ns()
+            process = recorder.spawn(specs[i])
+            started[process] = time.perf_counter()
+            session_timeline.span("spawn", spawn_ns, track=f"Device{i}", pid=process.pid)
+            # 后台持续读取 stdout/stderr，避免管道写满阻塞录像进程
+            default_pump.add(
+                process,
+                f"Device{i}",
+                os.path.join(log_dir, f"{session_name}-r{current_round}-{pc_name}-Device{i}.log"),
             )
+            if resource_sampler is not None:
+                resource_sampler.track(process, f"Device{i}", session_name)
+            with process_lock:
+                process_list.append(process)
+                if is_cancelled(command):  # STOP 已经处理过进程列表
+                    processutils.terminate_process_tree(process)
             logger.debug(
-                f"Started {record_time}s recording [{session_name}] on device {i}, command: {record_command}"
+                f"Started {record_time}s recording [{session_name}] on device {i}, command: {recorder.command(specs[i])}"
             )
-            process_list.append(process)
+            return process
 
-        # 监控所有进程
-        for p in process_list:
-            processutils.read_until_signal(p)
+        if is_cancelled(command):
+            # 已登记但还没有启动进程，没有 watch_session 来结束这些记录
+            for save_file_name in save_file_names:
+                catalog.finish_file(save_file_name, STATUS_STOPPED)
+            cancelled_before_spawn(control, command, session_timeline)
+            return
 
-        # 成功时回报给 master
-        send_status_to_master(master_addr, reply_port, 0, 1)
+        # 同时启动所有设备的录像进程 (此后收到的 STOP 由 spawn 终止进程，记录由 watch_session 结束)
+        arm_start = time.perf_counter()
+        started = {}
+        session_processes = list(spawn_pool.map(spawn, range(args.device_num)))
+
+        # 在同一个循环中监控本次启动的所有进程 (STOP 会终止进程并结束等待)
+        armed = processutils.wait_for_signal(
+            session_processes, started, timeout=args.arm_timeout
+        )
+        ready_ns = now_ns()
+        ready_at = {p: None if armed[p] is None else started[p] + armed[p] for p in session_processes}
+        for i, p in enumerate(session_processes):
+            end = None if ready_at[p] is None else int(ready_at[p] * 1e9)  # perf_counter 与 now_ns 同一时钟
+            session_timeline.span("arming", int(started[p] * 1e9), end, track=f"Device{i}", armed=end is not None)
+        session_timeline.instant("armed" if None not in ready_at.values() else "arming ended", at_ns=ready_ns)
+        threading.Thread(
+            target=watch_session,
+            args=(
+                control,
+                command,
+                list(zip(session_processes, save_file_names)),
+                ready_at,
+                log_dir,
+                session_timeline,
+            ),
+            name=f"watch-{current_round}",
+            daemon=True,
+        ).start()
+        watching = True
+        arm_report = {
+            "arm_ms": {
+                str(i): None if armed[p] is None else round(armed[p] * 1000, 3)
+                for i, p in enumerate(session_processes)
+            },
+            "total_ms": round((time.perf_counter() - arm_start) * 1000, 3),
+        }
+        if target_local is not None:
+            # 正数表示晚于计划时刻就绪；skew_bound_ms 是按以往启动估计的范围
+            skew_ms = (ready_ns - target_local) / 1e6
+            arm_report["skew_ms"] = round(skew_ms, 3)
+            skew_bound = arm_estimates.skew_bound_ms
+            if skew_bound is not None:
+                arm_report["skew_bound_ms"] = round(skew_bound, 3)
+                if abs(skew_ms) > skew_bound:
+                    logger.warning(
+                        f"[{session_name}] Armed {skew_ms:.1f} ms from the scheduled time, "
+                        f"outside the expected ±{skew_bound:.1f} ms"
+                    )
+        logger.info(f"Arm report [{session_name}] round {current_round}: {arm_report}")
+
+        if is_cancelled(command):
+            logger.warning(f"Recording [{session_name}] was stopped while arming")
+            control.reply(command, -1, command.status, "Cancelled by stop")
+            return
+
+        failed = [i for i, p in enumerate(session_processes) if armed[p] is None]
+        if failed:
+            arm_report["error"] = f"Device(s) {failed} failed to arm"
+            set_error(f"[{session_name}] {arm_report['error']}")
+            # 附上失败设备最后几行输出，便于在 master 上直接看到原因
+            arm_report["log"] = {
+                str(i): [line[:160] for line in default_pump.get(session_processes[i]).tail(3)]
+                for i in failed
+            }
+            control.reply(command, -1, command.status, json.dumps(arm_report))
+            return
+
+        # 没有设备 (device_num 为 0) 时保留原来的估计
+        for i, p in enumerate(session_processes):
+            arm_estimates.record(i, armed[p] * 1000)
+        arm_report["estimate_ms"] = round(arm_estimates.estimate_ms, 3)
+        prepared = {
+            "session": session_name,
+            "processes": session_processes,
+            "ready_ns": [int(ready_at[p] * 1e9) for p in session_processes],
+        }
+
+        # 成功时回报给 master (附带每个设备的就绪耗时)
+        session_timeline.instant(f"{COMMAND_NAMES[command.status]} reply sent")
+        control.reply(command, 0, command.status, json.dumps(arm_report))
     except Exception as e:
         error_message = f"Recording failed: {e}"
         logger.error(error_message)
-        send_status_to_master(master_addr, reply_port, -1, 1, error_message)
+        set_error(error_message)
+        session_timeline.instant("error", message=error_message)
+        if not watching:
+            for save_file_name in save_file_names:
+                catalog.finish_file(save_file_name, STATUS_FAILED)
+            send_timeline(control, command, session_timeline)
+        control.reply(command, -1, command.status, error_message)
+    finally:
+        arming = False
 
 
 # 停止所有录像进程
-def stop_recording(process_list: List[subprocess.Popen], master_addr, reply_port):
+def stop_recording(process_list: List[subprocess.Popen], control: SlaveControl, command: Command):
+    global last_stop_received, prepared
+    session_timeline = timeline
     try:
-        for process in process_list:
-            if process.poll() is None:
-                process.terminate()
-                logger.info(f"Terminated process with PID {process.pid}")
+        with process_lock:
+            last_stop_received = command.received
+            prepared = None
+            if session_timeline is not None:
+                session_timeline.instant("STOP received", at_ns=command.received, seq=command.seq)
+            for process in process_list:
+                if process.poll() is None:
+                    terminate_ns = now_ns()
+                    processutils.terminate_process_tree(process)
+                    if session_timeline is not None:
+                        session_timeline.span("terminate", terminate_ns, pid=process.pid)
+                    logger.info(f"Terminated process with PID {process.pid}")
 
-        send_status_to_master(master_addr, reply_port, 0, 2)  # 成功停止录像
+        control.reply(command, 0, CMD_STOP)  # 成功停止录像
     except Exception as e:
         error_message = f"Failed to stop recording: {e}"
         logger.error(error_message)
-        send_status_to_master(master_addr, reply_port, -1, 2, error_message)
+        set_error(error_message)
+        control.reply(command, -1, CMD_STOP, error_message)
+
+
+def on_go(control: SlaveControl, command: Command):
+    """The master fired the trigger: report how long each armed device waited for it."""
+    if prepared is None or (command.session_name and command.session_name != prepared["session"]):
+        control.reply(command, -1, CMD_GO, "Not prepared")
+        return
+    alive = [p.poll() is None for p in prepared["processes"]]
+    report = {
+        "session": prepared["session"],
+        # perf_counter 与 now_ns 同一时钟
+        "waited_ms": {str(i): round((command.received - ready) / 1e6, 3) for i, ready in enumerate(prepared["ready_ns"])},
+        "alive": sum(alive),
+    }
+    if command.timestamp and slave_clock.is_synced:
+        # GO 从 master 发出到本机收到的单程延迟
+        report["latency_ms"] = round((command.received - slave_clock.to_local(command.timestamp)) / 1e6, 3)
+    status = 0
+    if not all(alive):
+        status = -1
+        report["error"] = f"Device(s) {[i for i, a in enumerate(alive) if not a]} exited before GO"
+        set_error(f"[{prepared['session']}] {report['error']}")
+    logger.info(f"GO [{prepared['session']}]: {report}")
+    if timeline is not None and timeline.session == prepared["session"]:
+        timeline.instant("GO received", at_ns=command.received, seq=command.seq, latency_ms=report.get("latency_ms"))
+    control.reply(command, status, CMD_GO, json.dumps(report))
+
+
+def is_recording(process_list: List[subprocess.Popen]) -> bool:
+    with process_lock:
+        return any(process.poll() is None for process in process_list)
+
+
+def offload_recordings(save_path: str, process_list: List[subprocess.Popen]):
+    """Send the finished recordings the collector has not confirmed yet.
+
+    Uploaded files are marked in the session catalog, so each offload only
+    queries the collector about new files instead of every recording in
+    ``save_path``.
+    """
+    # 等待录像进程全部退出，避免传输写了一半的文件
+    while is_recording(process_list):
+        time.sleep(1)
+    # 进程退出后 watch_session 还要计算校验和再把记录标记为结束
+    deadline = time.monotonic() + FINISH_TIMEOUT
+    writing = {os.path.abspath(name) for name in current_files}
+    while time.monotonic() < deadline and any(f.path in writing for f in catalog.files(status=STATUS_RECORDING)):
+        time.sleep(0.5)
+    records = [record for record in catalog.pending_uploads() if os.path.exists(record.path)]
+    if not records:
+        return
+    names = {record.path: f"{pc_name}/{os.path.relpath(record.path, save_path)}" for record in records}
+    digests = {}
+    if transfer_client.chunk_size == DEFAULT_CHUNK_SIZE:  # 目录中的校验和按默认块大小计算
+        digests = {names[record.path]: record.checksum for record in records if record.checksum}
+    logger.info(f"Offloading {len(records)} recording(s) to {transfer_client.address}")
+    # 传输过程中如果开始了新的录像，暂停传输，让出磁盘和网络
+    report = transfer_client.send_files(
+        list(names.items()), busy=lambda: is_recording(process_list), digests=digests
+    )
+    done = set(report.done)
+    catalog.mark_uploaded([path for path, name in names.items() if name in done])
+    logger.info(
+        f"Offloaded {report.files} file(s), {report.skipped} already collected, "
+        f"{report.bytes / 1e6:.1f} MB at {report.throughput_mbps:.1f} MB/s "
+        f"({report.resumed_bytes / 1e6:.1f} MB resumed, {report.retries} retried chunk(s))"
+    )
+    if report.failed:
+        logger.error(f"Failed to offload: {report.failed}")
+        set_error(f"Failed to offload {len(report.failed)} file(s)")
+
+
+def schedule_offload(save_path: str, process_list: List[subprocess.Popen]):
+    global upload_future
+    if transfer_client is None:
+        return
+    if upload_future is not None and not upload_future.running() and not upload_future.done():
+        return  # 已有排队中的任务，它会包含新文件
+    upload_future = upload_pool.submit(offload_recordings, save_path, process_list)
+    upload_future.add_done_callback(
+        lambda f: f.exception() and logger.error(f"Offload failed: {f.exception()}")
+    )
+
+
+def capabilities(args: argparse.Namespace) -> List[str]:
+    """Optional features of this slave, advertised to the master."""
+    features = ["scheduled_start", "recorded_reports"]
+    if args.heartbeat_interval > 0:
+        features.append("heartbeat")
+    if resource_sampler is not None:
+        features.append("resources")
+    if transfer_client is not None:
+        features.append("transfer")
+    if args.master_device is not None:
+        features.append("legacy_master")
+    if recorder.name != "k4a":
+        features.append(f"{recorder.name}_recorder")
+    return features
 
 
 # 监听组播
 def listen_multicast(multicast_group, port, reply_port, args, process_list):
-    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-    # 绑定到所有接口的指定端口
-    sock.bind(("::", port))
-
-    # 加入组播组
-    group_bin = socket.inet_pton(socket.AF_INET6, multicast_group)
-    mreq = group_bin + struct.pack("I", 0)  # 0代表所有接口
-    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
-
-    logger.info(f"Listening for multicast messages on {multicast_group}:{port}")
-
-    while True:
-        data, address = sock.recvfrom(1024)
-        master_addr = address[0]
-        logger.info(f"Received message from {master_addr}")
-
-        if len(data) >= 8:  # 期望收到 状态码 和 会话名字长度
-            status, record_time, session_name_len = struct.unpack("!iii", data[:12])
-
-            if status == 1:  # Start command
-                session_name = data[12 : 12 + session_name_len].decode("utf-8")
-                logger.info(
-                    f"Starting {record_time}s recording [{session_name}] for session: {session_name}"
-                )
-                start_recording(
-                    args,
-                    args.save_path,
-                    process_list,
-                    master_addr,
-                    reply_port,
-                    session_name,
-                    record_time,
-                    legacy_master_device=args.master_device,
-                    init_delay=args.init_delay,
-                )
-
-            elif status == 2:  # Stop command
-                logger.info("Stopping recording")
-                stop_recording(process_list, master_addr, reply_port)
-
-            elif status == 3:  # Stop command
-                logger.info("Master ping")
-                send_status_to_master(master_addr, reply_port, 0, 3)
+    control = SlaveControl(
+        multicast_group,
+        port,
+        reply_port,
+        interface=args.interface,
+        hop_limit=args.hop_limit,
+        loopback=not args.no_multicast_loop,
+    )
+
+    def on_start(command: Command):
+        record_time = command.argument
+        session_name = command.session_name
+        logger.info(
+            f"Starting {record_time}s recording [{session_name}] for session: {session_name}"
+        )
+        start_recording(
+            args,
+            args.save_path,
+            process_list,
+            control,
+            command,
+            session_name,
+            record_time,
+            legacy_master_device=args.master_device,
+            init_delay=args.init_delay,
+        )
+        schedule_offload(args.save_path, process_list)
+
+    def on_stop(command: Command):
+        logger.info("Stopping recording")
+        stop_recording(process_list, control, command)
+        schedule_offload(args.save_path, process_list)
+
+    def reply_timestamps(command: Command):
+        # 回传 master 发送时刻、本机接收时刻和本机发送时刻，用于估计时钟偏移
+        control.reply(command, 0, command.status, stamps=(command.timestamp, command.received, now_ns()))
+
+    def on_ping(command: Command):
+        logger.info("Master ping")
+        reply_timestamps(command)
+
+    def on_clock(command: Command):
+        slave_clock.update(command.timestamp, command.argument / 1000, command.received)
+        logger.trace(f"Clock offset to master: {command.timestamp / 1e6:.3f} ms, drift {command.argument} ppb")
+
+    # 启动录像耗时较长，交给工作线程；STOP 和 PING 在接收循环中直接处理
+    control.on(CMD_START, on_start, blocking=True)
+    control.on(CMD_PREPARE, on_start, blocking=True)  # 与 START 相同，触发由 GO 之后的外部信号完成
+    control.on(CMD_GO, lambda command: on_go(control, command))
+    control.on(CMD_STOP, on_stop)
+    control.on(CMD_PING, on_ping)
+    control.on(CMD_CLOCK, on_clock)
+    control.on(CMD_SYNC, reply_timestamps)
+    control.announce(
+        lambda: announcement(
+            pc_name,
+            args.device_num,
+            args.device_offset,
+            args.sync_delay,
+            capabilities(args),
+            arm_estimate_ms=round(arm_estimates.estimate_ms, 1),
+            recorder=recorder.name,
+            command_port=control.command_port,
+        )
+    )
+    control.heartbeat(args.heartbeat_interval, lambda: heartbeat_snapshot(args, process_list))
+    control.run()
 
 
 if __name__ == "__main__":
@@ -157,12 +638,26 @@ if __name__ == "__main__":
     parser.add_argument(
         "--multicast_group",
         type=str,
-        default="ff02:ca11:4514:1919::",
+        default=DEFAULT_MULTICAST_GROUP,
         help="Multicast group address",
     )
-    parser.add_argument("--port", type=int, default=4329, help="Port to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument(
+        "--reply_port", type=int, default=DEFAULT_REPLY_PORT, help="Port to send replies to"
+    )
+    parser.add_argument(
+        "--interface",
+        type=str,
+        default=None,
+        help="Network interface (name or index) to join the group on and send multicast from",
+    )
     parser.add_argument(
-        "--reply_port", type=int, default=4328, help="Port to send replies to"
+        "--hop_limit", type=int, default=DEFAULT_HOP_LIMIT, help="Hop limit of multicast announcements"
+    )
+    parser.add_argument(
+        "--no_multicast_loop",
+        action="store_true",
+        help="Do not deliver this slave's multicast to the local host",
     )
     parser.add_argument("--device_num", type=int, default=2, help="Number of devices")
     parser.add_argument(
@@ -174,6 +669,15 @@ if __name__ == "__main__":
     parser.add_argument(
         "--sync_delay", type=int, default=160, help="Sync delay in microseconds"
     )
+    parser.add_argument(
+        "--arm_estimate",
+        type=float,
+        default=2000,
+        help="Initial guess of recorder arm time in milliseconds, refined after each start",
+    )
+    parser.add_argument(
+        "--arm_timeout", type=float, default=30, help="Seconds to wait for all recorders to arm"
+    )
     parser.add_argument(
         "--master_device", type=int, default=None, help="Master device id for legacy sync mode"
     )
@@ -183,6 +687,31 @@ if __name__ == "__main__":
         default="C:\\Program Files\\Azure Kinect SDK v1.4.2\\tools",
         help="Path to k4arecorder",
     )
+    parser.add_argument(
+        "--recorder",
+        type=str,
+        default="k4a",
+        choices=list(RECORDERS),
+        help="Recorder backend: k4arecorder, or a simulated recorder that needs no Kinects",
+    )
+    parser.add_argument(
+        "--sim_startup", type=float, default=1.5, help="Seconds the simulated recorder takes to arm"
+    )
+    parser.add_argument(
+        "--sim_bitrate",
+        type=float,
+        default=None,
+        help="MB/s written by each simulated recorder (default: the bitrate of the recording modes)",
+    )
+    parser.add_argument(
+        "--sim_fail_rate", type=float, default=0.0, help="Probability that a simulated recorder fails to arm"
+    )
+    parser.add_argument(
+        "--sim_trigger_file",
+        type=str,
+        default=None,
+        help="Simulated recorders wait for this file as for the sync signal (default: start right away)",
+    )
     parser.add_argument(
         "--save_path",
         type=str,
@@ -190,7 +719,56 @@ if __name__ == "__main__":
         help="Root path to save recordings",
     )
 
+    parser.add_argument(
+        "--log_path",
+        type=str,
+        default=None,
+        help="Directory for per-device recorder logs (default: <save_path>/logs)",
+    )
+    parser.add_argument(
+        "--heartbeat_interval",
+        type=float,
+        default=1.0,
+        help="Seconds between status heartbeats to the master, 0 to disable",
+    )
+    parser.add_argument(
+        "--sample_interval",
+        type=float,
+        default=1.0,
+        help="Seconds between resource samples of the recorders, 0 to disable",
+    )
+    parser.add_argument(
+        "--collector",
+        type=str,
+        default=None,
+        help=f"host[:port] of the collection node, finished recordings are sent there (port {DEFAULT_TRANSFER_PORT})",
+    )
+    parser.add_argument(
+        "--transfer_connections", type=int, default=4, help="Parallel connections to the collector"
+    )
+
     args = parser.parse_args()
+    arm_estimates = ArmTimeEstimates(args.arm_estimate)
+    recorder = create_recorder(
+        args.recorder,
+        args.recorder_path,
+        startup=args.sim_startup,
+        bitrate=args.sim_bitrate,
+        fail_rate=args.sim_fail_rate,
+        trigger_file=args.sim_trigger_file,
+    )
+    logger.info(f"Recorder backend: {args.recorder}")
+    catalog = SessionCatalog(args.save_path)
+    logger.info(f"Session catalog {catalog.path}, last round {catalog.last_round()}")
+    if args.sample_interval > 0:
+        try:
+            resource_sampler = ResourceSampler(args.sample_interval)
+            resource_sampler.start()
+        except ImportError:
+            logger.warning("psutil is not installed, resource sampling is disabled")
+    if args.collector:
+        host, port = parse_address(args.collector, DEFAULT_TRANSFER_PORT)
+        transfer_client = TransferClient(host, port, args.transfer_connections)
 
     # List to track running processes
     process_list: List[subprocess.Popen] = []
@@ -0,0 +1,190 @@
+import asyncio
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pytest
+
+from libs import controlplane
+from libs.clocksync import now_ns
+from libs.controlplane import MasterControl, SlaveControl
+from libs.membership import announcement
+from libs.protocol import CMD_PING, CMD_SYNC, Command, unpack_command
+
+PATHS = {"command": "multicast", "unicast command": "unicast"}
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+        sock.bind(("::", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class Link:
+    """Commands arriving at one slave, with faults injected before the slave sees them.
+
+    ``fault(command, path)`` returns how many copies the slave gets: 0 drops
+    the datagram, 2 replays it as a duplicate. ``path`` is ``"multicast"``
+    or ``"unicast"`` (the slave's command port).
+    """
+
+    def __init__(self):
+        self.received: List[Tuple[int, int, str]] = []  # (status, seq, path)，包括被丢弃的
+        self.fault: Optional[Callable[[Command, str], int]] = None
+
+    def drop_first(self, status: int, count: int, path: Optional[str] = None, duplicates: int = 1) -> None:
+        """Drop the first ``count`` datagrams of ``status`` (on ``path``), deliver the rest ``duplicates`` times."""
+        dropped = [0]
+
+        def fault(command: Command, arrived: str) -> int:
+            if command.status != status or (path is not None and arrived != path):
+                return 1
+            if dropped[0] < count:
+                dropped[0] += 1
+                return 0
+            return duplicates
+
+        self.fault = fault
+
+    def count(self, status: int, path: Optional[str] = None) -> int:
+        return sum(1 for s, _, p in self.received if s == status and (path is None or p == path))
+
+    def wrap(self, on_datagram, path: str):
+        def filtered(data: memoryview, address: Tuple) -> None:
+            command = unpack_command(data, address)
+            self.received.append((command.status, command.seq, path))
+            copies = 1 if self.fault is None else self.fault(command, path)
+            for _ in range(copies):
+                on_datagram(data, address)
+
+        return filtered
+
+
+class LoopbackRig:
+    """A master and slaves on this host, on ephemeral ports, each slave behind a :class:`Link`."""
+
+    def __init__(self):
+        self.port = free_port()
+        self.reply_port = free_port()
+        self.master: Optional[MasterControl] = None
+        self.slaves: List[SlaveControl] = []
+        self.links: Dict[SlaveControl, Link] = {}
+        self.devices: Dict[SlaveControl, int] = {}
+        self.acks: Dict[SlaveControl, List[int]] = {}  # 每个 slave 发出 ACK 的命令序号
+        self._loops: List[Tuple[asyncio.AbstractEventLoop, threading.Thread, object]] = []
+
+    def add_slave(self, devices: int = 1, **kwargs) -> SlaveControl:
+        """A slave announcing ``devices`` devices after the slaves added before it, like slave.py."""
+        slave = SlaveControl(port=self.port, reply_port=self.reply_port, **kwargs)
+        offset = sum(m for m in self.devices.values())
+        self.devices[slave] = devices
+        slave.announce(
+            lambda: announcement(
+                f"host{offset}", self.devices[slave], offset, 160, ["sim"], command_port=slave.command_port
+            )
+        )
+        self.slaves.append(slave)
+        self.links[slave] = Link()
+        acks = self.acks[slave] = []
+        send = slave.reply
+
+        def reply(command, status_code, msg_type, *args, **kw):
+            if msg_type == controlplane.REPLY_ACK:
+                acks.append(command.seq)
+            send(command, status_code, msg_type, *args, **kw)
+
+        slave.reply = reply
+
+        def reply_timestamps(command):
+            # 与 slave.py 相同: 回传三个时间戳，master 借此认识 slave 并估计时钟
+            slave.reply(command, 0, command.status, stamps=(command.timestamp, command.received, now_ns()))
+
+        slave.on(CMD_PING, reply_timestamps)
+        slave.on(CMD_SYNC, reply_timestamps)
+        return slave
+
+    def link(self, slave: SlaveControl) -> Link:
+        return self.links[slave]
+
+    def start_slave(self, slave: SlaveControl) -> None:
+        loop = controlplane.new_event_loop()
+        task = loop.create_task(slave.serve())
+
+        def run():
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                pending = asyncio.all_tasks(loop)
+                for other in pending:
+                    other.cancel()
+                if pending:
+                    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+                loop.close()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._loops.append((loop, thread, task))
+
+    def start(self, ping: bool = True, **master_options) -> MasterControl:
+        """Start the master and every slave; with ``ping`` wait until the master knows and pinged all of them."""
+        self.master = MasterControl(port=self.port, reply_port=self.reply_port, **master_options)
+        self.master.start()
+        for slave in self.slaves:
+            self.start_slave(slave)
+        if ping and self.slaves:
+            for _ in range(20):
+                # slave 收到命令后才知道 master 的地址 (心跳发往这里)
+                replies = self.master.send_ping(timeout=0.1, expected=len(self.slaves)).result()
+                if len(replies) == len(self.master.members.members) == len(self.slaves):
+                    break
+            else:
+                pytest.skip("IPv6 multicast on this host does not loop back to local sockets")
+        return self.master
+
+    def peer(self, slave: SlaveControl) -> str:
+        """The master's key for ``slave`` (its reply socket's address)."""
+        port = slave.reply_socket.getsockname()[1]
+        return next(peer for peer, state in self.master.slaves.items() if state.address[1] == port)
+
+    def stop_slave(self, slave: SlaveControl) -> None:
+        loop, thread, task = self._loops[self.slaves.index(slave)]
+        if thread.is_alive():
+            loop.call_soon_threadsafe(task.cancel)
+            thread.join(2)
+        slave.executor.shutdown(wait=True)  # 正在执行的处理函数可能还要回复
+        slave.reply_socket.close()
+
+    def close(self) -> None:
+        if self.master is not None:
+            self.master.close()
+        for slave in self.slaves[: len(self._loops)]:
+            self.stop_slave(slave)
+
+
+@pytest.fixture
+def rig(monkeypatch):
+    rig = LoopbackRig()
+    links = rig.links
+
+    class FilteredReader(controlplane.DatagramReader):
+        def __init__(self, sock, on_datagram, name, *args, **kwargs):
+            owner = getattr(on_datagram, "__self__", None)
+            if owner in links and name in PATHS:
+                on_datagram = links[owner].wrap(on_datagram, PATHS[name])
+            super().__init__(sock, on_datagram, name, *args, **kwargs)
+
+    monkeypatch.setattr(controlplane, "DatagramReader", FilteredReader)
+    yield rig
+    rig.close()
@@ -0,0 +1,103 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from libs.alignment import MISSING, alignment_stats, build_index, load_index, load_streams, session_files
+from libs.simrecorder import MkvWriter, frame_sizes
+
+PERIOD_NS = 33_333_333
+FRAMES = 60
+START_NS = 5_000_000_000  # 设备时钟上第一帧的时刻
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def record(path, offset_ns, drift_ppm=0.0, dropped=()):
+    """A recording whose frames lag the shared grid by ``offset_ns``, like a subordinate's sync delay."""
+    writer = MkvWriter(str(path), frame_sizes("NFOV_2X2BINNED", "OFF"), PERIOD_NS)
+    first_ns = START_NS + offset_ns
+    for i in range(FRAMES):
+        if i not in dropped:
+            writer.write_frame(int(i * PERIOD_NS * (1 + drift_ppm * 1e-6)), scale=0.001)
+    writer.finalize({"K4A_START_OFFSET_NS": first_ns})
+    return str(path)
+
+
+@pytest.fixture
+def session(tmp_path):
+    # host-a 两个设备 (--device_offset 0)，host-b 一个设备 (--device_offset 2)，sync delay 160 us
+    record(tmp_path / "s1-r1-host-a-Device0.mkv", 0)
+    record(tmp_path / "s1-r1-host-a-Device1.mkv", 160_000 + 25_000)  # 比配置晚 25 us
+    record(tmp_path / "s1-r4-host-b-Device0.mkv", 320_000, drift_ppm=50.0, dropped=(30,))
+    return tmp_path
+
+
+def test_session_files_take_the_latest_round_of_each_host(tmp_path):
+    names = [
+        "s1-host-a-Device0.mkv",  # 旧版本 slave，没有轮次
+        "s1-r2-host-a-Device0.mkv",
+        "s1-r2-host-a-Device1.mkv",
+        "s1-r5-host-a-Device0.mkv",
+        "s1-r5-host-a-Device1.mkv",
+        "s1-r3-host-b-Device0.mkv",
+        "s10-r9-host-a-Device0.mkv",
+        "s1-r5-host-a-Device0.log",
+    ]
+    for name in names:
+        (tmp_path / name).write_bytes(b"")
+
+    def found(**kwargs):
+        files = session_files(str(tmp_path), "s1", **kwargs)
+        return [(os.path.basename(path), host, device) for path, host, device in files]
+
+    assert found() == [
+        ("s1-r5-host-a-Device0.mkv", "host-a", 0),
+        ("s1-r5-host-a-Device1.mkv", "host-a", 1),
+        ("s1-r3-host-b-Device0.mkv", "host-b", 0),
+    ]
+    assert found(round=2) == [
+        ("s1-r2-host-a-Device0.mkv", "host-a", 0),
+        ("s1-r2-host-a-Device1.mkv", "host-a", 1),
+    ]
+    assert found(round=0) == [("s1-host-a-Device0.mkv", "host-a", 0)]
+
+
+def test_recovers_synthetic_offsets(session):
+    files = session_files(str(session), "s1")
+    streams = load_streams(files, 160, {"host-b": 2}, "DEPTH", workers=1)
+    assert [s.label for s in streams] == ["host-a/Device0", "host-a/Device1", "host-b/Device0"]
+    assert [s.expected_offset_ns for s in streams] == [0, 160_000, 320_000]
+    assert [s.issues for s in streams] == [[], [], []]
+    assert all(s.frame_period_ns == pytest.approx(PERIOD_NS, abs=2000) for s in streams)
+
+    index = build_index(streams)
+    assert index.shape == (FRAMES, 3)
+    # 丢帧的那一行在该设备上为空，其余帧号逐行递增
+    assert index["frame"][30, 2] == MISSING
+    assert list(index["frame"][:, 0]) == list(range(FRAMES))
+    assert index["timestamp_ns"][0, 1] - index["timestamp_ns"][0, 0] == 185_000
+
+    reference, late, drifting = alignment_stats(index, streams)
+    assert (reference.frames, reference.matched, reference.mean_offset_us) == (FRAMES, FRAMES, None)
+    assert late.offset_error_us == pytest.approx(25.0, abs=1.0)
+    assert late.jitter_us < 1.0 and abs(late.drift_ppm) < 1.0
+    assert (drifting.frames, drifting.matched, drifting.missing) == (FRAMES - 1, FRAMES - 1, 1)
+    assert drifting.expected_offset_us == 320.0
+    assert drifting.drift_ppm == pytest.approx(50.0, abs=1.0)
+    assert drifting.jitter_us < 1.0
+    # 漂移在两秒内累积约 100 us
+    assert drifting.max_error_us == pytest.approx(FRAMES * PERIOD_NS * 50e-6 / 1e3, abs=5.0)
+
+
+def test_align_session_writes_the_index(session):
+    command = [sys.executable, os.path.join(ROOT, "align_session.py"), str(session), "s1"]
+    subprocess.run(command + ["--device_offset", "host-b=2", "--workers", "2"], check=True, cwd=ROOT)
+    index, meta = load_index(str(session / "s1.align"))
+    assert index.shape == (FRAMES, 3) and meta["rows"] == FRAMES
+    assert [c["label"] for c in meta["columns"]] == ["host-a/Device0", "host-a/Device1", "host-b/Device0"]
+    assert meta["stats"][1]["offset_error_us"] == pytest.approx(25.0, abs=1.0)
+    assert np.array_equal(index["frame"][:, 0], np.arange(FRAMES))
+    assert json.loads((session / "s1.align.json").read_text()) == meta
@@ -0,0 +1,128 @@
+import argparse
+import json
+import threading
+import time
+
+import pytest
+
+from libs.protocol import CMD_GO, CMD_PREPARE, CMD_STOP
+
+from tests.conftest import wait_for
+
+
+def arm_after(slave, seconds, status=0):
+    """PREPARE handler that arms (or fails) after ``seconds`` and reports it like slave.py."""
+    prepared = []
+
+    def on_prepare(command):
+        time.sleep(seconds)
+        ms = round(seconds * 1000, 3)
+        report = {"arm_ms": {"0": ms if status == 0 else None}, "total_ms": ms}
+        prepared.append(command.session_name)
+        slave.reply(command, status, CMD_PREPARE, json.dumps(report))
+
+    slave.on(CMD_PREPARE, on_prepare, blocking=True)
+    return prepared
+
+
+def record(slave, status):
+    commands = []
+
+    def handler(command):
+        commands.append(command)
+        slave.reply(command, 0, status, "{}")
+
+    slave.on(status, handler)
+    return commands
+
+
+def test_barrier_waits_for_every_member(rig):
+    delays = (0.05, 0.2, 0.35)
+    slaves = [rig.add_slave() for _ in delays]
+    prepared = [arm_after(slave, delay) for slave, delay in zip(slaves, delays)]
+    master = rig.start()
+
+    barrier = master.prepare("s1", 10, timeout=5).result()
+    assert barrier.armed
+    assert (barrier.failed, barrier.missing) == ([], [])
+    assert prepared == [["s1"]] * 3
+    # 屏障在最慢的 slave 就绪后完成
+    slowest = barrier.replies[rig.peer(slaves[-1])]
+    assert barrier.completed_ns == slowest.received
+    assert 350 <= barrier.elapsed_ms < 2000
+    assert barrier.device_arm_ms() == {f"{rig.peer(s)}/Device0": d * 1000 for s, d in zip(slaves, delays)}
+    assert master.barrier is barrier
+
+
+def test_barrier_fails_on_first_failure(rig):
+    failing, slow = rig.add_slave(), rig.add_slave()
+    arm_after(failing, 0.05, status=-1)
+    arm_after(slow, 1.5)
+    master = rig.start()
+
+    start = time.perf_counter()
+    barrier = master.prepare("s1", 10, timeout=5).result()
+    # 不等慢的 slave 就绪
+    assert time.perf_counter() - start < 1.0
+    assert not barrier.armed
+    assert barrier.failed == [rig.peer(failing)]
+    assert barrier.missing == [rig.peer(slow)]
+    assert barrier.device_arm_ms() == {f"{rig.peer(failing)}/Device0": None}
+
+
+def test_barrier_reports_silent_members(rig):
+    armed, silent = rig.add_slave(), rig.add_slave()
+    arm_after(armed, 0.01)
+    master = rig.start()
+
+    barrier = master.prepare("s1", 10, timeout=0.5).result()
+    assert not barrier.armed
+    assert barrier.missing == [rig.peer(silent)]
+    assert list(barrier.replies) == [rig.peer(armed)]
+
+
+def test_go_after_barrier(rig):
+    slaves = [rig.add_slave() for _ in range(2)]
+    for slave in slaves:
+        arm_after(slave, 0.05)
+    gos = [record(slave, CMD_GO) for slave in slaves]
+    master = rig.start()
+
+    barrier = master.prepare("s1", 10, timeout=5).result()
+    assert barrier.armed
+    time.sleep(0.1)
+    result = master.go(timeout=2).result()
+
+    assert len(result.replies) == 2
+    # dead_ms 从屏障完成算到 GO 发出
+    assert result.dead_ms == pytest.approx((result.go_ns - barrier.completed_ns) / 1e6)
+    assert 100 <= result.dead_ms < 1000
+    for commands in gos:
+        (command,) = commands
+        assert command.session_name == "s1"
+        # GO 带着 master 的发出时刻，同一主机上时钟相同
+        assert command.timestamp == result.go_ns
+        assert 0 <= command.received - result.go_ns < 500_000_000
+    for reply in result.replies.values():
+        assert reply.received >= result.go_ns
+
+
+def test_failed_barrier_stops_every_slave(rig, monkeypatch):
+    pytest.importorskip("FreeSimpleGUI")
+    import master as master_app
+
+    failing, armed = rig.add_slave(), rig.add_slave()
+    arm_after(failing, 0.05, status=-1)
+    arm_after(armed, 0.1)
+    stops = {slave: record(slave, CMD_STOP) for slave in (failing, armed)}
+    gone = threading.Event()
+    monkeypatch.setattr(master_app, "send_go_message", lambda args: gone.set())
+    monkeypatch.setattr(master_app, "control", rig.start())
+
+    barrier = master_app.control.prepare("s1", 10, timeout=5).result()
+    assert not barrier.armed
+    master_app.on_prepare_done(barrier, argparse.Namespace(pwm_slot=None, go_when_armed=True))
+    # 屏障失败时自动 STOP 所有 slave (包括已就绪的)，不发 GO
+    assert wait_for(lambda: all(stops.values()))
+    assert [len(commands) for commands in stops.values()] == [1, 1]
+    assert not gone.is_set()
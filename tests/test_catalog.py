@@ -0,0 +1,93 @@
+import os
+import sqlite3
+
+from libs.catalog import (
+    STATUS_COMPLETE,
+    STATUS_FAILED,
+    STATUS_IMPORTED,
+    STATUS_RECORDING,
+    SessionCatalog,
+)
+
+
+def test_migrates_legacy_sheep_rounds(tmp_path):
+    for name in ("sheep_3_a_0.mkv", "sheep_12_a_1.mkv", "notes.txt", "other.mkv"):
+        (tmp_path / name).write_bytes(b"x" * 10)
+    catalog = SessionCatalog(str(tmp_path))
+    try:
+        # 轮次接着旧文件名中最大的轮次继续
+        assert catalog.last_round() == 12
+        assert catalog.allocate_round("s", 10, 2) == 13
+        imported = catalog.files(status=STATUS_IMPORTED)
+        assert sorted(os.path.basename(f.path) for f in imported) == ["other.mkv", "sheep_12_a_1.mkv", "sheep_3_a_0.mkv"]
+        assert all(f.size == 10 and f.round is None for f in imported)
+    finally:
+        catalog.close()
+
+
+def test_import_runs_only_on_creation(tmp_path):
+    SessionCatalog(str(tmp_path)).close()
+    (tmp_path / "sheep_40_a_0.mkv").write_bytes(b"")
+    catalog = SessionCatalog(str(tmp_path))
+    try:
+        assert catalog.last_round() == 0
+        assert catalog.files() == []
+    finally:
+        catalog.close()
+
+
+def test_adds_checksum_column_to_early_databases(tmp_path):
+    db = sqlite3.connect(tmp_path / "catalog.sqlite3")
+    db.execute(
+        "CREATE TABLE files (path TEXT PRIMARY KEY, round INTEGER, session TEXT, device INTEGER, "
+        "status TEXT NOT NULL, size INTEGER, duration REAL, created REAL NOT NULL, updated REAL NOT NULL)"
+    )
+    db.close()
+    catalog = SessionCatalog(str(tmp_path))
+    try:
+        path = str(tmp_path / "s-Device0.mkv")
+        catalog.add_file(path, catalog.allocate_round("s"), "s", 0)
+        assert catalog.finish_file(path, STATUS_COMPLETE, 1.5, "ab" * 32).checksum == "ab" * 32
+        assert [f.uploaded for f in catalog.pending_uploads()] == [None]
+    finally:
+        catalog.close()
+
+
+def test_rounds_and_files(tmp_path):
+    catalog = SessionCatalog(str(tmp_path))
+    try:
+        round_ = catalog.allocate_round("s1", 30, 2)
+        paths = [str(tmp_path / f"s1-Device{i}.mkv") for i in range(2)]
+        for device, path in enumerate(paths):
+            catalog.add_file(path, round_, "s1", device)
+        assert [f.status for f in catalog.files(round=round_)] == [STATUS_RECORDING] * 2
+        assert [r.session for r in catalog.rounds()] == ["s1"]
+
+        open(paths[0], "wb").write(b"x" * 100)
+        complete = catalog.finish_file(paths[0], STATUS_COMPLETE, 30.0)
+        failed = catalog.finish_file(paths[1], STATUS_FAILED)
+        assert (complete.size, complete.duration, failed.size) == (100, 30.0, None)
+        assert catalog.total_size() == 100
+        assert [f.path for f in catalog.files(status=STATUS_FAILED)] == [os.path.abspath(paths[1])]
+    finally:
+        catalog.close()
+
+
+def test_pending_uploads(tmp_path):
+    catalog = SessionCatalog(str(tmp_path))
+    try:
+        round_ = catalog.allocate_round("s1")
+        paths = [str(tmp_path / f"s1-Device{i}.mkv") for i in range(3)]
+        for device, path in enumerate(paths):
+            catalog.add_file(path, round_, "s1", device)
+        catalog.finish_file(paths[0], STATUS_COMPLETE, 10.0)
+        catalog.finish_file(paths[1], STATUS_FAILED)
+        # 仍在录制的文件不传输
+        assert [f.path for f in catalog.pending_uploads()] == [os.path.abspath(p) for p in paths[:2]]
+
+        catalog.mark_uploaded(paths[:1])
+        assert [f.path for f in catalog.pending_uploads()] == [os.path.abspath(paths[1])]
+        (uploaded,) = [f for f in catalog.files() if f.uploaded is not None]
+        assert uploaded.path == os.path.abspath(paths[0])
+    finally:
+        catalog.close()
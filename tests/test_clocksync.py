@@ -0,0 +1,71 @@
+import pytest
+
+from libs.clocksync import ClockEstimate, ClockFilter, ClockSample, ClockTable, SlaveClock
+
+
+def sample(master_ns, offset_ns, delay_ns, processing_ns=100_000):
+    """A ping sent at ``master_ns`` to a slave ``offset_ns`` ahead, with a symmetric ``delay_ns`` round trip."""
+    t0 = master_ns
+    t1 = t0 + delay_ns // 2 + offset_ns
+    t2 = t1 + processing_ns
+    t3 = t2 - offset_ns + delay_ns // 2
+    return ClockSample(t0, t1, t2, t3)
+
+
+def test_sample_offset_and_delay():
+    s = sample(1_000_000_000, 5_000_000, 400_000)
+    assert s.offset_ns == 5_000_000
+    assert s.delay_ns == 400_000
+
+
+def test_filter_anchors_on_lowest_delay():
+    clock_filter = ClockFilter()
+    # 排队只会增加单程延迟，造成偏移误差
+    for i, extra in enumerate((3_000_000, 0, 5_000_000)):
+        s = sample(i * 100_000_000, 2_000_000, 200_000)
+        clock_filter.add(ClockSample(s.t0, s.t1 + extra, s.t2 + extra, s.t3 + extra))
+    estimate = clock_filter.estimate()
+    assert estimate.offset_ns == 2_000_000
+    assert estimate.delay_ns == 200_000
+    assert estimate.drift_ppm == 0.0  # 时间跨度不足 min_span_ns
+
+
+def test_filter_estimates_drift():
+    clock_filter = ClockFilter()
+    for i in range(20):
+        master_ns = i * 1_000_000_000
+        # slave 时钟快 50 ppm
+        estimate = clock_filter.add(sample(master_ns, 1_000_000 + master_ns * 50 // 1_000_000, 200_000))
+    assert estimate.drift_ppm == pytest.approx(50, abs=0.1)
+    assert estimate.to_slave(estimate.updated_ns) - estimate.updated_ns == pytest.approx(
+        1_000_000 + estimate.updated_ns * 50 / 1e6, abs=2_000
+    )
+
+
+def test_estimate_conversions_are_inverse():
+    estimate = ClockEstimate(offset_ns=-7_000_000, delay_ns=100_000, updated_ns=10**12, drift_ppm=30.0)
+    master_ns = 10**12 + 60_000_000_000
+    # to_master 用近似的 master 时刻求偏移，误差为漂移乘以偏移的变化量
+    assert estimate.to_master(estimate.to_slave(master_ns)) == pytest.approx(master_ns, abs=100)
+    assert estimate.offset_at(master_ns) == -7_000_000 + 1_800_000
+
+
+def test_table_keeps_one_estimate_per_peer():
+    table = ClockTable()
+    table.add_sample("a", sample(0, 1_000, 300_000))
+    table.add_sample("b", sample(0, -2_000, 800_000))
+    assert table.get("a").offset_ns == 1_000
+    assert table.get("b").offset_ns == -2_000
+    assert table.get("c") is None
+    assert table.max_delay_ns() == 800_000
+    assert [row[0] for row in table.table()] == ["a", "b"]
+    with pytest.raises(ValueError):
+        table.add_sample("a", ClockSample(10, 0, 100, 20))
+
+
+def test_slave_clock_converts_master_time():
+    clock = SlaveClock()
+    assert not clock.is_synced
+    clock.update(5_000_000, 0.0, 0)
+    assert clock.is_synced
+    assert clock.to_local(1_000_000_000) == 1_005_000_000
@@ -0,0 +1,85 @@
+import time
+
+from libs.controlplane import MasterControl
+from libs.protocol import REPLY_HEARTBEAT, STATE_RECORDING, Heartbeat, Reply
+
+from tests.conftest import wait_for
+
+SECOND = 1_000_000_000
+ADDRESS = ("fe80::1", 40000, 0, 2)
+
+
+def heartbeat_reply(seq, received, interval_ms=1000, **fields):
+    heartbeat = Heartbeat(interval_ms=interval_ms, **fields)
+    return Reply(ADDRESS, 0, REPLY_HEARTBEAT, "", seq, received=received, heartbeat=heartbeat)
+
+
+def test_heartbeat_updates_state_and_counts_gaps():
+    master = MasterControl()
+    master._dispatch_reply(heartbeat_reply(1, SECOND, state=STATE_RECORDING, alive=2))
+    master._dispatch_reply(heartbeat_reply(2, 2 * SECOND, error="boom"))
+    # 序号 3、4 丢失
+    master._dispatch_reply(heartbeat_reply(5, 5 * SECOND))
+    (state,) = master.slaves.values()
+    assert (state.heartbeats, state.heartbeats_lost, state.heartbeat_seq) == (3, 2, 5)
+    assert state.heartbeat_at == 5 * SECOND
+    # 错误文本只在几次心跳中携带，之后仍保留
+    assert state.last_error == "boom"
+
+    # 序号变小说明 slave 重启，不算丢失
+    master._dispatch_reply(heartbeat_reply(1, 6 * SECOND))
+    assert (state.heartbeats, state.heartbeats_lost, state.heartbeat_seq) == (4, 2, 1)
+
+
+def test_stale_after_missed_intervals():
+    master = MasterControl()
+    master._dispatch_reply(heartbeat_reply(1, SECOND, interval_ms=500))
+    (state,) = master.slaves.values()
+    assert not state.is_stale(SECOND + int(1.5 * SECOND), master.stale_after)
+    assert state.is_stale(SECOND + int(1.6 * SECOND), master.stale_after)
+    # 没有心跳间隔 (旧版本 slave) 的 slave 从不判为失联
+    master._dispatch_reply(heartbeat_reply(2, 2 * SECOND, interval_ms=0))
+    assert not state.is_stale(100 * SECOND, master.stale_after)
+
+
+def test_stale_and_back(rig):
+    quiet, steady = rig.add_slave(), rig.add_slave()
+    for slave in (quiet, steady):
+        slave.heartbeat(0.1, lambda: Heartbeat(devices=1))
+    master = rig.start()
+    changes = []
+    master.on_stale = lambda state: changes.append((state.peer, state.stale))
+    assert wait_for(lambda: len(master.status_table()) == 2)
+    assert not any(row["stale"] for row in master.status_table())
+
+    # 心跳只在知道 master 地址时发送，清除地址即停止心跳
+    address, quiet.master_address = quiet.master_address, None
+    assert wait_for(lambda: changes == [(rig.peer(quiet), True)])
+    rows = {row["peer"]: row for row in master.status_table()}
+    assert rows[rig.peer(quiet)]["stale"] and rows[rig.peer(quiet)]["age_s"] >= 0.3
+    assert not rows[rig.peer(steady)]["stale"]
+
+    quiet.master_address = address
+    assert wait_for(lambda: changes[-1] == (rig.peer(quiet), False))
+    assert len(changes) == 2
+    assert not master.slaves[rig.peer(quiet)].stale
+
+
+def test_silent_member_times_out(rig):
+    leaving, staying = rig.add_slave(), rig.add_slave()
+    for slave in (leaving, staying):
+        slave.heartbeat(0.1, lambda: Heartbeat(devices=1))
+    master = rig.start()
+    master.members.leave_timeout = 0.5
+    events = []
+    master.on_membership = lambda member, joined: events.append((member.peer, joined))
+    peer = rig.peer(leaving)
+    assert wait_for(lambda: all(state.heartbeats for state in master.slaves.values()))
+
+    # 进程消失但没有发出离开通告
+    rig.stop_slave(leaving)
+    assert wait_for(lambda: events == [(peer, False)])
+    assert peer not in master.members.members and peer not in master.slaves
+    time.sleep(0.6)
+    # 仍有心跳的成员不会超时
+    assert list(master.members.members) == [rig.peer(staying)]
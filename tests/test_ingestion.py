@@ -0,0 +1,75 @@
+import socket
+import threading
+import time
+
+from libs.controlplane import HANDLE_BATCH, MasterControl
+from libs.protocol import REPLY_STOP, format_peer, pack_reply
+
+from tests.conftest import free_port, wait_for
+
+SENDERS = 8
+PER_SENDER = 200
+
+
+def test_burst_is_queued_in_batches_without_loss():
+    handled = []
+    loop_threads = set()
+    busy = threading.Event()
+
+    def on_reply(reply):
+        loop_threads.add(threading.current_thread().name)
+        handled.append((reply.peer, reply.seq))
+        if busy.is_set():
+            time.sleep(0.0005)  # 处理比读取慢，队列会堆满
+
+    master = MasterControl(port=free_port(), reply_port=free_port(), on_reply=on_reply, queue_limit=64)
+    master.start()
+    senders = [socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) for _ in range(SENDERS)]
+    try:
+        busy.set()
+        for seq in range(PER_SENDER):
+            for sender in senders:
+                sender.sendto(pack_reply(0, REPLY_STOP, "stopped", seq), ("::1", master.reply_port))
+        # 格式错误的数据包只计数
+        senders[0].sendto(b"\x00garbage", ("::1", master.reply_port))
+        total = SENDERS * PER_SENDER
+        assert wait_for(lambda: len(handled) == total and master.ingest_stats()["queued"] == 0, timeout=10)
+
+        stats = master.ingest_stats()
+        assert stats["received"] == total + 1 and stats["rejected"] == 1 and stats["failed"] == 0
+        assert stats["kernel_drops"] in (None, 0)
+        # 队列达到上限时暂停读取，其余数据包留在内核缓冲区
+        assert stats["queue_pauses"] >= 1
+        assert HANDLE_BATCH < stats["queue_peak"] <= 64
+        assert stats["receive_buffer"] > 0
+        # 每个 slave 的回复按发送顺序处理，回调只在事件循环线程中执行
+        for sender in senders:
+            peer = format_peer(("::1", sender.getsockname()[1]))
+            assert [seq for p, seq in handled if p == peer] == list(range(PER_SENDER))
+        assert loop_threads == {"master-control"}
+        assert sum(state.replies for state in master.slaves.values()) == total
+    finally:
+        for sender in senders:
+            sender.close()
+        master.close()
+
+
+def test_failing_callback_does_not_stop_ingestion():
+    handled = []
+
+    def on_reply(reply):
+        handled.append(reply.seq)
+        if reply.seq % 2:
+            raise RuntimeError("handler bug")
+
+    master = MasterControl(port=free_port(), reply_port=free_port(), on_reply=on_reply)
+    master.start()
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sender:
+            for seq in range(10):
+                sender.sendto(pack_reply(0, REPLY_STOP, "", seq), ("::1", master.reply_port))
+            assert wait_for(lambda: len(handled) == 10)
+        assert master.ingest_stats()["received"] == 10
+    finally:
+        master.close()
+    assert master.ingest_stats()["receive_buffer"] is None
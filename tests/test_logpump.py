@@ -0,0 +1,86 @@
+import subprocess
+import sys
+import time
+
+from libs.logpump import LogPump
+
+from tests.conftest import wait_for
+
+
+def spawn(code):
+    return subprocess.Popen(
+        [sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+
+
+def test_drains_every_pipe_of_many_processes():
+    pump = LogPump(ring_lines=10)
+    # 每个进程向两个管道各写约 200 KB，远超管道缓冲区，没人读就会阻塞
+    code = (
+        "import sys\n"
+        "for i in range(2000):\n"
+        "    print('out', i, 'x' * 90)\n"
+        "    print('err', i, 'y' * 90, file=sys.stderr)\n"
+        "sys.stdout.write('no newline at the end')\n"
+    )
+    expected = sum(len(f"{s} {i} {c * 90}\n") for i in range(2000) for s, c in (("out", "x"), ("err", "y")))
+    expected += len("no newline at the end")
+    processes = [spawn(code) for _ in range(4)]
+    logs = [pump.add(p, f"Device{i}") for i, p in enumerate(processes)]
+    for process in processes:
+        assert process.wait(timeout=20) == 0
+    assert wait_for(lambda: all(log.finished for log in logs))
+    for log in logs:
+        assert log.line_count == 4001
+        assert log.byte_count == expected
+        assert log.tail(1, "stdout") == ["no newline at the end"]
+        assert len(log.lines) == 10
+
+
+def test_parses_recorder_events(tmp_path):
+    events = []
+    pump = LogPump(on_event=events.append)
+    code = (
+        "import sys, time\n"
+        "print('Device serial number: 000123456789')\n"
+        "print('Rgb firmware: 1.6.110')\n"
+        "print('[subordinate mode] Waiting for signal from master', flush=True)\n"
+        "time.sleep(0.2)\n"
+        "print('Started recording')\n"
+        "for i in range(5):\n"
+        "    print('[warning] frame dropped', file=sys.stderr)\n"
+        "print('just a line')\n"
+        "print('Done')\n"
+    )
+    process = spawn(code)
+    log = pump.add(process, "Device0", str(tmp_path / "logs" / "device0.log"))
+    armed = pump.wait_armed([process], {process: time.perf_counter()}, timeout=10)
+    assert armed[process] is not None and armed[process] < 10
+    process.wait(timeout=10)
+    assert wait_for(lambda: log.finished)
+
+    kinds = [event.kind for event in log.events]
+    # 两个管道之间没有先后顺序
+    assert [kind for kind in kinds if kind != "warning"] == ["serial", "firmware", "armed", "started", "done"]
+    assert kinds.count("warning") == 5
+    assert log.events[0].groups == ("000123456789",)
+    assert log.events[1].groups == ("Rgb", "1.6.110")
+    assert [event.kind for event in events] == kinds
+    # 每秒只打印一条警告，其余计数
+    assert (log.warnings, log.suppressed) == (5, 4)
+    text = (tmp_path / "logs" / "device0.log").read_text()
+    assert "stdout: just a line" in text and "stderr: [warning] frame dropped" in text
+
+
+def test_wait_armed_gives_up_on_exited_processes():
+    pump = LogPump()
+    quiet = spawn("print('k4a_device_open() failed')")
+    ready = spawn("import time; print('Waiting for signal from master', flush=True); time.sleep(0.5)")
+    start = time.perf_counter()
+    armed = pump.wait_armed([quiet, ready], timeout=10)
+    # 进程退出 (输出关闭) 后不再等待它就绪
+    assert time.perf_counter() - start < 5
+    assert armed[quiet] is None and armed[ready] is not None
+    assert [event.kind for event in pump.get(quiet).events] == ["error"]
+    for process in (quiet, ready):
+        process.wait(timeout=10)
@@ -0,0 +1,84 @@
+from libs.membership import ANNOUNCE_LEAVING, ANNOUNCE_PRESENT, MembershipRegistry, announcement
+
+SECOND = 1_000_000_000
+
+
+def announce(registry, peer, now, host="host-a", devices=2, offset=0, **extra):
+    text = announcement(host, devices, offset, 160, ["sim"], **extra)
+    return registry.announce(peer, ANNOUNCE_PRESENT, text, now)
+
+
+def test_announce_joins_once():
+    registry = MembershipRegistry()
+    joined, left = announce(registry, "a", 1, command_port=5000)
+    assert (joined.host, joined.devices, joined.sync_slots, left) == ("host-a", 2, range(0, 2), [])
+    assert joined.extra == {"command_port": 5000}
+    # 重复的通告不是新成员
+    assert announce(registry, "a", 2, command_port=5000) == (None, [])
+    assert registry.device_count == 2
+
+
+def test_reannouncement_refreshes_member():
+    registry = MembershipRegistry()
+    announce(registry, "a", 1, command_port=5000, arm_estimate_ms=2000.0)
+    announce(registry, "a", 5 * SECOND, devices=3, command_port=5001, arm_estimate_ms=1200.0)
+    (member,) = registry.table()
+    assert (member.devices, member.joined, member.last_seen) == (3, 1, 5 * SECOND)
+    assert member.extra == {"command_port": 5001, "arm_estimate_ms": 1200.0}
+
+
+def test_restarted_slave_replaces_old_member():
+    registry = MembershipRegistry()
+    announce(registry, "a", 1)
+    announce(registry, "b", 2, host="host-b", offset=2)
+    joined, left = announce(registry, "c", 3)
+    assert joined.peer == "c"
+    assert [m.peer for m in left] == ["a"]
+    assert [m.peer for m in registry.table()] == ["c", "b"]
+
+
+def test_leaving():
+    registry = MembershipRegistry()
+    announce(registry, "a", 1)
+    joined, left = registry.announce("a", ANNOUNCE_LEAVING, "", 2)
+    assert joined is None and [m.peer for m in left] == ["a"]
+    assert registry.announce("a", ANNOUNCE_LEAVING, "", 3) == (None, [])
+
+
+def test_expiry_and_touch():
+    registry = MembershipRegistry(leave_timeout=10.0)
+    announce(registry, "a", 0)
+    announce(registry, "b", 0, host="host-b", offset=2)
+    # 任意数据包 (例如心跳) 都算作还在
+    registry.touch("b", 8 * SECOND)
+    registry.touch("unknown", 8 * SECOND)
+    assert registry.expire(10 * SECOND) == []
+    assert [m.peer for m in registry.expire(11 * SECOND)] == ["a"]
+    assert registry.expire(17 * SECOND) == []
+    assert [m.peer for m in registry.expire(19 * SECOND)] == ["b"]
+    assert registry.members == {}
+
+
+def test_validate():
+    registry = MembershipRegistry()
+    assert registry.validate() == ["No slaves have joined"]
+    announce(registry, "a", 1)
+    announce(registry, "b", 1, host="host-b", offset=1, devices=1)
+    problems = registry.validate(clients=3, devices=2, capabilities=("pwm",))
+    assert "Expected 3 slave(s), 2 joined" in problems
+    assert "host-b has 1 device(s), expected 2" in problems
+    assert "host-a lacks pwm" in problems
+    assert "host-b and host-a both use sync delay slot 1" in problems
+
+
+def test_discover_refreshes_announced_extra(rig):
+    slave = rig.add_slave()
+    master = rig.start()
+    peer = rig.peer(slave)
+    assert master.members.members[peer].extra["command_port"] == slave.command_port
+
+    estimate = {"arm_estimate_ms": 1234.5}
+    slave.announce(lambda: announcement("host0", 1, 0, 160, ["sim"], command_port=slave.command_port, **estimate))
+    (member,) = master.discover(window=0.2).result()
+    assert member.peer == peer
+    assert member.extra == {"command_port": slave.command_port, "arm_estimate_ms": 1234.5}
@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from libs.mkvscan import SIMPLE_BLOCK, read_header, read_timestamps, scan_file
+from libs.simrecorder import MkvWriter, frame_sizes
+
+PERIOD_NS = 33_333_333
+# FFmpeg (libavformat) 写的文件: COLOR (MJPEG) 和 DEPTH (FFV1) 各 15 帧，30 fps，毫秒时间戳
+FFMPEG_FIXTURE = os.path.join(os.path.dirname(__file__), "data", "ffmpeg.mkv")
+CLUSTER_ID = bytes.fromhex("1F43B675")
+
+
+def record(path, frames=30, finalize=True):
+    writer = MkvWriter(str(path), frame_sizes("NFOV_2X2BINNED", "720p"), PERIOD_NS)
+    for i in range(frames):
+        writer.write_frame(i * PERIOD_NS, scale=0.01)  # 小帧，测试只关心结构
+    if finalize:
+        writer.finalize({"K4A_DEVICE_SERIAL_NUMBER": "000000001000", "K4A_START_OFFSET_NS": 0})
+    else:
+        writer.file.close()  # 与被强制结束的录像进程一样，没有 Cues 和 Duration
+    return str(path)
+
+
+def test_finalized_recording(tmp_path):
+    report = scan_file(record(tmp_path / "a.mkv"))
+    assert report.ok, report.issues
+    assert report.finalized and not report.truncated
+    assert report.doc_type == "matroska"
+    assert [t.name for t in report.tracks.values()] == ["COLOR", "DEPTH", "IR"]
+    assert all(t.frames == 30 and t.dropped == 0 for t in report.tracks.values())
+    assert report.cue_points == 30
+    assert report.duration_s == pytest.approx(1.0, abs=0.01)
+    assert report.tags["K4A_DEVICE_SERIAL_NUMBER"] == "000000001000"
+
+
+def test_unfinalized_recording(tmp_path):
+    report = scan_file(record(tmp_path / "b.mkv", finalize=False))
+    assert not report.finalized and not report.truncated
+    assert report.frames == 90
+    assert any("not finalized" in issue for issue in report.issues)
+
+
+def test_truncated_recording(tmp_path):
+    path = record(tmp_path / "c.mkv", finalize=False)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 100)
+    report = scan_file(path)
+    assert report.truncated
+    assert [t.frames for t in report.tracks.values()] == [30, 30, 29]  # 最后一帧的 IR 块被截断
+    assert not report.ok
+
+
+def damaged_fixture(tmp_path, name, damage):
+    data = bytearray(open(FFMPEG_FIXTURE, "rb").read())
+    damage(data)
+    path = tmp_path / name
+    path.write_bytes(bytes(data))
+    return str(path)
+
+
+def first_block(data):
+    """Offset of the data of the first SimpleBlock (FFmpeg puts CRC-32 and the timestamp before it)."""
+    _, pos, _ = read_header(data, data.index(CLUSTER_ID), len(data))
+    while True:
+        element_id, start, size = read_header(data, pos, len(data))
+        if element_id == SIMPLE_BLOCK:
+            return start
+        pos = start + size
+
+
+def test_ffmpeg_recording():
+    report = scan_file(FFMPEG_FIXTURE)
+    assert report.ok, report.issues
+    assert report.finalized and not report.truncated
+    assert report.muxing_app.startswith("Lavf")
+    assert report.timestamp_scale == 1_000_000
+    assert [(t.name, t.codec, t.frames, t.dropped) for t in report.tracks.values()] == [
+        ("COLOR", "V_MJPEG", 15, 0),
+        ("DEPTH", "V_FFV1", 15, 0),
+    ]
+    assert report.duration_s == pytest.approx(0.5)
+    assert report.tags["K4A_START_OFFSET_NS"] == "160000"
+
+    _, timestamps = read_timestamps(FFMPEG_FIXTURE, "DEPTH")
+    # 毫秒精度的时间戳，按 TimestampScale 换算为纳秒
+    assert list(timestamps)[:4] == [0, 33_000_000, 67_000_000, 100_000_000]
+    assert len(timestamps) == 15
+
+
+def test_truncated_ffmpeg_recording(tmp_path):
+    path = damaged_fixture(tmp_path, "cut.mkv", lambda data: data.__delitem__(slice(len(data) // 2, None)))
+    report = scan_file(path)
+    assert report.truncated and not report.ok
+    assert 0 < report.frames < 30
+
+
+def test_corrupt_element_id(tmp_path):
+    def corrupt(data):
+        _, pos, _ = read_header(data, data.index(CLUSTER_ID), len(data))
+        data[pos] = 0  # Cluster 的第一个子元素 ID 没有标记位
+
+    report = scan_file(damaged_fixture(tmp_path, "id.mkv", corrupt))
+    assert not report.ok
+    assert any(issue.startswith("Unreadable: Invalid element ID") for issue in report.issues)
+
+
+def test_block_for_undeclared_track(tmp_path):
+    def corrupt(data):
+        data[first_block(data)] = 0x83  # 第一块改为轨道 3
+
+    report = scan_file(damaged_fixture(tmp_path, "track.mkv", corrupt))
+    assert "Blocks for undeclared track 3" in report.issues
+    assert report.tracks[3].frames == 1
+    assert sum(t.frames for t in report.tracks.values()) == 30
+
+
+def test_not_matroska(tmp_path):
+    path = damaged_fixture(tmp_path, "header.mkv", lambda data: data.__setitem__(slice(0, 4), b"RIFF"))
+    report = scan_file(path)
+    assert not report.ok
+    assert report.issues == ["Not an EBML file"]
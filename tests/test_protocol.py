@@ -0,0 +1,87 @@
+import struct
+
+import pytest
+
+from libs.protocol import (
+    CMD_START,
+    COMMAND,
+    PROTOCOL_VERSION,
+    REPLY,
+    REPLY_ACK,
+    REPLY_HEARTBEAT,
+    REPLY_PING,
+    REPLY_RECORDED,
+    STATE_RECORDING,
+    Heartbeat,
+    ProtocolError,
+    pack_command,
+    pack_heartbeat,
+    pack_reply,
+    unpack_command,
+    unpack_reply,
+)
+
+ADDRESS = ("fe80::1", 4328, 0, 2)
+
+
+def test_command_round_trip():
+    packet = pack_command(CMD_START, 30, "会话-1", 123456789012, 42)
+    command = unpack_command(memoryview(packet), ADDRESS)
+    assert (command.status, command.argument, command.session_name) == (CMD_START, 30, "会话-1")
+    assert (command.timestamp, command.seq, command.address) == (123456789012, 42, ADDRESS)
+
+
+def test_reply_round_trip():
+    packet = pack_reply(-1, REPLY_RECORDED, '{"path": "a.mkv"}', 7)
+    reply = unpack_reply(memoryview(packet), ADDRESS)
+    assert (reply.status, reply.msg_type, reply.msg_text, reply.seq) == (-1, REPLY_RECORDED, '{"path": "a.mkv"}', 7)
+    assert reply.peer == "[fe80::1]:4328"
+
+
+def test_reply_timestamps_round_trip():
+    packet = pack_reply(0, REPLY_PING, "", 3, (1, -2, 3))
+    assert unpack_reply(memoryview(packet), ADDRESS).stamps == (1, -2, 3)
+
+
+def test_heartbeat_round_trip():
+    heartbeat = Heartbeat(STATE_RECORDING, 3, 2, 3, 5, 10**12, 87.5, 1000, "disk full")
+    reply = unpack_reply(memoryview(pack_heartbeat(heartbeat, 9)), ADDRESS)
+    assert reply.msg_type == REPLY_HEARTBEAT and reply.seq == 9
+    assert reply.heartbeat == heartbeat
+
+
+@pytest.mark.parametrize("packet", [pack_command(CMD_START, 1, "abc"), pack_reply(0, REPLY_ACK, "text")])
+def test_rejects_wrong_length(packet):
+    unpack = unpack_command if packet[1] == CMD_START else unpack_reply
+    for data in (packet[:-1], packet + b"x", packet[:3]):
+        with pytest.raises(ProtocolError):
+            unpack(memoryview(data), ADDRESS)
+
+
+def test_rejects_wrong_version():
+    command = bytearray(pack_command(CMD_START))
+    command[0] = PROTOCOL_VERSION + 1
+    with pytest.raises(ProtocolError, match="version"):
+        unpack_command(memoryview(command), ADDRESS)
+    reply = bytearray(pack_reply(0, REPLY_ACK))
+    reply[0] = PROTOCOL_VERSION - 1
+    with pytest.raises(ProtocolError, match="version"):
+        unpack_reply(memoryview(reply), ADDRESS)
+
+
+def test_rejects_unknown_types():
+    with pytest.raises(ProtocolError, match="Unknown command"):
+        unpack_command(memoryview(COMMAND.pack(PROTOCOL_VERSION, 99, 0, 0, 0, 0)), ADDRESS)
+    with pytest.raises(ProtocolError, match="Unknown reply"):
+        unpack_reply(memoryview(REPLY.pack(PROTOCOL_VERSION, 99, 0, 0, 0)), ADDRESS)
+
+
+def test_pack_limits():
+    with pytest.raises(ProtocolError):
+        pack_command(CMD_START, 0, "x" * 256)
+    with pytest.raises(ProtocolError):
+        pack_reply(0, REPLY_RECORDED, "x" * 5000)
+    with pytest.raises(ProtocolError):
+        pack_reply(0, REPLY_HEARTBEAT)
+    with pytest.raises(struct.error):
+        pack_command(CMD_START, 2**31)
@@ -0,0 +1,99 @@
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("serial")
+if sys.platform == "win32":
+    pytest.skip("FakeController needs a pseudo terminal", allow_module_level=True)
+
+from libs.pwm import REPLY_PATTERN, FakeController, PwmController, PwmError
+
+
+@pytest.fixture
+def fake():
+    controllers = []
+
+    def make(**kwargs):
+        controller = FakeController(**kwargs)
+        controllers.append(controller)
+        return controller
+
+    yield make
+    for controller in controllers:
+        controller.close()
+
+
+def test_pipelined_answers_in_order(fake):
+    controller = fake()
+    with PwmController(controller.port) as pwm:
+        futures = pwm.send("dU2:010", "FR2:060", "dU3:020", "FR3:030")
+        replies = [f.result(timeout=2).reply for f in futures]
+    assert replies == ["OK duty 2 10", "OK freq 2 60", "OK duty 3 20", "OK freq 3 30"]
+    assert [command for _, command in controller.commands] == ["dU2:010", "FR2:060", "dU3:020", "FR3:030"]
+
+
+def test_start_timestamps_trigger(fake):
+    controller = fake()
+    with PwmController(controller.port) as pwm:
+        trigger = pwm.start(1, 30, 50)
+    assert (controller.duty[1], controller.frequency[1]) == (50, 30)
+    assert trigger.started_ns <= trigger.acked_ns
+    assert controller.started_at(1) <= trigger.acked_ns
+
+
+def test_rejected_command(fake):
+    with PwmController(fake().port) as pwm:
+        with pytest.raises(PwmError, match="invalid slot 7"):
+            pwm.set_frequency(7, 10)
+        # 被拒绝后后续命令仍然按顺序匹配
+        assert pwm.stop(1).reply == "OK freq 1 0"
+
+
+def test_timeout_expires_pending(fake):
+    with PwmController(fake(reply_delay=1.0).port, timeout=0.2) as pwm:
+        start = time.perf_counter()
+        with pytest.raises(PwmError, match="No answer"):
+            pwm.stop(1)
+        assert time.perf_counter() - start < 0.8
+
+
+def test_unsolicited_lines_go_to_on_message(fake):
+    messages = []
+    with PwmController(fake(banner="PWM controller v1 ready", banner_delay=0.05).port, on_message=messages.append):
+        deadline = time.perf_counter() + 2
+        while not messages and time.perf_counter() < deadline:
+            time.sleep(0.01)
+    assert messages == ["PWM controller v1 ready"]
+
+
+def test_banner_while_pending_is_not_an_answer(fake):
+    # 没有 settle 时 banner 可能在命令等待回复期间到达
+    controller = fake(banner="PWM controller v1 ready", banner_delay=0.05, reply_delay=0.3)
+    messages = []
+    with PwmController(controller.port, on_message=messages.append, timeout=2) as pwm:
+        ack = pwm.set_duty(1, 40)
+    assert ack.reply == "OK duty 1 40"
+    assert messages == ["PWM controller v1 ready"]
+
+
+def test_answers_in_another_format(fake):
+    # 实际控制器的应答格式不一定是 OK/ERR，默认按顺序把下一行当作应答
+    controller = fake(reply_format="{command} -> {value}", banner="PWM controller v2 ready", banner_delay=0.05)
+    messages = []
+    with PwmController(controller.port, on_message=messages.append, timeout=2) as pwm:
+        time.sleep(0.1)
+        trigger = pwm.start(2, 60, 25)
+        assert pwm.stop(2).reply == "FR2:000 -> 0"
+    assert (controller.duty[2], controller.frequency[2]) == (25, 0)
+    assert trigger.started_ns <= trigger.acked_ns
+    assert messages == ["PWM controller v2 ready"]
+
+
+def test_strict_reply_pattern(fake):
+    controller = fake(reply_format="{command} -> {value}")
+    messages = []
+    with PwmController(controller.port, on_message=messages.append, timeout=0.3, reply_pattern=REPLY_PATTERN) as pwm:
+        with pytest.raises(PwmError, match="No answer"):
+            pwm.set_duty(1, 40)
+    assert messages == ["dU1:040 -> 40"]
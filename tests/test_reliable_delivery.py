@@ -0,0 +1,111 @@
+import time
+
+from libs.controlplane import SlaveControl
+from libs.protocol import CMD_START, CMD_STOP, REPLY_ACK, Command
+
+from tests.conftest import wait_for
+
+
+def count_executions(slave: SlaveControl, status: int):
+    runs = []
+
+    def handler(command):
+        runs.append(command.seq)
+        slave.reply(command, 0, status, "done")
+
+    slave.on(status, handler)
+    return runs
+
+
+def test_retransmits_until_acked(rig):
+    lossy, healthy = rig.add_slave(), rig.add_slave()
+    lossy_runs = count_executions(lossy, CMD_STOP)
+    healthy_runs = count_executions(healthy, CMD_STOP)
+    # 前三个 STOP 数据包 (组播和单播重传) 丢失
+    rig.link(lossy).drop_first(CMD_STOP, 3)
+    master = rig.start()
+
+    replies = master.send_stop(timeout=3, expected=2).result()
+    assert len(replies) == 2
+    assert wait_for(lambda: len(rig.acks[lossy]) >= 1)
+    time.sleep(0.3)  # 等待可能仍在途中的重传
+
+    (seq,) = set(lossy_runs)
+    assert lossy_runs == [seq] and healthy_runs == [seq]
+    link = rig.link(lossy)
+    # 按退避单播重传 (不足 expected 个 ACK 时组播也重复) 直到收到 ACK，每份送达的副本都回 ACK
+    assert link.count(CMD_STOP) >= 4
+    assert link.count(CMD_STOP, "unicast") >= 1
+    assert rig.acks[lossy] == [seq] * (link.count(CMD_STOP) - 3)
+    # 已确认的 slave 不再收到单播重传
+    assert rig.link(healthy).count(CMD_STOP, "unicast") == 0
+    assert rig.acks[healthy] == [seq] * rig.link(healthy).count(CMD_STOP)
+    assert master.slaves[rig.peer(lossy)].ack_ms > master.slaves[rig.peer(healthy)].ack_ms
+
+
+def test_duplicates_execute_once_and_are_acked_again(rig):
+    slave = rig.add_slave()
+    runs = count_executions(slave, CMD_STOP)
+    # 每个数据包送达两次
+    rig.link(slave).drop_first(CMD_STOP, 0, duplicates=2)
+    master = rig.start()
+
+    for _ in range(3):
+        assert len(master.send_stop(timeout=2, expected=1).result()) == 1
+    assert wait_for(lambda: len(rig.acks[slave]) >= 6)
+    assert len(runs) == len(set(runs)) == 3
+    # 重复的命令也回 ACK，之前的 ACK 可能丢失
+    assert sorted(rig.acks[slave]) == sorted(runs * 2)
+
+
+def test_ack_lost_retransmit_is_not_executed_again(rig):
+    slave = rig.add_slave()
+    runs = count_executions(slave, CMD_STOP)
+    master = rig.start()
+    send = slave.reply
+    lost = []
+
+    def lose_first_ack(command, status_code, msg_type, *args, **kwargs):
+        if msg_type == REPLY_ACK and not lost:
+            lost.append(command.seq)
+            return
+        send(command, status_code, msg_type, *args, **kwargs)
+
+    slave.reply = lose_first_ack
+    assert len(master.send_stop(timeout=2, expected=1).result()) == 1
+    assert wait_for(lambda: rig.link(slave).count(CMD_STOP, "unicast") >= 1)
+    time.sleep(0.3)
+    assert runs == lost
+    assert rig.link(slave).count(CMD_STOP, "unicast") == 1
+
+
+def test_dedup_window():
+    slave = SlaveControl()
+    try:
+        runs = []
+        acks = []
+        slave.on(CMD_START, lambda command: runs.append(command.seq))
+        slave.reply = lambda command, status_code, msg_type, *args: acks.append((command.seq, msg_type))
+        master = ("fe80::1", 4328, 0, 2)
+        other = ("fe80::2", 4328, 0, 2)
+
+        def command(seq, address=master):
+            return Command(CMD_START, 10, "s", address, seq=seq)
+
+        slave._dispatch(command(7))
+        slave._dispatch(command(7))
+        # 同一序号来自另一个 master 不是重复命令
+        slave._dispatch(command(7, other))
+        assert runs == [7, 7]
+        assert acks == [(7, REPLY_ACK)] * 3
+
+        # 窗口只记住最近 256 条命令
+        for seq in range(100, 100 + 256):
+            slave._dispatch(command(seq))
+        slave._dispatch(command(7))
+        assert runs[-1] == 7
+        assert runs.count(7) == 3
+    finally:
+        slave.executor.shutdown()
+        slave.reply_socket.close()
+        slave.command_socket.close()
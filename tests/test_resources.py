@@ -0,0 +1,73 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from libs.resources import KEEP_SESSIONS, ResourceSample, ResourceSampler, SeriesStats
+
+psutil = pytest.importorskip("psutil")
+
+BUSY = "import time\nend = time.time() + 5\nwhile time.time() < end:\n    pass\n"
+
+
+def test_series_stats():
+    stats = SeriesStats()
+    stats.update(ResourceSample(0.0, 50.0, 100_000_000, 0, 0.0, 4), 0, 1.0)
+    stats.update(ResourceSample(1.0, 150.0, 300_000_000, 4_000_000, 8_000_000.0, 6), 4_000_000, 0.5)
+    assert stats.summary() == {
+        "samples": 2,
+        "cpu_mean": 100.0,
+        "cpu_max": 150.0,
+        "rss_max_mb": 300.0,
+        "threads_max": 6,
+        "written_mb": 4.0,
+        "write_mbps_mean": 2.67,
+        "write_mbps_max": 8.0,
+    }
+    assert SeriesStats().summary()["cpu_mean"] is None
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="starts the recorder through sh")
+def test_samples_the_recorder_behind_a_shell():
+    sampler = ResourceSampler(interval=0)
+    # 与 k4arecorder 一样经 shell 启动，CPU 消耗在子进程里
+    process = subprocess.Popen(f"{sys.executable} -c '{BUSY}'; true", shell=True)
+    try:
+        sampler.track(process, "Device0", "s1")
+        for _ in range(4):
+            sampler.sample_once()
+            time.sleep(0.2)
+        assert sampler.active_cpu() > 50
+        samples = sampler.series("Device0", "s1")
+        # 第一次采样只记录计数器起点
+        assert len(samples) == 3
+        assert all(s.cpu_percent > 50 and s.rss > 0 and s.threads >= 2 for s in samples)
+    finally:
+        psutil.Process(process.pid).children()[0].kill()
+        process.wait(timeout=10)
+
+    sampler.sample_once()
+    assert sampler.active_cpu() == 0
+    summary = sampler.summary("s1")
+    assert set(summary) == {"Device0", "slave"}
+    assert summary["Device0"]["samples"] == 3 and summary["Device0"]["cpu_mean"] > 50
+    # 已退出的进程仍可查询
+    assert len(sampler.series("Device0")) == 3
+
+
+def test_keeps_the_latest_sessions():
+    sampler = ResourceSampler(interval=0, include_self=False)
+    processes = [subprocess.Popen([sys.executable, "-c", "import time; time.sleep(5)"]) for _ in range(2)]
+    try:
+        for session in range(KEEP_SESSIONS + 2):
+            sampler.track(processes[session % 2], f"Device{session}", f"s{session}")
+        for _ in range(2):
+            sampler.sample_once()
+            time.sleep(0.05)
+        assert sampler.summary("s0") == {} and sampler.summary("s1") == {}
+        assert sampler.summary(f"s{KEEP_SESSIONS + 1}")[f"Device{KEEP_SESSIONS + 1}"]["samples"] == 1
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
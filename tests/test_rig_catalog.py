@@ -0,0 +1,48 @@
+from libs.catalog import (
+    STATUS_COMPLETE,
+    STATUS_FAILED,
+    STATUS_STOPPED,
+    RigCatalog,
+    SessionCatalog,
+    file_report,
+)
+
+
+def test_rig_catalog_from_slave_reports(tmp_path):
+    catalog = SessionCatalog(str(tmp_path / "data"))
+    rig = RigCatalog(str(tmp_path / "rig.sqlite3"))
+    try:
+        round_ = catalog.allocate_round("s1", 30, 2)
+        paths = [str(tmp_path / "data" / f"s1-Device{i}.mkv") for i in range(2)]
+        for device, path in enumerate(paths):
+            catalog.add_file(path, round_, "s1", device)
+        open(paths[0], "wb").write(b"x" * 100)
+        records = [
+            catalog.finish_file(paths[0], STATUS_COMPLETE, 30.0),
+            catalog.finish_file(paths[1], STATUS_FAILED),
+        ]
+        for record in records:
+            rig.add_report(file_report("host-a", record))
+        assert [f.device for f in rig.find(session="s1", host="host-a")] == [0, 1]
+        assert rig.find(session="s1", host="host-b") == []
+        assert rig.sessions() == [("s1", 1, 2, 100, 1)]
+        # 同一文件再次上报时覆盖原来的记录
+        rig.add_report(file_report("host-a", catalog.finish_file(paths[1], STATUS_STOPPED)))
+        assert rig.sessions() == [("s1", 1, 2, 100, 0)]
+    finally:
+        catalog.close()
+        rig.close()
+
+
+def test_rig_catalog_rejects_incomplete_reports(tmp_path):
+    rig = RigCatalog(str(tmp_path / "rig.sqlite3"))
+    try:
+        try:
+            rig.add_report({"host": "host-a"})
+        except KeyError:
+            pass
+        else:
+            raise AssertionError("report without a path was accepted")
+        assert rig.find() == []
+    finally:
+        rig.close()
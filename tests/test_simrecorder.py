@@ -0,0 +1,99 @@
+import os
+import signal
+import sys
+import time
+
+import pytest
+
+from libs.clocksync import now_ns
+from libs.mkvscan import scan_file
+from libs.recorder import SYNC_MASTER, RecorderBackend, RecordingSpec, SimulatedRecorder, create_recorder
+from libs.simrecorder import READY_SIGNAL, frame_sizes, main
+
+
+def spec(path, sync_mode=SYNC_MASTER, record_time=1):
+    return RecordingSpec(0, str(path), record_time, sync_mode, depth_mode="NFOV_2X2BINNED", color_mode="720p")
+
+
+def test_backend_needs_a_command():
+    with pytest.raises(TypeError):
+        RecorderBackend()
+    with pytest.raises(ValueError):
+        create_recorder("azure")
+
+
+def test_frame_sizes():
+    assert [t[0] for t in frame_sizes("NFOV_UNBINNED", "1080p")] == ["COLOR", "DEPTH", "IR"]
+    assert frame_sizes("NFOV_UNBINNED", "OFF")[0] == ("DEPTH", "V_MS/VFW/FOURCC", 640, 576, 640 * 576 * 2)
+    # 被动红外模式只有 IR 轨道
+    assert [t[0] for t in frame_sizes("PASSIVE_IR", "OFF")] == ["IR"]
+
+
+def test_command_uses_k4arecorder_options():
+    recorder = SimulatedRecorder(startup=0.1, drop_rate=0.5, trigger_file="go")
+    command = recorder.command(RecordingSpec(2, "out.mkv", 5, sync_delay=320))
+    assert command[:3] == [sys.executable, "-m", "libs.simrecorder"]
+    assert command[command.index("--external-sync") + 1] == "Subordinate"
+    assert command[command.index("--sync-delay") + 1] == "320"
+    assert command[command.index("--trigger-file") + 1] == "go"
+    assert command[-1] == "out.mkv"
+
+
+def test_records_for_the_record_length(tmp_path, capsys):
+    path = tmp_path / "a.mkv"
+    argv = ["--external-sync", "Master", "-d", "NFOV_2X2BINNED", "-c", "720p", "-l", "1"]
+    assert main(argv + ["--startup", "0", "--startup-jitter", "0", "--bitrate", "0.5", str(path)]) == 0
+    assert "Started recording" in capsys.readouterr().out
+    report = scan_file(str(path))
+    assert report.ok and report.finalized, report.issues
+    assert [t.frames for t in report.tracks.values()] == [30, 30, 30]
+    assert report.tags["K4A_WIRED_SYNC_MODE"] == "MASTER"
+
+
+def test_failed_start(tmp_path, capsys):
+    path = tmp_path / "b.mkv"
+    assert main(["--startup", "0", "--startup-jitter", "0", "--fail-rate", "1", str(path)]) == 1
+    assert "k4a_device_start_cameras() failed" in capsys.readouterr().err
+    assert not path.exists()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="SIGINT to a child process")
+def test_subordinate_waits_for_the_trigger_and_finalizes_on_ctrl_c(tmp_path):
+    trigger = tmp_path / "trigger"
+    recorder = SimulatedRecorder(startup=0.1, startup_jitter=0, bitrate=0.5, trigger_file=str(trigger))
+    process = recorder.spawn(spec(tmp_path / "c.mkv", "Subordinate", record_time=0), new_session=False)
+    try:
+        for line in process.stdout:
+            if READY_SIGNAL in line:
+                break
+        time.sleep(0.2)
+        # 触发前不写帧
+        assert scan_file(str(tmp_path / "c.mkv")).frames == 0
+        trigger.write_text(str(now_ns()))
+        time.sleep(0.5)
+        process.send_signal(signal.SIGINT)
+        output, _ = process.communicate(timeout=10)
+    finally:
+        process.kill()
+    assert process.returncode == 0
+    assert "Saving recording..." in output
+    report = scan_file(str(tmp_path / "c.mkv"))
+    assert report.finalized and report.frames > 0
+    assert report.tags["K4A_WIRED_SYNC_MODE"] == "SUBORDINATE"
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="SIGTERM")
+def test_killed_recording_is_not_finalized(tmp_path):
+    recorder = SimulatedRecorder(startup=0.1, startup_jitter=0, bitrate=0.5)
+    process = recorder.spawn(spec(tmp_path / "d.mkv", record_time=0))
+    try:
+        for line in process.stdout:
+            if "Started recording" in line:
+                break
+        time.sleep(0.3)
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    finally:
+        process.kill()
+    report = scan_file(str(tmp_path / "d.mkv"))
+    assert not report.finalized and report.frames > 0
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from libs.stats import SKEW_FLOOR_MS, ArmTimeEstimate, ArmTimeEstimates, LatencyHistogram
+
+
+def test_empty():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.mean is None
+
+
+def test_percentiles_within_bucket_error():
+    rng = random.Random(1)
+    values = sorted(rng.randint(50_000, 50_000_000) for _ in range(10_000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    assert histogram.count == len(values)
+    assert histogram.mean == pytest.approx(sum(values) / len(values))
+    for p in (1, 50, 90, 99):
+        exact = values[int(len(values) * p / 100) - 1]
+        # 每十倍 20 个桶，相对误差约 6%
+        assert histogram.percentile(p) == pytest.approx(exact, rel=0.07)
+
+
+def test_percentiles_clamped_to_observed_range():
+    histogram = LatencyHistogram()
+    for value in (500, 2_000_000, 10**11):  # 低于 min_ns、正常、高于 max_ns
+        histogram.record(value)
+    # 超出范围的值落在两端的桶里，结果不超出实际观测到的范围
+    assert 500 <= histogram.percentile(0) <= histogram.min_ns
+    assert histogram.percentile(50) == pytest.approx(2_000_000, rel=0.07)
+    assert 10**10 * 0.9 <= histogram.percentile(100) <= 10**11
+
+
+def test_arm_estimate_uses_initial_guess_then_slowest_run():
+    estimate = ArmTimeEstimate(2000.0, min_samples=3)
+    assert estimate.estimate_ms == 2000.0
+    assert estimate.skew_bound_ms is None
+    estimate.record(900.0)
+    estimate.record(1200.0)
+    # 样本不足时不低于已见过的最慢一次
+    assert estimate.estimate_ms >= 1200.0
+    assert estimate.skew_bound_ms is None
+
+
+def test_arm_estimate_covers_noisy_runs():
+    rng = random.Random(3)
+    estimate = ArmTimeEstimate(2000.0)
+    runs = [rng.gauss(1000, 50) for _ in range(200)]
+    for ms in runs[:100]:
+        estimate.record(ms)
+    # 均值 + 3 倍标准差应覆盖绝大多数后续启动，单次最大值不行
+    covered = sum(ms <= estimate.estimate_ms for ms in runs[100:])
+    assert covered >= 97
+    assert estimate.estimate_ms == pytest.approx(1150, abs=60)
+    skews = [ms - estimate.estimate_ms for ms in runs[100:]]
+    assert sum(abs(skew) <= estimate.skew_bound_ms for skew in skews) >= 97
+
+
+def test_arm_estimate_follows_a_slower_recorder():
+    estimate = ArmTimeEstimate(2000.0)
+    for _ in range(20):
+        estimate.record(1000.0)
+    assert estimate.estimate_ms == pytest.approx(1000.0)
+    assert estimate.skew_bound_ms == pytest.approx(SKEW_FLOOR_MS)
+    estimate.record(1500.0)
+    # 变慢的一次同时抬高均值和余量
+    assert estimate.estimate_ms > 1500.0
+    for _ in range(40):
+        estimate.record(1500.0)
+    assert estimate.estimate_ms == pytest.approx(1500.0, abs=5)
+
+
+def test_arm_estimates_take_the_slowest_device():
+    estimates = ArmTimeEstimates(2000.0, min_samples=1)
+    assert estimates.estimate_ms == 2000.0
+    assert estimates.skew_bound_ms is None
+    estimates.record(0, 800.0)
+    estimates.record(1, 1100.0)
+    assert estimates.estimate_ms == 1100.0
+    assert estimates.skew_bound_ms == pytest.approx(SKEW_FLOOR_MS)
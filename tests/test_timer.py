@@ -0,0 +1,55 @@
+import threading
+import time
+
+from libs.timer import PreciseTimer
+
+MS = 1_000_000
+
+
+def test_wakes_at_the_deadline():
+    timer = PreciseTimer()
+    for delay_ms in (1, 5, 20):
+        deadline = time.perf_counter_ns() + delay_ms * MS
+        error = timer.sleep_until_ns(deadline)
+        woke = time.perf_counter_ns()
+        # 不会提前醒来，返回值就是迟到的时间
+        assert 0 <= error <= woke - deadline
+        assert error < 5 * MS
+    stats = timer.stats()
+    assert stats["count"] == 3
+    assert 0 <= stats["p50_us"] <= stats["max_us"] < 5000
+
+
+def test_past_deadline_returns_at_once():
+    timer = PreciseTimer()
+    start = time.perf_counter_ns()
+    error = timer.sleep_until_ns(start - 10 * MS)
+    assert error >= 10 * MS
+    assert time.perf_counter_ns() - start < MS
+
+
+def test_sleep_does_not_spin_until_the_deadline():
+    timer = PreciseTimer(spin_ns=200_000)
+    start = time.thread_time()
+    timer.sleep_ms(100)
+    # 只有最后一小段自旋，本线程几乎不占 CPU
+    assert time.thread_time() - start < 0.02
+    assert timer.stats()["count"] == 1
+
+
+def test_other_threads_run_during_the_sleep():
+    timer = PreciseTimer()
+    ticks = []
+
+    def tick():
+        for _ in range(10):
+            ticks.append(time.perf_counter_ns())
+            time.sleep(0.005)
+
+    thread = threading.Thread(target=tick)
+    start = time.perf_counter_ns()
+    thread.start()
+    timer.sleep_ms(100)
+    thread.join()
+    # 另一个线程的循环在睡眠结束之前就已完成
+    assert len(ticks) == 10 and ticks[-1] - start < 100 * MS
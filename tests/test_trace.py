@@ -0,0 +1,117 @@
+import json
+
+from libs.clocksync import ClockEstimate
+from libs.protocol import CMD_STOP, REPLY_TRACE
+from libs.trace import CHUNK_BYTES, Timeline, TraceStore, chrome_trace, parse_chunk, save_trace
+
+from tests.conftest import wait_for
+
+MS = 1_000_000
+
+
+def by_name(trace, name):
+    (event,) = [e for e in trace["traceEvents"] if e["name"] == name and e["ph"] != "M"]
+    return event
+
+
+def test_chrome_trace_shape(tmp_path):
+    master = Timeline("s1")
+    master.instant("GO sent", at_ns=100 * MS, seq=7)
+    master.span("barrier", 90 * MS, 100 * MS)
+    aligned = [("spawn", "Device0", 95 * MS + 1_000_000, 96 * MS + 1_000_000, {"pid": 42})]
+    unaligned = [("trigger", "Device0", 5 * MS, None, None)]
+    # 第一个 slave 的时钟比 master 快 1 ms，第二个没有时钟估计
+    clocks = {"[fe80::1]:1": ClockEstimate(offset_ns=MS, delay_ns=200_000, updated_ns=0), "[fe80::2]:1": None}
+    trace = chrome_trace(
+        "s1", master, {"[fe80::1]:1": aligned, "[fe80::2]:1": unaligned}, clocks, {"[fe80::1]:1": "host-a"}
+    )
+
+    assert trace["displayTimeUnit"] == "ms"
+    assert trace["otherData"]["session"] == "s1"
+    assert trace["otherData"]["origin_ns"] == 5 * MS
+    assert trace["otherData"]["clocks"] == {
+        "[fe80::1]:1": {"offset_ms": 1.0, "rtt_ms": 0.2, "drift_ppm": 0.0},
+        "[fe80::2]:1": None,
+    }
+    names = {e["pid"]: e["args"]["name"] for e in trace["traceEvents"] if e["name"] == "process_name"}
+    # slave 按进程名排序
+    assert names == {1: "master", 2: "[fe80::2]:1 (clock not aligned)", 3: "host-a [fe80::1]:1"}
+    threads = {(e["pid"], e["args"]["name"]) for e in trace["traceEvents"] if e["name"] == "thread_name"}
+    assert threads == {(1, "control"), (2, "Device0"), (3, "Device0")}
+
+    # 时间为微秒，从最早的事件算起；slave 的时间换算到 master 时钟
+    go = {"name": "GO sent", "pid": 1, "tid": 1, "ts": 95_000.0, "ph": "i", "s": "t", "args": {"seq": 7}}
+    assert by_name(trace, "GO sent") == go
+    barrier = {"name": "barrier", "pid": 1, "tid": 1, "ts": 85_000.0, "ph": "X", "dur": 10_000.0}
+    assert by_name(trace, "barrier") == barrier
+    spawn = by_name(trace, "spawn")
+    assert (spawn["pid"], spawn["ts"], spawn["dur"], spawn["args"]) == (3, 90_000.0, 1000.0, {"pid": 42})
+    assert by_name(trace, "trigger")["ts"] == 0.0
+
+    path = tmp_path / "s1.trace.json"
+    save_trace(trace, str(path))
+    assert json.loads(path.read_text()) == trace
+
+
+def test_chunks_fit_a_datagram_and_reassemble():
+    timeline = Timeline("会话")
+    for i in range(300):
+        timeline.span(f"frame {i}", i * MS, i * MS + 500, track="Device0", index=i)
+    timeline.instant("huge", note="x" * CHUNK_BYTES)
+    chunks = timeline.chunks()
+    assert len(chunks) > 1
+    assert all(len(chunk.encode("utf-8")) <= CHUNK_BYTES for chunk in chunks)
+    # 单个事件大于一个数据包时丢弃并计数
+    assert timeline.dropped == 1
+
+    store = TraceStore()
+    for chunk in reversed(chunks[1:]):
+        assert store.add_chunk("peer", chunk) == ("会话", False)
+    assert store.incomplete("会话") == ["peer"]
+    assert store.add_chunk("peer", chunks[0]) == ("会话", True)
+    assert store.incomplete("会话") == []
+    events = store.events("会话")["peer"]
+    assert [e[0] for e in events] == [f"frame {i}" for i in range(300)]
+    assert events[5] == ("frame 5", "Device0", 5 * MS, 5 * MS + 500, {"index": 5})
+    assert parse_chunk(chunks[0])[:3] == ("会话", 0, len(chunks))
+
+
+def test_master_merges_slave_timelines(rig):
+    slave = rig.add_slave()
+
+    def on_stop(command):
+        slave.reply(command, 0, CMD_STOP, "stopped")
+        timeline = Timeline("s1")  # STOP 不带会话名，slave 用自己正在录像的会话
+        timeline.instant("STOP received", at_ns=command.received)
+        timeline.span("recorder exit", command.received, command.received + MS, track="Device0")
+        for chunk in timeline.chunks():
+            slave.reply(command, 0, REPLY_TRACE, chunk)
+
+    slave.on(CMD_STOP, on_stop)
+    master = rig.start()
+    master.session = "s1"
+    assert len(master.send_stop(timeout=2, expected=1).result()) == 1
+    assert wait_for(lambda: rig.peer(slave) in master.traces.events("s1"))
+
+    trace = master.trace()
+    assert trace["otherData"]["session"] == "s1"
+    # 回环上的 slave 与 master 同一时钟，偏移接近 0
+    assert abs(trace["otherData"]["clocks"][rig.peer(slave)]["offset_ms"]) < 5
+    names = {e["args"]["name"] for e in trace["traceEvents"] if e["name"] == "process_name"}
+    assert names == {"master", f"host0 {rig.peer(slave)}"}
+    received = by_name(trace, "STOP received")
+    assert received["pid"] == 2 and received["ph"] == "i"
+    assert by_name(trace, "recorder exit")["dur"] == 1000.0
+    # master 自己的时间线记录了发出的 STOP
+    assert any(e["pid"] == 1 and e["ph"] != "M" for e in trace["traceEvents"])
+
+
+def test_new_report_replaces_the_old_one():
+    store = TraceStore()
+    first, second = Timeline("s1"), Timeline("s1")
+    first.instant("old")
+    second.instant("new")
+    store.add_chunk("peer", first.chunks()[0])
+    # 同一会话再次录像后重新上报
+    assert store.add_chunk("peer", second.chunks()[0]) == ("s1", True)
+    assert [e[0] for e in store.events("s1")["peer"]] == ["new"]
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import socket
+import threading
+
+import pytest
+
+from libs.transfer import (
+    JOURNAL_SUFFIX,
+    OP_CHUNK,
+    OP_COMMIT,
+    OP_QUERY,
+    PART_SUFFIX,
+    RESPONSE,
+    STATUS_CHECKSUM,
+    STATUS_COMPLETE,
+    STATUS_OK,
+    CollectorServer,
+    TransferClient,
+    _PartialFile,
+    chunk_ranges,
+    file_digest,
+    pack_request,
+    parse_address,
+    root_digest,
+)
+
+CHUNK = 64 * 1024
+NAME = "host-a/session-Device0.mkv"
+
+
+@pytest.fixture
+def collector(tmp_path):
+    server = CollectorServer(str(tmp_path / "collected"), "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / "session-Device0.mkv"
+    path.write_bytes(os.urandom(5 * CHUNK + 123))
+    return str(path)
+
+
+def client(server):
+    return TransferClient(*server.server_address[:2], connections=3, chunk_size=CHUNK)
+
+
+def test_chunk_ranges():
+    assert chunk_ranges(0, CHUNK) == [(0, 0)]
+    assert chunk_ranges(2 * CHUNK + 1, CHUNK) == [(0, CHUNK), (CHUNK, CHUNK), (2 * CHUNK, 1)]
+
+
+def test_file_digest_is_root_of_chunk_digests(recording):
+    data = open(recording, "rb").read()
+    digests = [hashlib.sha256(data[o : o + n]).digest() for o, n in chunk_ranges(len(data), CHUNK)]
+    assert file_digest(recording, CHUNK) == root_digest(digests).hex()
+
+
+def test_parse_address():
+    assert parse_address("collector", 4330) == ("collector", 4330)
+    assert parse_address("10.0.0.2:5000", 4330) == ("10.0.0.2", 5000)
+    assert parse_address("[fe80::1]:5000", 4330) == ("fe80::1", 5000)
+    assert parse_address("fe80::1", 4330) == ("fe80::1", 4330)
+
+
+def test_transfer_and_skip_complete(collector, recording):
+    report = client(collector).send_files([(recording, NAME)])
+    assert (report.files, report.failed, report.bytes) == (1, [], os.path.getsize(recording))
+    received = collector.local_path(NAME)
+    assert open(received, "rb").read() == open(recording, "rb").read()
+    assert not os.path.exists(received + PART_SUFFIX) and not os.path.exists(received + JOURNAL_SUFFIX)
+
+    assert report.done == [NAME]
+
+    again = client(collector).send_files([(recording, NAME)])
+    assert (again.files, again.skipped, again.bytes) == (0, 1, 0)
+    assert again.done == [NAME]
+
+
+def test_same_size_but_different_file_is_sent_again(collector, recording, tmp_path):
+    client(collector).send_files([(recording, NAME)])
+    # 同名同大小但内容不同 (例如重用了会话名)，不能当作已收齐
+    other = tmp_path / "other.mkv"
+    other.write_bytes(os.urandom(os.path.getsize(recording)))
+    report = client(collector).send_files([(str(other), NAME)])
+    assert (report.files, report.skipped, report.done) == (1, 0, [NAME])
+    assert open(collector.local_path(NAME), "rb").read() == other.read_bytes()
+
+
+def test_query_compares_digest(collector, recording):
+    client(collector).send_files([(recording, NAME)])
+    size = os.path.getsize(recording)
+    digest = bytes.fromhex(file_digest(recording, CHUNK))
+    assert request(collector, pack_request(OP_QUERY, NAME, size, length=CHUNK, digest=digest)) == STATUS_COMPLETE
+    # 旧版本发送端不带校验和，只比较大小
+    assert request(collector, pack_request(OP_QUERY, NAME, size, length=CHUNK)) == STATUS_COMPLETE
+    wrong = root_digest([hashlib.sha256(b"other").digest()])
+    assert request(collector, pack_request(OP_QUERY, NAME, size, length=CHUNK, digest=wrong)) == STATUS_OK
+    # 另一种块大小的校验和按需重新计算
+    other = bytes.fromhex(file_digest(recording, 2 * CHUNK))
+    assert request(collector, pack_request(OP_QUERY, NAME, size, length=2 * CHUNK, digest=other)) == STATUS_COMPLETE
+
+
+def test_resume_sends_only_missing_chunks(collector, recording):
+    data = open(recording, "rb").read()
+    # 模拟上次中断: 收集端的部分文件和进度日志里已有前两块
+    partial = _PartialFile(collector.local_path(NAME), len(data))
+    with open(partial.part_path, "r+b") as f:
+        for offset, length in chunk_ranges(len(data), CHUNK)[:2]:
+            f.seek(offset)
+            f.write(data[offset : offset + length])
+            partial.record(offset, length, hashlib.sha256(data[offset : offset + length]).digest())
+
+    report = client(collector).send_files([(recording, NAME)])
+    assert report.files == 1 and not report.failed
+    assert report.resumed_bytes == 2 * CHUNK
+    assert report.bytes == len(data) - 2 * CHUNK
+    assert open(collector.local_path(NAME), "rb").read() == data
+
+
+def request(server, packet, payload=b""):
+    with socket.create_connection(server.server_address[:2]) as sock:
+        sock.sendall(packet + payload)
+        status, _ = RESPONSE.unpack(sock.recv(RESPONSE.size, socket.MSG_WAITALL))
+        return status
+
+
+def test_corrupted_chunk_and_wrong_commit_are_rejected(collector):
+    payload = os.urandom(1000)
+    digest = hashlib.sha256(payload).digest()
+    corrupted = bytes([payload[0] ^ 1]) + payload[1:]
+    assert request(collector, pack_request(OP_CHUNK, NAME, 1000, 0, 1000, digest), corrupted) == STATUS_CHECKSUM
+    assert request(collector, pack_request(OP_CHUNK, NAME, 1000, 0, 1000, digest), payload) == STATUS_OK
+
+    wrong = root_digest([hashlib.sha256(b"other").digest()])
+    assert request(collector, pack_request(OP_COMMIT, NAME, 1000, digest=wrong)) == STATUS_CHECKSUM
+    path = collector.local_path(NAME)
+    assert not os.path.exists(path) and not os.path.exists(path + PART_SUFFIX)
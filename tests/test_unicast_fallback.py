@@ -0,0 +1,64 @@
+from libs.controlplane import PATH_MULTICAST, PATH_UNICAST
+from libs.protocol import CMD_STOP
+
+from tests.conftest import wait_for
+
+
+def test_unicast_fallback_and_back(rig):
+    deaf, healthy = rig.add_slave(), rig.add_slave()
+    for slave in (deaf, healthy):
+        slave.on(CMD_STOP, lambda command, slave=slave: slave.reply(command, 0, CMD_STOP, "stopped"))
+    master = rig.start()
+    link = rig.link(deaf)
+    deaf_peer, healthy_peer = rig.peer(deaf), rig.peer(healthy)
+
+    def stop():
+        assert len(master.send_stop(timeout=2, expected=2).result()) == 2
+        # 等待送达任务记录路径 (ACK 之后)
+        assert wait_for(lambda: not master._acks)
+
+    # 该 slave 收不到组播，命令靠单播重传送达
+    link.fault = lambda command, path: 0 if path == "multicast" else 1
+    stop()
+    assert master.slaves[deaf_peer].path == PATH_MULTICAST
+    assert master.slaves[deaf_peer].multicast_misses == 1
+    stop()
+    assert master.slaves[deaf_peer].path == PATH_UNICAST
+    assert master.slaves[healthy_peer].path == PATH_MULTICAST
+
+    # 单播路径上的命令与组播同时发出，不再等待重传
+    unicast_before = link.count(CMD_STOP, "unicast")
+    stop()
+    assert link.count(CMD_STOP, "unicast") == unicast_before + 1
+    rows = {row["peer"]: row for row in master.path_table()}
+    assert rows[deaf_peer]["path"] == PATH_UNICAST and rows[deaf_peer]["unicast_count"] == 3
+    assert rows[healthy_peer]["multicast_count"] == 3 and rows[healthy_peer]["unicast_count"] == 0
+
+    # 组播恢复后，连续 multicast_restore_after 次探测有回复才切回纯组播
+    link.fault = None
+    for probe in range(1, master.multicast_restore_after + 1):
+        assert len(master.send_ping(timeout=1, expected=2).result()) == 2
+        expected = PATH_MULTICAST if probe == master.multicast_restore_after else PATH_UNICAST
+        assert master.slaves[deaf_peer].path == expected
+    assert master.slaves[deaf_peer].multicast_misses == 0
+
+    unicast_before = link.count(CMD_STOP, "unicast")
+    stop()
+    assert link.count(CMD_STOP, "unicast") == unicast_before
+    assert master.slaves[deaf_peer].path == PATH_MULTICAST
+
+
+def test_late_multicast_keeps_the_path(rig):
+    slow = rig.add_slave()
+    slow.on(CMD_STOP, lambda command: slow.reply(command, 0, CMD_STOP, "stopped"))
+    master = rig.start()
+
+    # 第一份组播丢失但此后送达：偶发丢包只计一次，不切换路径
+    rig.link(slow).drop_first(CMD_STOP, 1, path="multicast")
+    for _ in range(3):
+        assert len(master.send_stop(timeout=2, expected=1).result()) == 1
+        assert wait_for(lambda: not master._acks)
+    state = master.slaves[rig.peer(slow)]
+    assert state.path == PATH_MULTICAST
+    assert state.multicast_misses == 0
+    assert (state.unicast_ack.count, state.multicast_ack.count) == (1, 2)